@@ -10,6 +10,7 @@ let messages = new Map(); // 存储每个对话的消息
 let quotedMessage = null; // 当前被引用的消息
 let currentReadDetailMessage = null; // 当前正在显示阅读详情的消息
 let unreadCounts = new Map(); // 存储每个联系人的未读消息数量 {username: count}
+let historyCursors = new Map(); // 历史消息分页游标 {chatKey: {hasMore, beforeTimestamp, beforeSeq, loading}}
 
 // 用户ID管理
 function generateUserId() {
@@ -168,12 +169,17 @@ function connectWebSocket() {
     const wsUrl = `${protocol}//${window.location.host}/ws`;
 
     ws = new WebSocket(wsUrl);
+    ws.binaryType = 'arraybuffer';
 
     ws.onopen = () => {
         console.log('WebSocket 连接已建立');
     };
 
     ws.onmessage = (event) => {
+        if (event.data instanceof ArrayBuffer) {
+            handleMediaFrame(event.data);
+            return;
+        }
         const data = JSON.parse(event.data);
         handleMessage(data);
     };
@@ -212,12 +218,42 @@ function handleMessage(data) {
             // 接收群组历史消息
             receiveHistoryGroupMessage(data);
             break;
+        case 'history_batch':
+            // 分块打包的历史/离线消息，逐条按原类型处理
+            (data.messages || []).forEach(item => handleMessage(item));
+            break;
+        case 'history_sync':
+            // 登录时的分页游标（哪些会话还有更早的消息）
+            onHistorySync(data);
+            break;
+        case 'history_page':
+            // 分页拉取到的更早消息
+            onHistoryPage(data);
+            break;
+        case 'media_upload_complete':
+        case 'media_upload_error':
+        case 'media_download_error':
+            onMediaTransferResult(data);
+            break;
+        case 'bot_job_status':
+            // 机器人任务状态：processing（已受理）/ progress（分段进度）/ rejected / cancelled
+            onBotJobStatus(data);
+            break;
+        case 'bot_message_delta':
+            // 机器人回复的流式片段，边生成边显示
+            onBotMessageDelta(data);
+            break;
         case 'new_message':
             // 如果是机器人回复，显示在结果区域
-            if (data.from === 'AI总结Bot' && currentChatWith === 'AI总结Bot') {
+            if (data.from === 'AI总结Bot' && currentChatWith === 'AI总结Bot' && botResultContent) {
                 botResultContent.textContent = data.content;
                 botResultArea.style.display = 'block';
             } else {
+                // 流式显示的临时气泡换成最终消息
+                if (data.job_id) {
+                    botJobs.delete(data.job_id);
+                }
+                removeBotStreamBubble(data);
                 receiveMessage(data);
             }
             break;
@@ -231,7 +267,11 @@ function handleMessage(data) {
             addContact(data.username);
             break;
         case 'user_offline':
-            removeContact(data.username);
+            onUserOffline(data.username);
+            break;
+        case 'users_offline':
+            // 同一时间断开的多个用户合并为一条通知
+            data.usernames.forEach(onUserOffline);
             break;
         case 'group_created':
             onGroupCreated(data);
@@ -393,6 +433,14 @@ function removeContact(username) {
     }
 }
 
+// 用户离线：更新联系人状态，并结束和他的视频通话（服务器不再单独发送挂断信令）
+function onUserOffline(username) {
+    removeContact(username);
+    if (peerConnections.has(username) || (videoCallType === 'user' && videoCallTarget === username)) {
+        handleVideoEnd({from: username});
+    }
+}
+
 // 设置联系人在线/离线状态
 function setContactOnlineStatus(username, isOnline) {
     const contactItem = contactsList.querySelector(`[data-username="${username}"]`);
@@ -478,6 +526,17 @@ function loadChatHistory(chatWith) {
             </div>
         `;
     } else {
+        // 还有更早的消息时，在顶部显示"加载更早的消息"
+        const cursor = historyCursors.get(chatKey);
+        if (cursor && cursor.hasMore) {
+            const loadMoreBtn = document.createElement('div');
+            loadMoreBtn.className = 'load-more-history';
+            loadMoreBtn.textContent = cursor.loading ? '加载中...' : '加载更早的消息';
+            loadMoreBtn.style.cssText = 'text-align: center; color: #999; font-size: 13px; padding: 8px; cursor: pointer;';
+            loadMoreBtn.onclick = () => requestOlderHistory(chatKey);
+            messagesContainer.appendChild(loadMoreBtn);
+        }
+
         chatMessages.forEach(msg => {
             displayMessage(msg);
 
@@ -489,9 +548,100 @@ function loadChatHistory(chatWith) {
     }
 }
 
-// 获取聊天记录的 key
+// 历史消息分页游标的 key（与 messages 的 key 一致）
+function getHistoryChatKey(chatType, chat) {
+    return chatType === 'group' ? chat : getChatKey(currentUser, chat);
+}
+
+// 登录时收到各会话的分页游标
+function onHistorySync(data) {
+    (data.conversations || []).forEach(conv => {
+        historyCursors.set(getHistoryChatKey(conv.chat_type, conv.chat), {
+            chatType: conv.chat_type,
+            chat: conv.chat,
+            hasMore: conv.has_more,
+            beforeTimestamp: conv.before_timestamp,
+            beforeSeq: conv.before_seq,
+            loading: false
+        });
+    });
+
+    // 如果已经打开了某个会话，刷新以显示"加载更早的消息"
+    if (currentChatWith) {
+        loadChatHistory(currentChatWith);
+    }
+}
+
+// 请求更早的一页历史消息
+function requestOlderHistory(chatKey) {
+    const cursor = historyCursors.get(chatKey);
+    if (!cursor || !cursor.hasMore || cursor.loading) return;
+
+    cursor.loading = true;
+    ws.send(JSON.stringify({
+        type: 'history_request',
+        chat_type: cursor.chatType,
+        chat: cursor.chat,
+        before_timestamp: cursor.beforeTimestamp,
+        before_seq: cursor.beforeSeq
+    }));
+}
+
+// 收到更早的一页历史消息，插入到会话开头
+function onHistoryPage(data) {
+    const chatKey = getHistoryChatKey(data.chat_type, data.chat);
+    historyCursors.set(chatKey, {
+        chatType: data.chat_type,
+        chat: data.chat,
+        hasMore: data.has_more,
+        beforeTimestamp: data.before_timestamp,
+        beforeSeq: data.before_seq,
+        loading: false
+    });
+
+    mergeHistoryMessages(chatKey, data.messages || [], true);
+
+    if (currentChatWith && getHistoryChatKey(currentChatType === 'group' ? 'group' : 'private', currentChatWith) === chatKey) {
+        // 保持滚动位置，不跳到底部
+        const previousHeight = messagesContainer.scrollHeight;
+        loadChatHistory(currentChatWith);
+        messagesContainer.scrollTop = messagesContainer.scrollHeight - previousHeight;
+    }
+}
+
+// 消息的去重 key：同一发送者、同一时间戳视为同一条消息
+function messageIdentity(msg) {
+    return `${msg.from}|${msg.timestamp}`;
+}
+
+// 把服务器发来的历史消息合并进会话，已经有的消息（重连后再次推送、重复的分页）跳过
+// prepend 为 true 时放在会话开头（更早的一页），否则追加到末尾
+function mergeHistoryMessages(chatKey, items, prepend) {
+    const existing = messages.get(chatKey) || [];
+    const seen = new Set(existing.map(messageIdentity));
+    const added = items.filter(msg => {
+        const key = messageIdentity(msg);
+        if (seen.has(key)) return false;
+        seen.add(key);
+        return true;
+    });
+    messages.set(chatKey, prepend ? added.concat(existing) : existing.concat(added));
+}
+
+// 按 Unicode 码点比较字符串（与 Python 的排序一致；JS 默认按 UTF-16 码元比较，emoji 等字符顺序会不同）
+function compareCodePoints(a, b) {
+    const x = Array.from(a, c => c.codePointAt(0));
+    const y = Array.from(b, c => c.codePointAt(0));
+    for (let i = 0; i < Math.min(x.length, y.length); i++) {
+        if (x[i] !== y[i]) return x[i] - y[i];
+    }
+    return x.length - y.length;
+}
+
+// 获取聊天记录的 key：与服务器 get_chat_key 相同，排序后的 JSON 数组（如 ["alice","bob"]）
+// 不用 '_' 拼接，用户名中含 '_' 时不会冲突（'a_b'+'c' 与 'a'+'b_c'）
 function getChatKey(user1, user2) {
-    return [user1, user2].sort().join('_');
+    return JSON.stringify([user1, user2].sort(compareCodePoints));
 }
 
 // 发送消息
@@ -588,63 +738,193 @@ function sendMessage() {
     cancelQuote(); // 清除引用
 }
 
-// 发送图片
-function sendImage(file) {
-    if (!currentChatWith) return;
+// 媒体文件通过 WebSocket 二进制帧分块传输
+// 帧格式: op(1) | flags(1) | transfer_id(4) | chunk_index(4) | type_len(2) | content_type | payload（大端序）
+const MEDIA_OP_UPLOAD = 1;
+const MEDIA_OP_DOWNLOAD = 2;
+const MEDIA_FLAG_LAST = 1;
+const MEDIA_HEADER_SIZE = 12;
+const MEDIA_CHUNK_SIZE = 64 * 1024;
+const MEDIA_MAX_BUFFERED = 1024 * 1024; // 发送缓冲超过 1MB 时等待
+let mediaTransferCounter = 0;
+const pendingMediaTransfers = new Map(); // {transferId: {resolve, reject, chunks, contentType}}
+const mediaObjectUrls = new Map(); // {blobId: objectURL} - 已下载的媒体文件
+
+function encodeMediaFrame(op, transferId, chunkIndex, payload, contentType, last) {
+    const typeBytes = new TextEncoder().encode(contentType || '');
+    const frame = new Uint8Array(MEDIA_HEADER_SIZE + typeBytes.length + payload.byteLength);
+    const view = new DataView(frame.buffer);
+    view.setUint8(0, op);
+    view.setUint8(1, last ? MEDIA_FLAG_LAST : 0);
+    view.setUint32(2, transferId);
+    view.setUint32(6, chunkIndex);
+    view.setUint16(10, typeBytes.length);
+    frame.set(typeBytes, MEDIA_HEADER_SIZE);
+    frame.set(new Uint8Array(payload), MEDIA_HEADER_SIZE + typeBytes.length);
+    return frame;
+}
+
+function decodeMediaFrame(buffer) {
+    const view = new DataView(buffer);
+    const typeLength = view.getUint16(10);
+    const bodyStart = MEDIA_HEADER_SIZE + typeLength;
+    return {
+        op: view.getUint8(0),
+        last: (view.getUint8(1) & MEDIA_FLAG_LAST) !== 0,
+        transferId: view.getUint32(2),
+        chunkIndex: view.getUint32(6),
+        contentType: new TextDecoder().decode(new Uint8Array(buffer, MEDIA_HEADER_SIZE, typeLength)),
+        payload: new Uint8Array(buffer, bodyStart)
+    };
+}
 
-    const reader = new FileReader();
-    reader.onload = (e) => {
-        let message, chatKey;
+// 收到二进制下载帧
+function handleMediaFrame(buffer) {
+    const frame = decodeMediaFrame(buffer);
+    const transfer = pendingMediaTransfers.get(frame.transferId);
+    if (frame.op !== MEDIA_OP_DOWNLOAD || !transfer) return;
 
-        if (currentChatType === 'group') {
-            // 群聊图片
-            message = {
-                type: 'send_group_message',
-                group_id: currentChatWith,
-                content: e.target.result,
-                content_type: 'image',
-                timestamp: Date.now()
-            };
-            chatKey = currentChatWith;
-        } else {
-            // 私聊图片
-            message = {
-                type: 'send_message',
-                to: currentChatWith,
-                content: e.target.result,
-                content_type: 'image',
-                timestamp: Date.now()
-            };
-            chatKey = getChatKey(currentUser, currentChatWith);
-        }
+    if (frame.chunkIndex === 0) {
+        transfer.contentType = frame.contentType;
+    }
+    transfer.chunks.push(frame.payload);
+    if (frame.last) {
+        pendingMediaTransfers.delete(frame.transferId);
+        transfer.resolve(new Blob(transfer.chunks, { type: transfer.contentType }));
+    }
+}
 
-        ws.send(JSON.stringify(message));
+// 上传/下载结果（文本帧）
+function onMediaTransferResult(data) {
+    const transfer = pendingMediaTransfers.get(data.transfer_id);
+    if (!transfer) return;
+    pendingMediaTransfers.delete(data.transfer_id);
+    if (data.type === 'media_upload_complete') {
+        transfer.resolve(data);
+    } else {
+        transfer.reject(new Error(data.message || '传输失败'));
+    }
+}
 
-        // 添加到本地消息列表
-        if (!messages.has(chatKey)) {
-            messages.set(chatKey, []);
+function startMediaTransfer() {
+    const transferId = ++mediaTransferCounter;
+    const done = new Promise((resolve, reject) => {
+        pendingMediaTransfers.set(transferId, { resolve, reject, chunks: [], contentType: '' });
+    });
+    return { transferId, done };
+}
+
+// 上传媒体文件（图片/语音），返回 {blob_id, url, size, content_type}
+async function uploadBlob(blob, fallbackType) {
+    const contentType = blob.type || fallbackType;
+    if (!ws || ws.readyState !== WebSocket.OPEN) {
+        // 连接不可用时使用 HTTP 上传
+        // 服务器只接受已注册用户的上传（用户名 URL 编码，HTTP 头不能直接带中文）
+        const response = await fetch('/api/blobs', {
+            method: 'POST',
+            headers: {
+                'Content-Type': contentType,
+                'X-Chat-User': encodeURIComponent(currentUser),
+                'X-Chat-User-Id': currentUserId
+            },
+            body: blob
+        });
+        const result = await response.json();
+        if (!response.ok) {
+            throw new Error(result.error || '上传失败');
         }
+        return result;
+    }
 
-        // 如果是群聊，添加阅读状态字段
-        let messageWithStatus = {
-            ...message,
-            from: currentUser,
-            read: false
+    const { transferId, done } = startMediaTransfer();
+    const chunkCount = Math.max(1, Math.ceil(blob.size / MEDIA_CHUNK_SIZE));
+    for (let i = 0; i < chunkCount; i++) {
+        while (ws.bufferedAmount > MEDIA_MAX_BUFFERED) {
+            await new Promise(resolve => setTimeout(resolve, 20));
+        }
+        const chunk = await blob.slice(i * MEDIA_CHUNK_SIZE, (i + 1) * MEDIA_CHUNK_SIZE).arrayBuffer();
+        ws.send(encodeMediaFrame(MEDIA_OP_UPLOAD, transferId, i, chunk, i === 0 ? contentType : '', i === chunkCount - 1));
+    }
+    return done;
+}
+
+// 下载媒体文件，返回可播放/显示的地址
+async function getMediaUrl(url, blobId) {
+    if (!blobId || !ws || ws.readyState !== WebSocket.OPEN) {
+        return url;
+    }
+    if (!mediaObjectUrls.has(blobId)) {
+        const { transferId, done } = startMediaTransfer();
+        ws.send(JSON.stringify({ type: 'media_download', blob_id: blobId, transfer_id: transferId }));
+        mediaObjectUrls.set(blobId, URL.createObjectURL(await done));
+    }
+    return mediaObjectUrls.get(blobId);
+}
+
+// 发送图片
+async function sendImage(file) {
+    if (!currentChatWith) return;
+
+    let uploaded;
+    try {
+        uploaded = await uploadBlob(file, 'image/png');
+    } catch (error) {
+        console.error('上传图片失败:', error);
+        alert('上传图片失败：' + error.message);
+        return;
+    }
+
+    let message, chatKey;
+
+    if (currentChatType === 'group') {
+        // 群聊图片
+        message = {
+            type: 'send_group_message',
+            group_id: currentChatWith,
+            content: uploaded.url,
+            blob_id: uploaded.blob_id,
+            content_type: 'image',
+            timestamp: Date.now()
+        };
+        chatKey = currentChatWith;
+    } else {
+        // 私聊图片
+        message = {
+            type: 'send_message',
+            to: currentChatWith,
+            content: uploaded.url,
+            blob_id: uploaded.blob_id,
+            content_type: 'image',
+            timestamp: Date.now()
         };
+        chatKey = getChatKey(currentUser, currentChatWith);
+    }
 
-        if (currentChatType === 'group') {
-            const group = groups.get(currentChatWith);
-            const groupMembers = group ? group.members : [];
-            messageWithStatus.read_by = [currentUser];
-            messageWithStatus.unread_members = groupMembers.filter(m => m !== currentUser);
-        }
+    ws.send(JSON.stringify(message));
 
-        messages.get(chatKey).push(messageWithStatus);
+    // 添加到本地消息列表
+    if (!messages.has(chatKey)) {
+        messages.set(chatKey, []);
+    }
 
-        // 显示消息
-        displayMessage(messageWithStatus);
+    // 如果是群聊，添加阅读状态字段
+    let messageWithStatus = {
+        ...message,
+        from: currentUser,
+        read: false
     };
-    reader.readAsDataURL(file);
+
+    if (currentChatType === 'group') {
+        const group = groups.get(currentChatWith);
+        const groupMembers = group ? group.members : [];
+        messageWithStatus.read_by = [currentUser];
+        messageWithStatus.unread_members = groupMembers.filter(m => m !== currentUser);
+    }
+
+    messages.get(chatKey).push(messageWithStatus);
+
+    // 显示消息
+    displayMessage(messageWithStatus);
 }
 
 // 接收历史消息（登录时加载）
@@ -653,10 +933,7 @@ function receiveHistoryMessage(data) {
     const chatPartner = data.from === currentUser ? data.to : data.from;
     const chatKey = getChatKey(currentUser, chatPartner);
 
-    if (!messages.has(chatKey)) {
-        messages.set(chatKey, []);
-    }
-    messages.get(chatKey).push(data);
+    mergeHistoryMessages(chatKey, [data], false);
     // 历史消息不显示，只存储到内存
 }
 
@@ -664,13 +941,107 @@ function receiveHistoryMessage(data) {
 function receiveHistoryGroupMessage(data) {
     const chatKey = data.group_id;
 
-    if (!messages.has(chatKey)) {
-        messages.set(chatKey, []);
-    }
-    messages.get(chatKey).push(data);
+    mergeHistoryMessages(chatKey, [data], false);
     // 历史消息不显示，只存储到内存
 }
 
+// 机器人正在处理的任务 {job_id: timestamp}
+const botJobs = new Map();
+
+// 机器人回复的临时气泡（状态提示和流式片段），最终消息到达后被替换
+function getBotStreamBubble(data) {
+    let bubble = messagesContainer.querySelector(`.message.streaming[data-timestamp="${data.timestamp}"]`);
+    if (!bubble) {
+        displayMessage({ from: data.from, to: data.to, content: '', content_type: 'text', timestamp: data.timestamp });
+        bubble = messagesContainer.querySelector(`.message[data-timestamp="${data.timestamp}"]:last-child`);
+        if (!bubble) return null;
+        bubble.classList.add('streaming');
+    }
+    return bubble;
+}
+
+function setBotStreamText(data, text, placeholder) {
+    if (currentChatWith !== data.from) return;
+
+    if (botResultContent) {
+        botResultContent.dataset.streamTimestamp = placeholder ? '' : data.timestamp;
+        botResultContent.textContent = text;
+        botResultArea.style.display = 'block';
+        return;
+    }
+
+    const bubble = getBotStreamBubble(data);
+    if (!bubble) return;
+    bubble.querySelector('.message-content > div:last-child').textContent = text;
+    bubble.dataset.placeholder = placeholder ? '1' : '';
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+}
+
+function onBotJobStatus(data) {
+    if (data.status === 'processing') {
+        botJobs.set(data.job_id, data.timestamp);
+        setBotStreamText(data, '⏳ 正在处理...', true);
+
+        // 处理中的气泡带一个取消按钮
+        const bubble = messagesContainer.querySelector(`.message.streaming[data-timestamp="${data.timestamp}"]`);
+        if (bubble && !bubble.querySelector('.bot-cancel-btn')) {
+            const cancelBtn = document.createElement('button');
+            cancelBtn.className = 'bot-cancel-btn';
+            cancelBtn.textContent = '取消';
+            cancelBtn.style.cssText = 'font-size: 11px; padding: 3px 8px; margin-left: 8px; background: #f0f0f0; border: 1px solid #ddd; border-radius: 4px; color: #666; cursor: pointer;';
+            cancelBtn.onclick = () => cancelBotJob(data.job_id);
+            bubble.appendChild(cancelBtn);
+        }
+    } else if (data.status === 'progress') {
+        // 长文本分段总结的进度
+        setBotStreamText(data, `⏳ 正在分段总结 (${data.done}/${data.total})...`, true);
+    } else if (data.status === 'rejected') {
+        setBotStreamText(data, data.message, true);
+    } else if (data.status === 'cancelled') {
+        botJobs.delete(data.job_id);
+        removeBotStreamBubble(data);
+    }
+}
+
+// 取消正在处理的机器人任务
+function cancelBotJob(jobId) {
+    if (ws && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({ type: 'cancel_bot_job', job_id: jobId }));
+    }
+}
+
+// 机器人流式回复：同一条回复的片段带相同的 timestamp，最终消息以 new_message 送达
+function onBotMessageDelta(data) {
+    if (currentChatWith !== data.from) return;
+
+    if (botResultContent) {
+        if (botResultContent.dataset.streamTimestamp !== String(data.timestamp)) {
+            botResultContent.dataset.streamTimestamp = data.timestamp;
+            botResultContent.textContent = '';
+        }
+        botResultContent.textContent += data.delta;
+        botResultArea.style.display = 'block';
+        return;
+    }
+
+    const bubble = getBotStreamBubble(data);
+    if (!bubble) return;
+    const textDiv = bubble.querySelector('.message-content > div:last-child');
+    if (bubble.dataset.placeholder === '1') {
+        textDiv.textContent = '';
+        bubble.dataset.placeholder = '';
+    }
+    textDiv.textContent += data.delta;
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+}
+
+function removeBotStreamBubble(data) {
+    const bubble = messagesContainer.querySelector(`.message.streaming[data-timestamp="${data.timestamp}"]`);
+    if (bubble) {
+        bubble.remove();
+    }
+}
+
 // 接收消息
 function receiveMessage(data) {
     const chatKey = getChatKey(currentUser, data.from);
@@ -798,6 +1169,7 @@ function displayMessage(msg) {
     // 添加实际的消息内容
     if (msg.content_type === 'image') {
         const img = document.createElement('img');
+        img.loading = 'lazy';
         img.src = msg.content;
         contentDiv.appendChild(img);
     } else if (msg.content_type === 'voice') {
@@ -826,7 +1198,7 @@ function displayMessage(msg) {
 
         // 点击播放语音
         playBtn.onclick = () => {
-            playVoiceMessage(msg.content, playBtn, voiceInfo);
+            playVoiceMessage(msg.content, playBtn, voiceInfo, msg.blob_id);
         };
 
         contentDiv.appendChild(voiceDiv);
@@ -2381,85 +2753,82 @@ sendVoiceBtn.addEventListener('click', async () => {
     }
 
     try {
-        // 转换为base64
-        const reader = new FileReader();
-        reader.onloadend = () => {
-            console.log('音频已转换为base64');
-            const base64Audio = reader.result.split(',')[1];
-            const duration = parseInt(previewDuration.textContent.split(':')[0]) * 60 +
-                           parseInt(previewDuration.textContent.split(':')[1]);
-
-            // 发送语音消息
-            let message, chatKey;
-
-            if (currentChatType === 'group') {
-                // 群聊语音消息
-                message = {
-                    type: 'send_group_message',
-                    group_id: currentChatWith,
-                    content: base64Audio,
-                    content_type: 'voice',
-                    duration: duration,
-                    timestamp: Date.now(),
-                    from: currentUser  // 添加from字段
-                };
-                chatKey = currentChatWith;
-
-                // 确保messages Map中有这个群的数组
-                if (!messages.has(chatKey)) {
-                    messages.set(chatKey, []);
-                }
+        // 上传录音文件，消息里只发送文件引用
+        const uploaded = await uploadBlob(recordedAudioBlob, 'audio/webm');
+        console.log('语音已上传:', uploaded.blob_id);
+        const duration = parseInt(previewDuration.textContent.split(':')[0]) * 60 +
+                       parseInt(previewDuration.textContent.split(':')[1]);
 
-                messages.get(chatKey).push({
-                    ...message,
-                    from: currentUser,
-                    group_id: currentChatWith,
-                    read_by: [currentUser],
-                    unread_members: groups.get(currentChatWith)?.members.filter(m => m !== currentUser) || []
-                });
-            } else {
-                // 私聊语音消息
-                message = {
-                    type: 'send_message',
-                    to: currentChatWith,
-                    content: base64Audio,
-                    content_type: 'voice',
-                    duration: duration,
-                    timestamp: Date.now(),
-                    from: currentUser  // 添加from字段
-                };
-                chatKey = getChatKey(currentUser, currentChatWith);
-            }
+        // 发送语音消息
+        let message, chatKey;
 
-            // 发送到服务器
-            console.log('准备发送消息到服务器:', message);
-            ws.send(JSON.stringify(message));
-            console.log('消息已发送到服务器');
-
-            // 显示语音消息
-            console.log('准备显示语音消息');
-            console.log('message对象:', message);
-            console.log('合并后的对象:', {...message, from: currentUser});
-            displayMessage({...message, from: currentUser});
-            console.log('语音消息已显示');
-
-            // 清理并恢复界面
-            if (previewAudio) {
-                previewAudio.pause();
-                previewAudio = null;
-            }
+        if (currentChatType === 'group') {
+            // 群聊语音消息
+            message = {
+                type: 'send_group_message',
+                group_id: currentChatWith,
+                content: uploaded.url,
+                blob_id: uploaded.blob_id,
+                content_type: 'voice',
+                duration: duration,
+                timestamp: Date.now(),
+                from: currentUser  // 添加from字段
+            };
+            chatKey = currentChatWith;
 
-            if (recordedAudioUrl) {
-                URL.revokeObjectURL(recordedAudioUrl);
-                recordedAudioUrl = null;
+            // 确保messages Map中有这个群的数组
+            if (!messages.has(chatKey)) {
+                messages.set(chatKey, []);
             }
 
-            recordedAudioBlob = null;
-            voicePreview.classList.remove('active');
-            inputArea.style.display = 'flex';
-        };
+            messages.get(chatKey).push({
+                ...message,
+                from: currentUser,
+                group_id: currentChatWith,
+                read_by: [currentUser],
+                unread_members: groups.get(currentChatWith)?.members.filter(m => m !== currentUser) || []
+            });
+        } else {
+            // 私聊语音消息
+            message = {
+                type: 'send_message',
+                to: currentChatWith,
+                content: uploaded.url,
+                blob_id: uploaded.blob_id,
+                content_type: 'voice',
+                duration: duration,
+                timestamp: Date.now(),
+                from: currentUser  // 添加from字段
+            };
+            chatKey = getChatKey(currentUser, currentChatWith);
+        }
+
+        // 发送到服务器
+        console.log('准备发送消息到服务器:', message);
+        ws.send(JSON.stringify(message));
+        console.log('消息已发送到服务器');
+
+        // 显示语音消息
+        console.log('准备显示语音消息');
+        console.log('message对象:', message);
+        console.log('合并后的对象:', {...message, from: currentUser});
+        displayMessage({...message, from: currentUser});
+        console.log('语音消息已显示');
+
+        // 清理并恢复界面
+        if (previewAudio) {
+            previewAudio.pause();
+            previewAudio = null;
+        }
 
-        reader.readAsDataURL(recordedAudioBlob);
+        if (recordedAudioUrl) {
+            URL.revokeObjectURL(recordedAudioUrl);
+            recordedAudioUrl = null;
+        }
+
+        recordedAudioBlob = null;
+        voicePreview.classList.remove('active');
+        inputArea.style.display = 'flex';
 
     } catch (error) {
         console.error('发送语音消息失败:', error);
@@ -2471,7 +2840,7 @@ sendVoiceBtn.addEventListener('click', async () => {
 let currentPlayingAudio = null;
 let currentPlayingBtn = null;
 
-function playVoiceMessage(base64Audio, playBtn, voiceInfo) {
+async function playVoiceMessage(base64Audio, playBtn, voiceInfo, blobId) {
     // 如果当前有正在播放的语音，先停止
     if (currentPlayingAudio && !currentPlayingAudio.paused) {
         currentPlayingAudio.pause();
@@ -2503,8 +2872,17 @@ function playVoiceMessage(base64Audio, playBtn, voiceInfo) {
         return;
     }
 
-    // 创建音频对象
-    const audioUrl = `data:audio/webm;base64,${base64Audio}`;
+    // 创建音频对象（新消息是文件引用，通过二进制帧下载；旧消息是 base64 数据）
+    let audioUrl;
+    try {
+        audioUrl = base64Audio.startsWith('/') || base64Audio.startsWith('data:')
+            ? await getMediaUrl(base64Audio, blobId)
+            : `data:audio/webm;base64,${base64Audio}`;
+    } catch (error) {
+        console.error('下载语音失败:', error);
+        alert('下载语音失败');
+        return;
+    }
     const audio = new Audio(audioUrl);
 
     currentPlayingAudio = audio;
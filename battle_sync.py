@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+3D战场的定时状态同步
+
+原来每收到一条 3d_battle_move 就立即转发给所有其他玩家，流量是 O(玩家数² × 移动频率)。
+现在移动消息只更新服务器上的位置，由固定频率（默认 20Hz）的 tick 统一下发：
+- 每个 tick 给每个玩家发一条 3d_battle_state，只包含视野内、上次发送后有变化的玩家位置（增量）
+- 视野用地面网格做空间索引，只查询附近的格子，不用遍历所有玩家
+- 离开视野的玩家放在 removed 里，客户端隐藏；重新进入视野时再发送完整位置
+
+加入时带 binary: true 的客户端改用二进制帧（与媒体帧共用 WebSocket 二进制消息，用第一个字节 op 区分）：
+
+    移动（客户端 -> 服务器）: | op=16 (1) | x (2) | y (2) | z (2) |
+    状态（服务器 -> 客户端）: | op=17 (1) | tick (4) | 更新数 n (2) | 移除数 m (2) |
+                              n × | 玩家 id (2) | x (2) | y (2) | z (2) | + m × | 玩家 id (2) |
+
+整数均为大端序。坐标为定点数（实际值 × POSITION_SCALE 取整，范围约 ±327），
+玩家 id 是本次加入时分配的数字（3d_battle_players_list / 3d_battle_player_joined 里带 id），不再重复发送用户名。
+"""
+
+import asyncio
+import math
+import struct
+import time
+
+OP_BATTLE_MOVE = 16
+OP_BATTLE_STATE = 17
+BATTLE_OPS = (OP_BATTLE_MOVE, OP_BATTLE_STATE)
+
+POSITION_SCALE = 100  # 1 厘米精度
+_COORD_LIMIT = 32767
+MOVE_FRAME = struct.Struct('>Bhhh')
+STATE_HEADER = struct.Struct('>BIHH')
+STATE_ENTRY = struct.Struct('>Hhhh')
+PLAYER_ID = struct.Struct('>H')
+MAX_PLAYER_ID = 0xFFFF
+
+
+class BattleFrameError(Exception):
+    """无效的战场二进制帧"""
+
+
+def quantize(value):
+    q = round(value * POSITION_SCALE)
+    if -_COORD_LIMIT <= q <= _COORD_LIMIT:
+        return q
+    return _COORD_LIMIT if q > 0 else -_COORD_LIMIT
+
+
+def encode_move(position):
+    return MOVE_FRAME.pack(OP_BATTLE_MOVE, quantize(position['x']), quantize(position['y']), quantize(position['z']))
+
+
+def decode_move(data):
+    """解码客户端的二进制移动帧，返回 {x, y, z}"""
+    if len(data) != MOVE_FRAME.size:
+        raise BattleFrameError('移动帧长度不正确')
+    op, x, y, z = MOVE_FRAME.unpack(data)
+    if op != OP_BATTLE_MOVE:
+        raise BattleFrameError(f'不是移动帧: {op}')
+    return {'x': x / POSITION_SCALE, 'y': y / POSITION_SCALE, 'z': z / POSITION_SCALE}
+
+
+def encode_state_entry(player_id, position):
+    return STATE_ENTRY.pack(player_id, quantize(position['x']), quantize(position['y']), quantize(position['z']))
+
+
+def encode_state(tick, entries, removed_ids):
+    """entries 为已编码的 encode_state_entry 列表"""
+    return b''.join((STATE_HEADER.pack(OP_BATTLE_STATE, tick & 0xFFFFFFFF, len(entries), len(removed_ids)),
+                     *entries, *(PLAYER_ID.pack(player_id) for player_id in removed_ids)))
+
+
+def decode_state(data):
+    """解码状态帧，返回 (tick, {玩家 id: {x, y, z}}, [移除的玩家 id])（测试和性能对比用）"""
+    op, tick, count, removed_count = STATE_HEADER.unpack_from(data)
+    if op != OP_BATTLE_STATE:
+        raise BattleFrameError(f'不是状态帧: {op}')
+    players = {}
+    offset = STATE_HEADER.size
+    for _ in range(count):
+        player_id, x, y, z = STATE_ENTRY.unpack_from(data, offset)
+        players[player_id] = {'x': x / POSITION_SCALE, 'y': y / POSITION_SCALE, 'z': z / POSITION_SCALE}
+        offset += STATE_ENTRY.size
+    removed = [PLAYER_ID.unpack_from(data, offset + i * PLAYER_ID.size)[0] for i in range(removed_count)]
+    return tick, players, removed
+
+
+def parse_position(position):
+    """把客户端发来的位置转换为 {x, y, z} 浮点数，无效时返回 None"""
+    if not isinstance(position, dict):
+        return None
+    try:
+        parsed = {axis: float(position.get(axis, 0)) for axis in ('x', 'y', 'z')}
+    except (TypeError, ValueError):
+        return None
+    if not all(math.isfinite(value) for value in parsed.values()):
+        return None
+    return parsed
+
+
+class SpatialGrid:
+    """地面（x/z 平面）上的均匀网格，每个格子记录其中的玩家；y 方向不分格"""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self._cells = {}  # {(cx, cz): set(name)}
+        self._where = {}  # {name: (cx, cz)}
+
+    def _cell(self, position):
+        return (math.floor(position['x'] / self.cell_size), math.floor(position['z'] / self.cell_size))
+
+    def update(self, name, position):
+        cell = self._cell(position)
+        old = self._where.get(name)
+        if old == cell:
+            return
+        if old is not None:
+            self._discard(name, old)
+        self._cells.setdefault(cell, set()).add(name)
+        self._where[name] = cell
+
+    def remove(self, name):
+        cell = self._where.pop(name, None)
+        if cell is not None:
+            self._discard(name, cell)
+
+    def _discard(self, name, cell):
+        members = self._cells[cell]
+        members.discard(name)
+        if not members:
+            del self._cells[cell]
+
+    def query(self, position, radius):
+        """返回可能在 radius 范围内的玩家（按格子粗筛，调用方再按距离精确判断）"""
+        cx, cz = self._cell(position)
+        span = math.ceil(radius / self.cell_size)
+        found = []
+        for x in range(cx - span, cx + span + 1):
+            for z in range(cz - span, cz + span + 1):
+                members = self._cells.get((x, z))
+                if members:
+                    found.extend(members)
+        return found
+
+    def __len__(self):
+        return len(self._where)
+
+
+class BattleSync:
+    """players 为服务器的 battle_3d_players（{username: {position, websocket, binary}}），
+    send(ws, message) 发送一帧（dict 或二进制 bytes）
+
+    tick_rate: 每秒下发次数；view_radius: 视野半径，超出范围的玩家不下发
+    on_tick(tick): 每个 tick 发送完位置之后调用（积分榜等其他需要按 tick 合并下发的状态）
+    """
+
+    def __init__(self, players, send, tick_rate=20, view_radius=40, cell_size=None, on_tick=None):
+        self.players = players
+        self.send = send
+        self.on_tick = on_tick
+        self.tick_rate = tick_rate
+        self.view_radius = view_radius
+        self.grid = SpatialGrid(cell_size or view_radius)
+        self._dirty = set()  # 上个 tick 之后移动过的玩家
+        self._views = {}  # {观察者: {可见玩家: 上次发送的位置}}
+        self.ids = {}  # {username: 玩家 id}
+        self._names = {}  # {玩家 id: username}
+        self._next_id = 1
+        self._tick = 0
+        self._task = None
+        self._stats = {'ticks': 0, 'moves': 0, 'frames_sent': 0, 'positions_sent': 0, 'removals_sent': 0,
+                       'binary_moves': 0, 'binary_frames_sent': 0, 'bytes_sent': 0,
+                       'tick_time_total': 0.0, 'tick_time_max': 0.0, 'late_ticks': 0}
+
+    def _allocate_id(self):
+        if len(self._names) >= MAX_PLAYER_ID:
+            raise RuntimeError('战场玩家 id 已用完')
+        while self._next_id in self._names:
+            self._next_id = self._next_id % MAX_PLAYER_ID + 1
+        player_id = self._next_id
+        self._next_id = self._next_id % MAX_PLAYER_ID + 1
+        return player_id
+
+    def join(self, username):
+        """玩家加入（已写入 players 之后调用），返回分配的玩家 id；下一个 tick 会把视野内的玩家全部发给他"""
+        player = self.players[username]
+        player_id = self.ids.get(username)
+        if player_id is None:
+            player_id = self._allocate_id()
+            self.ids[username] = player_id
+            self._names[player_id] = username
+        self.grid.update(username, player['position'])
+        self._views[username] = {}
+        self._dirty.add(username)
+        return player_id
+
+    def handle_frame(self, username, data):
+        """处理客户端的二进制战场帧（目前只有移动），username 为发送帧的连接加入战场时的玩家名"""
+        if username is None or username not in self.players:
+            raise BattleFrameError('还没有加入战场')
+        self.move(username, decode_move(data))
+        self._stats['binary_moves'] += 1
+
+    def move(self, username, position):
+        """记录最新位置，同一个 tick 内的多次移动只下发最后一次"""
+        player = self.players.get(username)
+        if player is None:
+            return
+        player['position'] = position
+        self.grid.update(username, position)
+        self._dirty.add(username)
+        self._stats['moves'] += 1
+
+    def leave(self, username):
+        """玩家离开（从 players 删除之后调用）；其他玩家通过 3d_battle_player_left 移除他"""
+        self.grid.remove(username)
+        self._views.pop(username, None)
+        player_id = self.ids.pop(username, None)
+        if player_id is not None:
+            del self._names[player_id]
+        self._dirty.discard(username)
+        for view in self._views.values():
+            view.pop(username, None)
+
+    def nearby(self, position, exclude=None):
+        """视野半径内的玩家（攻击、击中动画只发给能看到的人）"""
+        radius_sq = self.view_radius ** 2
+        x, y, z = position['x'], position['y'], position['z']
+        players = self.players
+        names = []
+        for name in self.grid.query(position, self.view_radius):
+            player = players.get(name)
+            if name == exclude or player is None:
+                continue
+            other = player['position']
+            # 每个 tick 对每个观察者都要计算，直接展开距离公式
+            if (other['x'] - x) ** 2 + (other['y'] - y) ** 2 + (other['z'] - z) ** 2 <= radius_sq:
+                names.append(name)
+        return names
+
+    def tick(self):
+        """计算并发送一个 tick 的增量状态"""
+        started_at = time.perf_counter()
+        self._tick += 1
+        dirty = self._dirty
+        self._dirty = set()
+        entries = _StateEntries(self)  # 本 tick 已编码的二进制条目，每个玩家只编码一次
+        players = self.players
+        for observer, player in players.items():
+            view = self._views.setdefault(observer, {})
+            visible = set(self.nearby(player['position'], exclude=observer))
+            changed = [name for name in visible if name in dirty or name not in view]
+            for name in changed:
+                view[name] = players[name]['position']
+            removed = [name for name in view if name not in visible]
+            for name in removed:
+                del view[name]
+            if changed or removed:
+                if player.get('binary'):
+                    frame = self._binary_state(changed, removed, entries)
+                    self._stats['binary_frames_sent'] += 1
+                    self._stats['bytes_sent'] += len(frame)
+                else:
+                    frame = {'type': '3d_battle_state', 'tick': self._tick,
+                             'players': {name: view[name] for name in changed}}
+                    if removed:
+                        frame['removed'] = removed
+                self.send(player['websocket'], frame)
+                self._stats['frames_sent'] += 1
+                self._stats['positions_sent'] += len(changed)
+                self._stats['removals_sent'] += len(removed)
+        if self.on_tick is not None:
+            self.on_tick(self._tick)
+
+        elapsed = time.perf_counter() - started_at
+        self._stats['ticks'] += 1
+        self._stats['tick_time_total'] += elapsed
+        self._stats['tick_time_max'] = max(self._stats['tick_time_max'], elapsed)
+
+    def _binary_state(self, changed, removed, entries):
+        header = STATE_HEADER.pack(OP_BATTLE_STATE, self._tick & 0xFFFFFFFF, len(changed), len(removed))
+        if not removed:
+            return header + b''.join([entries[name] for name in changed])
+        return b''.join([header, *[entries[name] for name in changed],
+                         *[PLAYER_ID.pack(self.ids[name]) for name in removed]])
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.tick_rate
+        next_tick = loop.time()
+        while True:
+            next_tick += interval
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                # 落后了就从现在重新计时，不连续补发
+                self._stats['late_ticks'] += 1
+                next_tick = loop.time()
+                await asyncio.sleep(0)
+            if self.players:
+                try:
+                    self.tick()
+                except Exception as e:
+                    print(f'⚠️ 3D战场同步出错: {e}')
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        ticks = self._stats['ticks']
+        return {
+            **self._stats,
+            'players': len(self.players),
+            'tick_rate': self.tick_rate,
+            'view_radius': self.view_radius,
+            'tick_time_avg': self._stats['tick_time_total'] / ticks if ticks else 0.0
+        }
+
+
+class _StateEntries(dict):
+    """{username: 已编码的状态条目}，第一次用到时编码"""
+
+    def __init__(self, sync):
+        super().__init__()
+        self.sync = sync
+
+    def __missing__(self, name):
+        entry = self[name] = encode_state_entry(self.sync.ids[name], self.sync.players[name]['position'])
+        return entry
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+3D战场位置同步：JSON 与二进制帧的带宽和 CPU 对比
+
+    接收移动 - 客户端发来的一次移动：json.loads + 校验，对比 struct 解码
+    下发状态 - 一个 tick 内所有玩家都在移动时，服务器编码并下发给每个观察者的状态帧
+
+运行: python bench_battle.py [玩家数]
+"""
+
+import json
+import random
+import sys
+import time
+
+from battle_sync import BattleSync, decode_move, encode_move, parse_position
+from outbound import JSON_ENCODER, encode_json
+
+ROUNDS = 20
+
+
+def random_position(spread):
+    return {'x': random.uniform(-spread, spread), 'y': 0.0, 'z': random.uniform(-spread, spread)}
+
+
+def bench_moves(count=100000):
+    """返回 [(名称, 每帧字节数, 每帧微秒)]"""
+    positions = [random_position(22) for _ in range(count)]
+    json_frames = [json.dumps({'type': '3d_battle_move', 'username': 'guest_a1b2c3d4', 'position': p})
+                   for p in positions]
+    binary_frames = [encode_move(p) for p in positions]
+
+    start = time.perf_counter()
+    for frame in json_frames:
+        data = json.loads(frame)
+        parse_position(data.get('position'))
+    json_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for frame in binary_frames:
+        decode_move(frame)
+    binary_time = time.perf_counter() - start
+
+    return [
+        ('JSON', sum(len(f.encode('utf-8')) for f in json_frames) / count, json_time / count * 1e6),
+        ('二进制', sum(len(f) for f in binary_frames) / count, binary_time / count * 1e6)
+    ]
+
+
+def bench_ticks(player_count, binary):
+    """所有玩家每个 tick 都在移动，返回 (每个 tick 的毫秒数, 其中编码帧的毫秒数, 每个 tick 下发的字节数, 每个位置的字节数)"""
+    random.seed(1)
+    players = {}
+    sent = {'bytes': 0, 'encode_time': 0.0}
+
+    def send(ws, message):
+        # 和 OutboundQueue 一样，dict 在发送前编码为 JSON
+        start = time.perf_counter()
+        frame = message if isinstance(message, bytes) else encode_json(message).encode('utf-8')
+        sent['encode_time'] += time.perf_counter() - start
+        sent['bytes'] += len(frame)
+
+    # 用户名和实际客户端一样是 guest_ + 随机串，场地大小让每个人视野内约有 20~30 个玩家
+    spread = 20 * (player_count / 10) ** 0.5
+    sync = BattleSync(players, send, view_radius=40)
+    build_binary = sync._binary_state
+
+    def timed_binary_state(*args):
+        # 二进制帧在 tick 里构造，构造时间也算作编码
+        start = time.perf_counter()
+        frame = build_binary(*args)
+        sent['encode_time'] += time.perf_counter() - start
+        return frame
+
+    sync._binary_state = timed_binary_state
+    for i in range(player_count):
+        name = f'guest_{random.getrandbits(32):08x}'
+        players[name] = {'position': random_position(spread), 'websocket': name, 'binary': binary}
+        sync.join(name)
+    sync.tick()
+
+    names = list(players)
+    sent['bytes'] = 0
+    sent['encode_time'] = 0.0
+    positions_before = sync.stats()['positions_sent']
+    elapsed = 0.0
+    for _ in range(ROUNDS):
+        for name in names:
+            p = players[name]['position']
+            sync.move(name, {'x': p['x'] + random.uniform(-0.1, 0.1), 'y': 0.0, 'z': p['z'] + random.uniform(-0.1, 0.1)})
+        start = time.perf_counter()
+        sync.tick()
+        elapsed += time.perf_counter() - start
+    positions = sync.stats()['positions_sent'] - positions_before
+    return elapsed / ROUNDS * 1000, sent['encode_time'] / ROUNDS * 1000, sent['bytes'] / ROUNDS, sent['bytes'] / positions
+
+
+def main():
+    player_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print('=' * 60)
+    print(f'3D战场位置同步：JSON（{JSON_ENCODER}）对比二进制帧')
+    print('=' * 60)
+
+    moves = bench_moves()
+    print('接收移动:')
+    for name, size, micros in moves:
+        print(f'  {name:<6} {size:6.1f} 字节/帧, {micros:6.2f} 微秒/帧')
+    print(f'  二进制: 字节数为 JSON 的 1/{moves[0][1] / moves[1][1]:.1f}，解码快 {moves[0][2] / moves[1][2]:.1f} 倍')
+
+    json_ms, json_encode_ms, json_bytes, json_per = bench_ticks(player_count, binary=False)
+    binary_ms, binary_encode_ms, binary_bytes, binary_per = bench_ticks(player_count, binary=True)
+    print(f'下发状态（{player_count} 个玩家同时移动，每个 tick；tick 耗时包含视野计算）:')
+    print(f'  JSON   tick {json_ms:6.2f}ms（编码 {json_encode_ms:5.2f}ms）, {json_bytes / 1024:8.1f}KB, '
+          f'{json_per:5.1f} 字节/位置')
+    print(f'  二进制 tick {binary_ms:6.2f}ms（编码 {binary_encode_ms:5.2f}ms）, {binary_bytes / 1024:8.1f}KB, '
+          f'{binary_per:5.1f} 字节/位置')
+    print(f'  二进制: 带宽为 JSON 的 1/{json_bytes / binary_bytes:.1f}，编码快 {json_encode_ms / binary_encode_ms:.1f} 倍')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GeoIP 查询性能对比
+
+    本地数据库   - LocalGeoIpDatabase（内存映射 + 二分查找）
+    HTTP 查询    - IpApiResolver 请求本地模拟的 ip-api 服务（不含公网延迟，是 HTTP 路径的上限）
+
+运行: python bench_geoip.py [IP段数量]
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from geoip_resolver import IpApiResolver, LocalGeoIpDatabase, build_database
+from http_clients import HttpClients
+
+LOCAL_LOOKUPS = 200000
+HTTP_LOOKUPS = 2000
+
+
+def int_to_ip(value):
+    return '.'.join(str((value >> shift) & 0xFF) for shift in (24, 16, 8, 0))
+
+
+def make_rows(range_count):
+    """生成 range_count 个连续的 IP 段"""
+    step = (2 ** 32) // range_count
+    for i in range(range_count):
+        yield int_to_ip(i * step), int_to_ip(i * step + step - 1), f'国家{i % 200}·城市{i % 5000}'
+
+
+def bench_local(db_path, ips):
+    db = LocalGeoIpDatabase(db_path)
+    start = time.perf_counter()
+    db.lookup_local(ips[0])
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for ip in ips:
+        db.lookup_local(ip)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return load_time, len(ips) / elapsed
+
+
+async def bench_http(ips):
+    async def handler(request):
+        return web.json_response({'status': 'success', 'country': '国家', 'regionName': '地区', 'city': '城市'})
+
+    app = web.Application()
+    app.router.add_get('/json/{ip}', handler)
+    async with TestServer(app) as server:
+        clients = HttpClients()
+        resolver = IpApiResolver(clients, base_url=str(server.make_url('')).rstrip('/'))
+        await clients.start()
+
+        start = time.perf_counter()
+        for ip in ips:
+            await resolver.lookup(ip)
+        sequential = len(ips) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[resolver.lookup(ip) for ip in ips])
+        concurrent = len(ips) / (time.perf_counter() - start)
+
+        await clients.close()
+    return sequential, concurrent
+
+
+def main():
+    range_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    rng = random.Random(0)
+    ips = [int_to_ip(rng.getrandbits(32)) for _ in range(LOCAL_LOOKUPS)]
+
+    print('=' * 60)
+    print(f'GeoIP 查询性能对比（{range_count} 个 IP 段）')
+    print('=' * 60)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'geoip.db')
+        start = time.perf_counter()
+        build_database(make_rows(range_count), db_path)
+        print(f'生成数据库: {time.perf_counter() - start:.2f}s, {os.path.getsize(db_path) / 1024 / 1024:.1f}MB')
+
+        load_time, local_rate = bench_local(db_path, ips)
+        print(f'本地数据库: 首次加载 {load_time * 1000:.1f}ms, {local_rate:,.0f} 次/秒 '
+              f'({1e6 / local_rate:.1f}µs/次)')
+
+    sequential, concurrent = asyncio.run(bench_http(ips[:HTTP_LOOKUPS]))
+    print(f'HTTP 查询（本机模拟服务）: 顺序 {sequential:,.0f} 次/秒, 并发 {concurrent:,.0f} 次/秒')
+    print(f'本地数据库约为 HTTP 顺序查询的 {local_rate / sequential:,.0f} 倍'
+          f'（ip-api.com 实际还有公网延迟和每分钟 45 次的限制）')
+
+
+if __name__ == '__main__':
+    main()
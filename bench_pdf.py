@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDF 解析对事件循环的影响
+
+    事件循环内解析 - 旧做法：在协程里直接调用 PyPDF2
+    进程池解析     - PdfExtractor（工作进程中解析）
+
+解析期间每 10ms 唤醒一次的探测任务记录调度延迟，延迟越大说明其他连接被卡住越久。
+
+运行: python bench_pdf.py [页数]
+"""
+
+import asyncio
+import sys
+import time
+
+from pdf_extract import PdfExtractor, extract_pages, format_pages, make_text_pdf
+
+PROBE_INTERVAL = 0.01
+
+
+async def measure_loop_lag(extract):
+    """执行 extract() 的同时测量事件循环调度延迟，返回 (解析耗时, 最大延迟, p99 延迟)"""
+    lags = []
+    done = False
+
+    async def probe():
+        while not done:
+            expected = time.perf_counter() + PROBE_INTERVAL
+            await asyncio.sleep(PROBE_INTERVAL)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.sleep(PROBE_INTERVAL * 3)
+    start = time.perf_counter()
+    await extract()
+    elapsed = time.perf_counter() - start
+    done = True
+    await probe_task
+    lags.sort()
+    return elapsed, lags[-1], lags[int(len(lags) * 0.99)]
+
+
+async def main():
+    page_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    pdf_data = make_text_pdf([[f'Page {p} line {i}: meeting notes and chat messages' for i in range(50)]
+                              for p in range(page_count)])
+
+    print('=' * 60)
+    print(f'PDF 解析对事件循环的影响（{page_count} 页, {len(pdf_data) / 1024 / 1024:.1f}MB）')
+    print('=' * 60)
+
+    async def inline():
+        page_total, pages = extract_pages(pdf_data, page_count)
+        return format_pages(pages, page_total)
+
+    elapsed, max_lag, p99_lag = await measure_loop_lag(inline)
+    print(f'事件循环内解析: 耗时 {elapsed:.2f}s, 最大调度延迟 {max_lag * 1000:.0f}ms, p99 {p99_lag * 1000:.0f}ms')
+
+    extractor = PdfExtractor(max_workers=2, timeout=120, max_pages=page_count)
+    await extractor.start()
+    elapsed, max_lag, p99_lag = await measure_loop_lag(lambda: extractor.extract(pdf_data))
+    print(f'进程池解析:     耗时 {elapsed:.2f}s, 最大调度延迟 {max_lag * 1000:.0f}ms, p99 {p99_lag * 1000:.0f}ms')
+    extractor.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
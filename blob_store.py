@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+内容寻址的媒体文件存储（图片、语音）
+
+文件按内容的 SHA-256 命名，保存在 data/blobs/<前两位>/<sha256>，
+旁边的 <sha256>.json 记录内容类型和大小。相同内容只保存一份。
+消息里只保存 blob 引用（blob_id 和 /api/blobs/<blob_id> 地址），不再内联 base64。
+"""
+
+import hashlib
+import json
+import os
+import re
+import uuid
+
+from aiohttp import web
+
+BLOB_URL_PREFIX = '/api/blobs/'
+
+# 允许保存的内容类型（不接受 svg/html 等可执行脚本的类型）
+ALLOWED_CONTENT_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/bmp')
+ALLOWED_CONTENT_TYPE_PREFIXES = ('audio/',)
+
+_BLOB_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobTooLarge(Exception):
+    """上传内容超过大小上限"""
+
+
+class BlobFileResponse(web.FileResponse):
+    """发送 blob 文件：FileResponse 默认用修改时间和大小生成 ETag，这里固定为内容哈希（blob_id）"""
+
+    def __init__(self, path, blob_id, **kwargs):
+        super().__init__(path, **kwargs)
+        self._blob_id = blob_id
+
+    @property
+    def etag(self):
+        return web.FileResponse.etag.fget(self)
+
+    @etag.setter
+    def etag(self, value):
+        web.FileResponse.etag.fset(self, self._blob_id)
+
+
+def is_valid_blob_id(blob_id):
+    return bool(blob_id) and _BLOB_ID_RE.match(blob_id) is not None
+
+
+def normalize_content_type(content_type):
+    """去掉参数（如 audio/webm;codecs=opus -> audio/webm），不允许的类型返回 None"""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ALLOWED_CONTENT_TYPES or content_type.startswith(ALLOWED_CONTENT_TYPE_PREFIXES):
+        return content_type
+    return None
+
+
+def blob_url(blob_id):
+    return BLOB_URL_PREFIX + blob_id
+
+
+class BlobWriter:
+    """边写边计算 SHA-256，写完后按哈希移动到最终位置"""
+
+    def __init__(self, store, content_type, max_size=None):
+        self.store = store
+        self.content_type = content_type
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+        os.makedirs(store.tmp_dir, exist_ok=True)
+        self._tmp_path = os.path.join(store.tmp_dir, uuid.uuid4().hex)
+        self._file = open(self._tmp_path, 'wb')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.abort()
+            raise BlobTooLarge(f'文件超过大小上限 {self.max_size} 字节')
+        self._hash.update(data)
+        self._file.write(data)
+
+    def commit(self):
+        """完成写入，返回 blob 信息 {blob_id, content_type, size}"""
+        self._file.close()
+        blob_id = self._hash.hexdigest()
+        path = self.store.path(blob_id)
+        if os.path.exists(path):
+            # 相同内容已存在，直接复用
+            os.remove(self._tmp_path)
+            self.store.stats['dedup_hits'] += 1
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._tmp_path, path)
+            with open(path + '.json', 'w', encoding='utf-8') as f:
+                json.dump({'content_type': self.content_type, 'size': self.size}, f)
+            self.store.stats['blobs_stored'] += 1
+            self.store.stats['bytes_stored'] += self.size
+        return self.store.stat(blob_id)
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class BlobStore:
+    """data/blobs 目录下的内容寻址存储"""
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.tmp_dir = os.path.join(root_dir, 'tmp')  # 第一次写入时才创建目录
+        self.stats = {'blobs_stored': 0, 'bytes_stored': 0, 'dedup_hits': 0}
+
+    def path(self, blob_id):
+        return os.path.join(self.root_dir, blob_id[:2], blob_id)
+
+    def writer(self, content_type, max_size=None):
+        return BlobWriter(self, content_type, max_size)
+
+    def put(self, data, content_type):
+        """保存一段完整内容，返回 blob 信息"""
+        blob_id = hashlib.sha256(data).hexdigest()
+        if os.path.exists(self.path(blob_id)):
+            self.stats['dedup_hits'] += 1
+            return self.stat(blob_id)
+        writer = self.writer(content_type)
+        writer.write(data)
+        return writer.commit()
+
+    def stat(self, blob_id):
+        """返回 {blob_id, content_type, size}，不存在时返回 None"""
+        if not is_valid_blob_id(blob_id):
+            return None
+        path = self.path(blob_id)
+        try:
+            with open(path + '.json', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            if not os.path.exists(path):
+                return None
+            meta = {'content_type': 'application/octet-stream', 'size': os.path.getsize(path)}
+        return {'blob_id': blob_id, 'content_type': meta['content_type'], 'size': meta['size']}
+
+    def read_range(self, blob_id, start, end, chunk_size=64 * 1024):
+        """按块读取 [start, end) 区间的内容"""
+        with open(self.path(blob_id), 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
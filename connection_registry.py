@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+WebSocket 连接登记表
+
+每个连接对应一个 Session，记录这个连接上的所有身份：聊天用户名、3D战场玩家名、加入的群组视频。
+断开时按连接直接取出 Session 清理，不用在 connected_users / battle_3d_players 里逐个查找。
+
+断开通知合并发送：flush_delay 秒内断开的连接一起交给 on_departures，
+大量连接同时断开时（服务器重启、网络抖动）每个还在线的人只收到一条通知，而不是每断开一个收一条。
+"""
+
+import asyncio
+import time
+
+
+class Session:
+    """一个 WebSocket 连接上的身份"""
+
+    __slots__ = ('ws', 'username', 'battle_username', 'video_groups', 'opened_at')
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.username = None  # 注册后的聊天用户名
+        self.battle_username = None  # 加入3D战场时的玩家名
+        self.video_groups = set()  # 正在进行视频通话的群组 id
+        self.opened_at = time.time()
+
+
+class ConnectionRegistry:
+    """{websocket: Session}；on_departures(sessions) 在断开的连接清理完之后合并调用"""
+
+    def __init__(self, on_departures=None, flush_delay=0.05):
+        self.on_departures = on_departures
+        self.flush_delay = flush_delay
+        self._sessions = {}
+        self._pending = []  # 已断开、还没发送通知的 Session
+        self._flush_handle = None
+        self._stats = {'opened': 0, 'closed': 0, 'flushes': 0, 'max_batch': 0}
+
+    def open(self, ws):
+        session = self._sessions[ws] = Session(ws)
+        self._stats['opened'] += 1
+        return session
+
+    def get(self, ws):
+        return self._sessions.get(ws)
+
+    def close(self, ws):
+        """移除连接，返回它的 Session（不存在时返回 None）；通知在 flush_delay 秒后合并发送"""
+        session = self._sessions.pop(ws, None)
+        if session is None:
+            return None
+        self._stats['closed'] += 1
+        if self.on_departures is not None:
+            self._pending.append(session)
+            if self._flush_handle is None:
+                self._flush_handle = asyncio.get_running_loop().call_later(self.flush_delay, self.flush)
+        return session
+
+    def flush(self):
+        """立即发送等待中的断开通知"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        sessions, self._pending = self._pending, []
+        if not sessions:
+            return
+        self._stats['flushes'] += 1
+        self._stats['max_batch'] = max(self._stats['max_batch'], len(sessions))
+        try:
+            self.on_departures(sessions)
+        except Exception as e:
+            print(f'⚠️ 发送断开通知失败: {e}')
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        return {**self._stats, 'connections': len(self._sessions), 'pending': len(self._pending)}
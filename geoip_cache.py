@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+IP 地理位置缓存（LRU + TTL）
+
+- 按 IP 缓存，IPv4 同时按 /24 网段缓存（同一网段的其他 IP 直接命中）
+- 同一个 IP 的并发查询共用一次上游请求
+- 查询失败也缓存一小段时间（负缓存），避免重连风暴时反复请求上游
+"""
+
+import asyncio
+import ipaddress
+import time
+from collections import OrderedDict
+
+
+def cache_keys(ip):
+    """返回 (IP key, 网段 key)，IPv6 或无法解析的地址没有网段 key"""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip, None
+    if address.version == 4:
+        return ip, str(ipaddress.ip_network(f'{ip}/24', strict=False))
+    return ip, None
+
+
+def is_public_ip(ip):
+    """内网、回环等地址无法定位，不需要查询上游"""
+    try:
+        return ipaddress.ip_address(ip).is_global
+    except ValueError:
+        return False
+
+
+class GeoIpCache:
+    """包装一个异步查询函数 lookup(ip) -> 位置字符串（失败返回 None 或抛出异常）"""
+
+    def __init__(self, lookup, max_size=10000, ttl=24 * 3600, negative_ttl=300, clock=time.monotonic):
+        self.lookup = lookup
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # {key: (expires_at, location)}，location 为 None 表示负缓存
+        self._inflight = {}  # {ip: Future}
+        self._stats = {'hits': 0, 'subnet_hits': 0, 'negative_hits': 0, 'misses': 0,
+                       'coalesced': 0, 'lookups': 0, 'failures': 0}
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, location = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, location
+
+    def _put(self, key, location, ttl):
+        self._entries[key] = (self.clock() + ttl, location)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get_cached(self, ip):
+        """只查缓存，返回 (是否命中, 位置)；负缓存命中时位置为 None"""
+        ip_key, subnet_key = cache_keys(ip)
+        found, location = self._get(ip_key)
+        if found:
+            self._stats['negative_hits' if location is None else 'hits'] += 1
+            return True, location
+        if subnet_key is not None:
+            found, location = self._get(subnet_key)
+            if found:
+                self._stats['subnet_hits'] += 1
+                return True, location
+        return False, None
+
+    async def resolve(self, ip):
+        """返回位置字符串，查询失败返回 None"""
+        found, location = self.get_cached(ip)
+        if found:
+            return location
+
+        future = self._inflight.get(ip)
+        if future is not None:
+            self._stats['coalesced'] += 1
+            return await asyncio.shield(future)
+
+        self._stats['misses'] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[ip] = future
+        try:
+            location = await self._lookup(ip)
+            future.set_result(location)
+            return location
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._inflight[ip]
+
+    async def _lookup(self, ip):
+        self._stats['lookups'] += 1
+        try:
+            location = await self.lookup(ip)
+        except Exception as e:
+            print(f'获取地理位置失败: {e}')
+            location = None
+
+        ip_key, subnet_key = cache_keys(ip)
+        if location is None:
+            self._stats['failures'] += 1
+            self._put(ip_key, None, self.negative_ttl)
+        else:
+            self._put(ip_key, location, self.ttl)
+            if subnet_key is not None:
+                self._put(subnet_key, location, self.ttl)
+        return location
+
+    def stats(self):
+        return {**self._stats, 'size': len(self._entries), 'inflight': len(self._inflight)}
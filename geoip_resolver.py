@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+IP 地理位置解析器
+
+    LocalGeoIpDatabase  - 本地 IP 段数据库（内存映射，二分查找，微秒级，无需外网）
+    IpApiResolver       - ip-api.com HTTP 查询（可选的后备）
+    ChainedGeoIpResolver - 依次尝试多个解析器
+
+本地数据库文件格式（data/geoip.db）：
+
+    头部 '<8sBxxxII': 魔数 b'GEOIPDB1' | 字节序 (1=小端) | 段数 N | 位置数 M
+    starts[N] uint32 | ends[N] uint32 | location_index[N] uint32   （按 start 升序）
+    位置表: UTF-8 JSON 数组，长度为 M
+
+从 CSV（start_ip,end_ip,国家,地区,城市...）生成数据库：
+
+    python geoip_resolver.py build ranges.csv data/geoip.db
+"""
+
+import array
+import bisect
+import csv
+import ipaddress
+import json
+import mmap
+import os
+import socket
+import struct
+import sys
+
+MAGIC = b'GEOIPDB1'
+HEADER = struct.Struct('<8sBxxxII')
+_UINT32 = struct.Struct('!I')
+
+
+class GeoIpResolver:
+    """解析器接口：lookup(ip) 返回位置字符串，查不到返回 None"""
+
+    async def lookup(self, ip):
+        return self.lookup_local(ip)
+
+    def lookup_local(self, ip):
+        """不经过网络的同步查询，不支持时返回 None"""
+        return None
+
+    def stats(self):
+        return {}
+
+
+def ipv4_to_int(ip):
+    """IPv4 地址转整数，非 IPv4 返回 None"""
+    try:
+        return _UINT32.unpack(socket.inet_pton(socket.AF_INET, ip))[0]
+    except (OSError, TypeError):
+        pass
+    # IPv4 映射的 IPv6 地址（::ffff:1.2.3.4）
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    if address.version == 4:
+        return int(address)
+    if address.ipv4_mapped is not None:
+        return int(address.ipv4_mapped)
+    return None
+
+
+class LocalGeoIpDatabase(GeoIpResolver):
+    """内存映射的 IPv4 段数据库，首次查询时才打开文件"""
+
+    def __init__(self, path):
+        self.path = path
+        self._mmap = None
+        self._starts = None
+        self._ends = None
+        self._location_index = None
+        self._locations = None
+        self.error = None  # 加载失败的原因，设置后不再尝试加载
+        self.lookups = 0
+        self.found = 0
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        columns = []
+        try:
+            if len(mm) < HEADER.size:
+                raise ValueError(f'GeoIP 数据库已损坏: {self.path}')
+            magic, little_endian, range_count, location_count = HEADER.unpack_from(mm)
+            if magic != MAGIC:
+                raise ValueError(f'不是 GeoIP 数据库文件: {self.path}')
+
+            offset = HEADER.size
+            size = range_count * 4
+            if len(mm) < offset + size * 3:
+                raise ValueError(f'GeoIP 数据库已损坏: {self.path}')
+            for _ in range(3):
+                column = memoryview(mm)[offset:offset + size].cast('I')
+                if bool(little_endian) != (sys.byteorder == 'little'):
+                    # 字节序不同时复制一份并转换（同一台机器生成的文件不会走到这里）
+                    column = array.array('I', column)
+                    column.byteswap()
+                columns.append(column)
+                offset += size
+
+            locations = json.loads(mm[offset:].decode('utf-8'))
+            if not isinstance(locations, list) or len(locations) != location_count:
+                raise ValueError(f'GeoIP 数据库已损坏: {self.path}')
+        except BaseException:
+            for column in columns:
+                if isinstance(column, memoryview):
+                    column.release()
+            mm.close()
+            raise
+        self._mmap = mm
+        self._locations = locations
+        self._starts, self._ends, self._location_index = columns
+        print(f'✅ 加载本地 GeoIP 数据库: {range_count} 个 IP 段, {location_count} 个位置')
+
+    def _ensure_loaded(self):
+        """首次使用时加载；文件无法加载时只报告一次，之后不再尝试（查询返回 None，由后备解析器处理）"""
+        if self._starts is not None:
+            return True
+        if self.error is not None:
+            return False
+        try:
+            self._load()
+        except (OSError, ValueError) as e:
+            self.error = str(e)
+            print(f'⚠️ 本地 GeoIP 数据库不可用，已停用: {e}')
+            return False
+        return True
+
+    def lookup_local(self, ip):
+        value = ipv4_to_int(ip)
+        if value is None or not self._ensure_loaded():
+            return None
+
+        self.lookups += 1
+        i = bisect.bisect_right(self._starts, value) - 1
+        if i < 0 or value > self._ends[i]:
+            return None
+        self.found += 1
+        return self._locations[self._location_index[i]]
+
+    def __len__(self):
+        return len(self._starts) if self._ensure_loaded() else 0
+
+    def close(self):
+        if self._mmap is not None:
+            for column in (self._starts, self._ends, self._location_index):
+                if isinstance(column, memoryview):
+                    column.release()
+            self._starts = self._ends = self._location_index = None
+            self._mmap.close()
+            self._mmap = None
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'loaded': self._starts is not None,
+            'error': self.error,
+            'ranges': len(self._starts) if self._starts is not None else None,
+            'lookups': self.lookups,
+            'found': self.found
+        }
+
+
+class IpApiResolver(GeoIpResolver):
+    """通过 ip-api.com 查询（免费服务，每分钟 45 次请求）"""
+
+    def __init__(self, http_clients, base_url='http://ip-api.com'):
+        self.http_clients = http_clients
+        self.base_url = base_url
+        self.requests = 0
+
+    async def lookup(self, ip):
+        self.requests += 1
+        session = await self.http_clients.session()
+        async with session.get(
+            f'{self.base_url}/json/{ip}?lang=zh-CN&fields=country,regionName,city,status,message',
+            timeout=self.http_clients.timeout('geoip')
+        ) as response:
+            data = await response.json()
+
+            if data.get('status') != 'success':
+                print(f'获取地理位置失败: {data.get("message", response.status)}')
+                return None
+
+            return format_location(data.get('country', ''), data.get('regionName', ''), data.get('city', ''))
+
+    def stats(self):
+        return {'requests': self.requests}
+
+
+class ChainedGeoIpResolver(GeoIpResolver):
+    """依次尝试多个解析器，返回第一个结果"""
+
+    def __init__(self, resolvers):
+        self.resolvers = resolvers
+
+    async def lookup(self, ip):
+        for resolver in self.resolvers:
+            location = await resolver.lookup(ip)
+            if location is not None:
+                return location
+        return None
+
+    def lookup_local(self, ip):
+        for resolver in self.resolvers:
+            location = resolver.lookup_local(ip)
+            if location is not None:
+                return location
+        return None
+
+    def stats(self):
+        return {type(resolver).__name__: resolver.stats() for resolver in self.resolvers}
+
+
+def format_location(*parts):
+    """组合位置信息（国家·地区·城市），跳过空值和重复的地区名"""
+    location_parts = []
+    for part in parts:
+        if part and part not in location_parts:
+            location_parts.append(part)
+    return '·'.join(location_parts) if location_parts else '未知位置'
+
+
+def create_geoip_resolver(db_path=None, http_clients=None):
+    """按配置组合解析器：本地数据库存在时优先使用，http_clients 不为 None 时启用 HTTP 后备"""
+    resolvers = []
+    if db_path and os.path.exists(db_path):
+        resolvers.append(LocalGeoIpDatabase(db_path))
+    if http_clients is not None:
+        resolvers.append(IpApiResolver(http_clients))
+    if len(resolvers) == 1:
+        return resolvers[0]
+    return ChainedGeoIpResolver(resolvers)
+
+
+def build_database(rows, out_path):
+    """rows: (start_ip, end_ip, location) 可迭代对象，生成数据库文件，返回段数"""
+    ranges = []
+    for start_ip, end_ip, location in rows:
+        start, end = ipv4_to_int(start_ip), ipv4_to_int(end_ip)
+        if start is None or end is None or start > end:
+            continue  # 只收录 IPv4 段
+        ranges.append((start, end, location))
+    ranges.sort()
+
+    locations = []
+    location_ids = {}
+    starts, ends, indexes = array.array('I'), array.array('I'), array.array('I')
+    for start, end, location in ranges:
+        if location not in location_ids:
+            location_ids[location] = len(locations)
+            locations.append(location)
+        starts.append(start)
+        ends.append(end)
+        indexes.append(location_ids[location])
+
+    tmp_path = out_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 1 if sys.byteorder == 'little' else 0, len(ranges), len(locations)))
+        for column in (starts, ends, indexes):
+            column.tofile(f)
+        f.write(json.dumps(locations, ensure_ascii=False).encode('utf-8'))
+    os.replace(tmp_path, out_path)
+    return len(ranges)
+
+
+def read_csv_ranges(csv_path):
+    """读取 start_ip,end_ip,国家,地区,城市... 格式的 CSV"""
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) >= 3:
+                yield row[0].strip(), row[1].strip(), format_location(*(col.strip() for col in row[2:]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'build':
+        print('用法: python geoip_resolver.py build ranges.csv data/geoip.db')
+        sys.exit(1)
+    count = build_database(read_csv_ranges(sys.argv[2]), sys.argv[3])
+    print(f'✅ 已生成 {sys.argv[3]}: {count} 个 IP 段')
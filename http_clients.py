@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+共享的出站 HTTP 连接池
+
+所有对外 HTTP 调用（Claude API、IP 定位、天气）共用一个 ClientSession：
+连接保持复用（keep-alive），DNS 结果缓存，不用每次请求都重新建连和 TLS 握手。
+每个上游服务有自己的超时设置。
+会话在应用启动时创建，关闭时释放。
+"""
+
+import aiohttp
+
+# 各上游服务的默认超时（秒）
+DEFAULT_TIMEOUTS = {
+    'llm': {'total': 90, 'connect': 10},
+    'geoip': {'total': 5, 'connect': 2},
+    'weather': {'total': 10, 'connect': 3},
+}
+
+
+class HttpClients:
+    """进程内共享的 ClientSession 和各上游超时"""
+
+    def __init__(self, limit=100, limit_per_host=20, keepalive_timeout=30, dns_cache_ttl=300, timeouts=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeouts = {
+            name: aiohttp.ClientTimeout(**values)
+            for name, values in {**DEFAULT_TIMEOUTS, **(timeouts or {})}.items()
+        }
+        self._session = None
+
+    async def start(self):
+        """创建连接池（应用启动时调用）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def session(self):
+        """返回共享会话（未启动时自动创建，例如在测试或脚本中直接调用）"""
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    def timeout(self, upstream):
+        return self.timeouts[upstream]
+
+    async def close(self):
+        """关闭连接池（应用关闭时调用）"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def stats(self):
+        connector = self._session.connector if self._session is not None and not self._session.closed else None
+        return {
+            'open': connector is not None,
+            'limit': self.limit,
+            'limit_per_host': self.limit_per_host,
+            'keepalive_timeout': self.keepalive_timeout,
+            'dns_cache_ttl': self.dns_cache_ttl,
+            'timeouts': {name: timeout.total for name, timeout in self.timeouts.items()}
+        }
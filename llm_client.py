@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+统一的 Claude API 客户端
+
+机器人回复和 /api/summarize_chat 都通过这里调用 Messages API：
+- 密钥和模型在启动时读取一次（环境变量优先，其次 .api_config 文件）
+- 同时进行的请求数有上限，排队的请求按用户轮转，一个用户的大量请求不会饿死其他用户
+- 429（限流）和 529（过载）等临时错误按指数退避重试，优先使用服务器返回的 retry-after
+- 支持 SSE 流式响应（stream），边生成边转发给用户
+- 记录延迟、首个 token 延迟、排队时间和 token 用量（/api/metrics）
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+from collections import OrderedDict, deque
+
+import aiohttp
+
+API_URL = 'https://api.anthropic.com/v1/messages'
+API_VERSION = '2023-06-01'
+DEFAULT_MODEL = 'claude-3-5-sonnet-20241022'
+
+# 可以重试的状态码：限流、过载和网关临时错误
+RETRY_STATUSES = (429, 500, 502, 503, 529)
+
+
+class LLMError(Exception):
+    """API 调用失败（status 为 HTTP 状态码，排队已满时为 503）"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def load_llm_config(base_dir):
+    """读取 API 配置：ANTHROPIC_API_KEY 环境变量优先，其次 base_dir/.api_config 文件"""
+    api_key = os.environ.get('ANTHROPIC_API_KEY', '')
+
+    # Railway环境变量备选方案：尝试从配置文件读取
+    if not api_key:
+        config_file = os.path.join(base_dir, '.api_config')
+        try:
+            with open(config_file, 'r') as f:
+                api_key = f.read().strip()
+        except OSError:
+            pass
+
+    return {
+        'api_key': api_key,
+        'model': os.environ.get('ANTHROPIC_MODEL', DEFAULT_MODEL),
+        'api_url': os.environ.get('ANTHROPIC_API_URL', API_URL)
+    }
+
+
+async def iter_sse(stream):
+    """解析 SSE 流，产出 (event, data)；data 为解析后的 JSON"""
+    event = None
+    data_lines = []
+    async for raw_line in stream:
+        line = raw_line.decode('utf-8').rstrip('\r\n')
+        if not line:
+            if data_lines:
+                yield event, json.loads('\n'.join(data_lines))
+            event = None
+            data_lines = []
+        elif line.startswith('event:'):
+            event = line[6:].strip()
+        elif line.startswith('data:'):
+            data_lines.append(line[5:].lstrip())
+    if data_lines:
+        yield event, json.loads('\n'.join(data_lines))
+
+
+class LLMClient:
+    """带并发上限、公平排队和重试的 Messages API 客户端"""
+
+    def __init__(self, http_clients, api_key, model=DEFAULT_MODEL, api_url=API_URL,
+                 max_concurrency=4, max_queue=100, max_retries=4, backoff_base=1.0, backoff_max=30.0):
+        self.http_clients = http_clients
+        self.api_key = api_key
+        self.model = model
+        self.api_url = api_url
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._active = 0
+        self._waiting = OrderedDict()  # {user: deque(Future)}，按用户轮转
+        self._latencies = deque(maxlen=500)
+        self._ttft = deque(maxlen=500)  # 流式调用的首个 token 延迟
+        self._stats = {
+            'requests': 0, 'started': 0, 'succeeded': 0, 'failed': 0, 'rejected': 0, 'retries': 0,
+            'input_tokens': 0, 'output_tokens': 0, 'queue_wait_total': 0.0
+        }
+
+    # ---------- 排队 ----------
+
+    def queued(self):
+        return sum(len(waiters) for waiters in self._waiting.values())
+
+    async def _acquire(self, user):
+        if self._active < self.max_concurrency and not self._waiting:
+            self._active += 1
+            return
+        if self.queued() >= self.max_queue:
+            self._stats['rejected'] += 1
+            raise LLMError('AI 服务繁忙，请稍后再试', 503)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # 已经分到名额，转交给下一个
+            else:
+                waiters = self._waiting.get(user)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiting[user]
+            raise
+
+    def _release(self):
+        """把名额交给下一个用户（轮转），没有等待者时释放"""
+        while self._waiting:
+            user, waiters = next(iter(self._waiting.items()))
+            future = waiters.popleft()
+            if waiters:
+                self._waiting.move_to_end(user)
+            else:
+                del self._waiting[user]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    # ---------- 调用 ----------
+
+    def _payload(self, content, system, max_tokens, temperature, stream=False):
+        payload = {
+            'model': self.model,
+            'max_tokens': max_tokens,
+            'messages': [{'role': 'user', 'content': content}]
+        }
+        if system:
+            payload['system'] = system
+        if temperature is not None:
+            payload['temperature'] = temperature
+        if stream:
+            payload['stream'] = True
+        return payload
+
+    async def _start(self, user):
+        """排队等待名额，返回开始时间"""
+        if not self.api_key:
+            raise LLMError('未配置API密钥。请设置ANTHROPIC_API_KEY环境变量。')
+        self._stats['requests'] += 1
+        queued_at = time.monotonic()
+        await self._acquire(user)
+        started_at = time.monotonic()
+        self._stats['started'] += 1
+        self._stats['queue_wait_total'] += started_at - queued_at
+        return started_at
+
+    def _finish(self, started_at, usage):
+        self._latencies.append(time.monotonic() - started_at)
+        self._stats['succeeded'] += 1
+        self._stats['input_tokens'] += usage.get('input_tokens', 0)
+        self._stats['output_tokens'] += usage.get('output_tokens', 0)
+
+    async def complete(self, content, system=None, user=None, max_tokens=4096, temperature=None):
+        """发送一条用户消息，返回回复文本；失败时抛出 LLMError"""
+        payload = self._payload(content, system, max_tokens, temperature)
+        started_at = await self._start(user)
+        try:
+            result = await self._request(payload, self.http_clients.timeout('llm'), read_json=True)
+        except LLMError:
+            self._stats['failed'] += 1
+            raise
+        finally:
+            self._release()
+
+        self._finish(started_at, result.get('usage', {}))
+        return ''.join(block.get('text', '') for block in result.get('content', []) if block.get('type') == 'text')
+
+    async def stream(self, content, system=None, user=None, max_tokens=4096, temperature=None):
+        """流式调用（SSE），逐段产出回复文本；失败时抛出 LLMError
+
+        只在收到第一个字节之前重试；流式响应没有总超时，两次数据之间最多等待 llm 超时时间。
+        """
+        payload = self._payload(content, system, max_tokens, temperature, stream=True)
+        llm_timeout = self.http_clients.timeout('llm')
+        timeout = aiohttp.ClientTimeout(total=None, connect=llm_timeout.connect, sock_read=llm_timeout.total)
+        started_at = await self._start(user)
+        usage = {}
+        first_token = True
+        try:
+            response = await self._request(payload, timeout)
+            try:
+                async for event, data in iter_sse(response.content):
+                    if event == 'message_start':
+                        usage.update(data.get('message', {}).get('usage', {}))
+                    elif event == 'content_block_delta' and data.get('delta', {}).get('type') == 'text_delta':
+                        if first_token:
+                            first_token = False
+                            self._ttft.append(time.monotonic() - started_at)
+                        yield data['delta']['text']
+                    elif event == 'message_delta':
+                        usage.update(data.get('usage', {}))
+                    elif event == 'error':
+                        error = data.get('error', {})
+                        raise LLMError(f'API流式响应错误: {error.get("message", error)}',
+                                       529 if error.get('type') == 'overloaded_error' else None)
+            finally:
+                response.release()
+        except LLMError:
+            self._stats['failed'] += 1
+            raise
+        except asyncio.TimeoutError:
+            self._stats['failed'] += 1
+            raise LLMError('API调用超时', 504)
+        except aiohttp.ClientError as e:
+            self._stats['failed'] += 1
+            raise LLMError(f'读取API响应失败: {e}', 502)
+        finally:
+            self._release()
+
+        self._finish(started_at, usage)
+
+    async def _request(self, payload, timeout, read_json=False):
+        """发送请求，返回状态码为 200 的响应（调用方负责 release）；临时错误按退避重试
+
+        read_json=True 时在同一个超时/重试处理中读取响应体，返回解析后的 JSON：
+        读取超时抛出 504，读取中途连接出错按临时错误重试。
+        """
+        headers = {
+            'x-api-key': self.api_key,
+            'anthropic-version': API_VERSION,
+            'content-type': 'application/json'
+        }
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                session = await self.http_clients.session()
+                response = await session.post(self.api_url, headers=headers, json=payload, timeout=timeout)
+                if response.status == 200:
+                    if not read_json:
+                        return response
+                    try:
+                        return await response.json()
+                    except ValueError as e:
+                        raise LLMError(f'API响应格式错误: {e}', 502)
+                    finally:
+                        response.release()
+                try:
+                    error_text = await response.text()
+                finally:
+                    response.release()
+                error = LLMError(f'API调用失败 ({response.status}): {error_text}', response.status)
+                if response.status not in RETRY_STATUSES:
+                    raise error
+                retry_after = response.headers.get('retry-after')
+            except asyncio.TimeoutError:
+                raise LLMError('API调用超时', 504)
+            except aiohttp.ClientError as e:
+                error = LLMError(f'连接API失败: {e}', 502)
+
+            if attempt >= self.max_retries:
+                raise error
+            delay = self._backoff(attempt, retry_after)
+            attempt += 1
+            self._stats['retries'] += 1
+            print(f'⏳ Claude API 暂时不可用 ({error.status})，{delay:.1f} 秒后第 {attempt} 次重试')
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt, retry_after=None):
+        """指数退避（带随机抖动），服务器给出 retry-after 时按它等待"""
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        delay = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        ttft = sorted(self._ttft)
+        started = self._stats['started']
+        return {
+            **self._stats,
+            'model': self.model,
+            'configured': bool(self.api_key),
+            'in_flight': self._active,
+            'queued': self.queued(),
+            'max_concurrency': self.max_concurrency,
+            'queue_wait_avg': self._stats['queue_wait_total'] / started if started > 0 else 0.0,
+            'latency_p50': latencies[len(latencies) // 2] if latencies else None,
+            'latency_p95': latencies[int(len(latencies) * 0.95)] if latencies else None,
+            'ttft_p50': ttft[len(ttft) // 2] if ttft else None
+        }
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+通过 WebSocket 二进制帧分块传输媒体文件
+
+图片/语音不再以 base64 文本帧发送（体积大约 +33%，服务器还要 json.loads 整个大字符串），
+而是切成小块，每块一个二进制帧：
+
+    | op (1) | flags (1) | transfer_id (4) | chunk_index (4) | type_len (2) | content_type | payload |
+
+整数均为大端序。op 为 1 表示上传、2 表示下载；flags 的最低位表示最后一块。
+content_type 只在第 0 块中携带，其余块 type_len 为 0。
+上传的分块在服务器端按顺序写入 blob 存储，最后一块到达时得到 blob 引用。
+文件读写都在传入的线程池（executor）中执行，不阻塞事件循环。
+"""
+
+import asyncio
+import struct
+from collections import namedtuple
+
+from blob_store import BlobTooLarge, normalize_content_type
+
+OP_UPLOAD = 1
+OP_DOWNLOAD = 2
+FLAG_LAST = 0x01
+
+HEADER = struct.Struct('>BBIIH')
+CHUNK_SIZE = 64 * 1024
+
+MediaFrame = namedtuple('MediaFrame', 'op last transfer_id chunk_index content_type payload')
+
+
+class MediaFrameError(Exception):
+    """无效的媒体帧或上传失败"""
+
+    def __init__(self, message, transfer_id=None):
+        super().__init__(message)
+        self.transfer_id = transfer_id
+
+
+def encode_frame(op, transfer_id, chunk_index, payload, content_type='', last=False):
+    """编码一个媒体帧"""
+    content_type = content_type.encode('ascii')
+    header = HEADER.pack(op, FLAG_LAST if last else 0, transfer_id, chunk_index, len(content_type))
+    return b''.join((header, content_type, payload))
+
+
+def decode_frame(data):
+    """解码一个媒体帧，payload 是原数据的 memoryview（不复制）"""
+    if len(data) < HEADER.size:
+        raise MediaFrameError('媒体帧太短')
+    op, flags, transfer_id, chunk_index, type_len = HEADER.unpack_from(data)
+    body_start = HEADER.size + type_len
+    if len(data) < body_start:
+        raise MediaFrameError('媒体帧头部不完整', transfer_id)
+    try:
+        content_type = bytes(data[HEADER.size:body_start]).decode('ascii')
+    except UnicodeDecodeError:
+        raise MediaFrameError('无效的内容类型', transfer_id)
+    return MediaFrame(op, bool(flags & FLAG_LAST), transfer_id, chunk_index, content_type,
+                      memoryview(data)[body_start:])
+
+
+class MediaUploads:
+    """一个连接上正在进行的分块上传（blob 文件的创建、写入、提交和放弃都在 executor 中执行）"""
+
+    def __init__(self, blob_store, executor, max_size=None, max_transfers=4):
+        self.blob_store = blob_store
+        self.executor = executor
+        self.max_size = max_size
+        self.max_transfers = max_transfers
+        self.transfers = {}  # {transfer_id: {'writer': BlobWriter, 'next_chunk': int}}
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def feed(self, frame):
+        """处理一个上传帧；最后一块时返回 blob 信息，否则返回 None"""
+        transfer_id = frame.transfer_id
+        if frame.op != OP_UPLOAD:
+            raise MediaFrameError('不支持的媒体帧类型', transfer_id)
+
+        transfer = self.transfers.get(transfer_id)
+        if transfer is None:
+            if frame.chunk_index != 0:
+                raise MediaFrameError('上传不存在或已结束', transfer_id)
+            if len(self.transfers) >= self.max_transfers:
+                raise MediaFrameError('同时进行的上传过多', transfer_id)
+            content_type = normalize_content_type(frame.content_type)
+            if content_type is None:
+                raise MediaFrameError('不支持的文件类型', transfer_id)
+            writer = await self._run(self.blob_store.writer, content_type, self.max_size)
+            transfer = {'writer': writer, 'next_chunk': 0}
+            self.transfers[transfer_id] = transfer
+
+        if frame.chunk_index != transfer['next_chunk']:
+            self.abort(transfer_id)
+            raise MediaFrameError(f'分块顺序错误: 期望 {transfer["next_chunk"]}，收到 {frame.chunk_index}', transfer_id)
+
+        try:
+            await self._run(transfer['writer'].write, frame.payload)
+        except BlobTooLarge as e:
+            del self.transfers[transfer_id]
+            raise MediaFrameError(str(e), transfer_id)
+        transfer['next_chunk'] += 1
+
+        if frame.last:
+            del self.transfers[transfer_id]
+            return await self._run(transfer['writer'].commit)
+        return None
+
+    def abort(self, transfer_id):
+        """放弃一个上传：删除临时文件排在已提交的写入之后，不等待"""
+        transfer = self.transfers.pop(transfer_id, None)
+        if transfer is not None:
+            self.executor.submit(transfer['writer'].abort)
+
+    def close(self):
+        """连接断开时放弃所有未完成的上传"""
+        for transfer_id in list(self.transfers):
+            self.abort(transfer_id)
+
+
+async def iter_download_frames(blob_store, info, transfer_id, executor, chunk_size=CHUNK_SIZE):
+    """把一个 blob 编码为下载帧序列（第 0 块携带内容类型，空文件也有一帧）；文件在 executor 中读取"""
+    loop = asyncio.get_running_loop()
+    size = info['size']
+    chunk_count = max(1, -(-size // chunk_size))
+    chunks = blob_store.read_range(info['blob_id'], 0, size, chunk_size)
+    try:
+        for chunk_index in range(chunk_count):
+            payload = await loop.run_in_executor(executor, next, chunks, b'')
+            yield encode_frame(
+                OP_DOWNLOAD, transfer_id, chunk_index, payload,
+                info['content_type'] if chunk_index == 0 else '',
+                last=chunk_index == chunk_count - 1
+            )
+    finally:
+        # 中途取消时关闭文件（同样在 executor 中，排在最后一次读取之后）
+        executor.submit(chunks.close)
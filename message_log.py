@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+消息追加日志 - 用换行分隔的 JSON 日志代替每次整文件重写 messages.json
+
+每条消息只追加一行记录（O(1) 写入），启动时先加载快照再重放日志，
+日志记录数超过阈值后压缩为新快照并截断日志。
+记录如何应用到消息上由调用方决定（JsonStorage 用 storage._apply_message_record）。
+"""
+
+import json
+import os
+
+
+class MessageLog:
+    """消息快照 + 追加日志
+
+    快照格式: {"log_seq": N, "chats": {chat_key: [messages]}}，
+    log_seq 之前（含）的日志记录都已包含在快照中，重放时跳过，
+    这样即使压缩过程中崩溃也不会重复应用记录。
+    旧版 messages.json（直接是 {chat_key: [messages]}）同样可以加载。
+    """
+
+    def __init__(self, snapshot_path, log_path, compact_threshold=10000):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.compact_threshold = compact_threshold
+        self.seq = 0  # 最后一条日志记录的序号
+        self.pending_records = 0  # 快照之后追加的记录数
+        self._file = None
+
+    def load(self, apply, store_factory=None):
+        """加载快照并重放日志，返回重放后的 store
+
+        快照中的 {chat_key: [messages]} 先用 store_factory(chats) 转换（默认不转换），
+        之后每条日志记录用 apply(store, record) 重放。
+        """
+        store = {}
+        snapshot_seq = 0
+
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data.get('log_seq'), int) and isinstance(data.get('chats'), dict):
+                store = data['chats']
+                snapshot_seq = data['log_seq']
+            else:
+                store = data  # 旧版格式
+
+        if store_factory is not None:
+            store = store_factory(store)
+        self.seq = snapshot_seq
+        self.pending_records = 0
+
+        if os.path.exists(self.log_path):
+            valid_size = 0
+            with open(self.log_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # 写入中途崩溃留下的半行
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    valid_size += len(line)
+                    seq = record.get('seq', 0)
+                    if seq <= snapshot_seq:
+                        continue
+                    apply(store, record)
+                    self.seq = seq
+                    self.pending_records += 1
+
+            # 截掉损坏的尾部，保证后续追加的记录从新行开始
+            if valid_size < os.path.getsize(self.log_path):
+                print(f'⚠️  消息日志尾部损坏，已截断到 {valid_size} 字节')
+                with open(self.log_path, 'r+b') as f:
+                    f.truncate(valid_size)
+
+        return store
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.log_path, 'a', encoding='utf-8')
+        return self._file
+
+    def append(self, record):
+        """追加一条记录（只写一行，不重写历史）"""
+        self.append_many([record])
+
+    def append_many(self, records, fsync=False):
+        """批量追加记录，一次写入、一次 flush（可选 fsync）"""
+        lines = []
+        for record in records:
+            self.seq += 1
+            lines.append(json.dumps({'seq': self.seq, **record}, ensure_ascii=False, separators=(',', ':')))
+        f = self._open()
+        f.write('\n'.join(lines) + '\n')
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+        self.pending_records += len(records)
+
+    def needs_compaction(self):
+        return self.pending_records >= self.compact_threshold
+
+    def compact(self, store):
+        """把当前消息 {chat_key: [messages]} 写成新快照并清空日志"""
+        chats = json.dumps(store, ensure_ascii=False)
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f'{{"log_seq":{self.seq},"chats":{chats}}}')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        # 快照已包含全部记录，截断日志
+        self.close()
+        open(self.log_path, 'w').close()
+        self.pending_records = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本地模拟的 Claude Messages API（用于测试和本地调试，不访问外网）
+
+- 普通请求返回 JSON
+- "stream": true 时按 SSE 格式逐段返回（message_start / content_block_delta / message_delta / message_stop）
+
+回复内容为 reply_prefix + 用户消息（可截断），便于测试核对。本地调试：
+
+    python mock_llm_server.py 8090
+    ANTHROPIC_API_KEY=test ANTHROPIC_API_URL=http://localhost:8090/v1/messages python server.py
+"""
+
+import asyncio
+import json
+import sys
+
+from aiohttp import web
+
+
+def sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'.encode('utf-8')
+
+
+def create_mock_llm_app(reply_prefix='总结：', chunk_size=4, delay=0.01, fail_after=None, max_reply_chars=None):
+    """chunk_size: 每个 SSE 片段的字符数；delay: 片段间隔（秒）；fail_after: 发送这么多片段后返回 error 事件；
+    max_reply_chars: 回复中最多带多少个用户消息的字符（模拟总结比原文短）"""
+
+    async def messages_handler(request):
+        body = await request.json()
+        text = reply_prefix + body['messages'][0]['content'][:max_reply_chars]
+        usage = {'input_tokens': len(body['messages'][0]['content']), 'output_tokens': len(text)}
+
+        if not body.get('stream'):
+            return web.json_response({
+                'type': 'message',
+                'role': 'assistant',
+                'content': [{'type': 'text', 'text': text}],
+                'usage': usage
+            })
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        await response.write(sse_event('message_start', {
+            'type': 'message_start',
+            'message': {'type': 'message', 'role': 'assistant', 'content': [],
+                        'usage': {'input_tokens': usage['input_tokens'], 'output_tokens': 1}}
+        }))
+        await response.write(sse_event('content_block_start', {
+            'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}
+        }))
+        await response.write(sse_event('ping', {'type': 'ping'}))
+        for i, start in enumerate(range(0, len(text), chunk_size)):
+            if fail_after is not None and i >= fail_after:
+                await response.write(sse_event('error', {
+                    'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'Overloaded'}
+                }))
+                return response
+            await asyncio.sleep(delay)
+            await response.write(sse_event('content_block_delta', {
+                'type': 'content_block_delta', 'index': 0,
+                'delta': {'type': 'text_delta', 'text': text[start:start + chunk_size]}
+            }))
+        await response.write(sse_event('content_block_stop', {'type': 'content_block_stop', 'index': 0}))
+        await response.write(sse_event('message_delta', {
+            'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'},
+            'usage': {'output_tokens': usage['output_tokens']}
+        }))
+        await response.write(sse_event('message_stop', {'type': 'message_stop'}))
+        return response
+
+    app = web.Application()
+    app.router.add_post('/v1/messages', messages_handler)
+    return app
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8090
+    print(f'🧪 模拟 Messages API: http://localhost:{port}/v1/messages')
+    web.run_app(create_mock_llm_app(), port=port)
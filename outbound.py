@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+每个 WebSocket 连接的发送队列
+
+处理消息时只把帧放进接收方的队列（不等待网络），由该连接自己的写任务按顺序发送。
+一个慢客户端只会堆积自己的队列，不会拖慢其他接收者和发送者的处理。
+队列有上限，超过上限时按策略处理：
+    disconnect - 断开慢连接（客户端重连后通过历史同步补齐消息，默认）
+    drop       - 丢弃新帧
+"""
+
+import asyncio
+import json
+
+from aiohttp import WSCloseCode
+
+# 优先使用 orjson 编码（更快），未安装时退回标准库
+try:
+    import orjson
+
+    def encode_json(data):
+        """把消息编码为 JSON 文本帧"""
+        return orjson.dumps(data).decode('utf-8')
+
+    JSON_ENCODER = 'orjson'
+except ImportError:
+    def encode_json(data):
+        """把消息编码为 JSON 文本帧"""
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+    JSON_ENCODER = 'json'
+
+POLICY_DISCONNECT = 'disconnect'
+POLICY_DROP = 'drop'
+
+# 全局统计（/api/metrics）
+outbound_stats = {
+    'frames_enqueued': 0,
+    'frames_sent': 0,
+    'frames_dropped': 0,
+    'send_errors': 0,
+    'slow_disconnects': 0,
+    'max_queue_depth': 0
+}
+
+
+class OutboundQueue:
+    """单个连接的有界发送队列 + 独立写任务"""
+
+    def __init__(self, ws, max_size=1000, policy=POLICY_DISCONNECT):
+        if policy not in (POLICY_DISCONNECT, POLICY_DROP):
+            raise ValueError(f'未知的慢连接策略: {policy}')
+        self.ws = ws
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.dropped = 0
+        self.closed = False
+        # 批量发送（put_wait）在队列低于一半时继续，给普通消息留出空间
+        self._low_water = max(1, max_size // 2)
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def put(self, payload):
+        """放入一帧（dict、已编码的 str 或二进制 bytes），不等待发送
+
+        扇出时先用 encode_json 编码一次，再把同一个 str 放进每个接收者的队列。
+        """
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            outbound_stats['frames_dropped'] += 1
+            if self.policy == POLICY_DISCONNECT:
+                print(f'⚠️  发送队列已满 ({self.queue.maxsize})，断开慢连接')
+                outbound_stats['slow_disconnects'] += 1
+                self.closed = True
+                self._drained.set()
+                asyncio.get_running_loop().create_task(
+                    self.ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b'slow consumer')
+                )
+            return False
+
+        outbound_stats['frames_enqueued'] += 1
+        depth = self.queue.qsize()
+        if depth > outbound_stats['max_queue_depth']:
+            outbound_stats['max_queue_depth'] = depth
+        return True
+
+    async def put_wait(self, payload):
+        """放入一帧，队列超过一半时等待写任务发送
+
+        用于文件下载等批量发送：发送方按连接速度推进，不会占满队列而触发慢连接策略。
+        """
+        while not self.closed and self.queue.qsize() >= self._low_water:
+            self._drained.clear()
+            await self._drained.wait()
+        return self.put(payload)
+
+    async def _run(self):
+        while True:
+            payload = await self.queue.get()
+            try:
+                if isinstance(payload, bytes):
+                    await self.ws.send_bytes(payload)
+                else:
+                    if not isinstance(payload, str):
+                        payload = encode_json(payload)
+                    await self.ws.send_str(payload)
+                outbound_stats['frames_sent'] += 1
+            except Exception as e:
+                # 连接已断开，剩余的帧无法再发送
+                outbound_stats['send_errors'] += 1
+                print(f'发送消息失败: {e}')
+                self.closed = True
+                self._drained.set()
+                return
+            if self.queue.qsize() < self._low_water:
+                self._drained.set()
+
+    async def close(self):
+        """停止写任务（连接断开时调用）"""
+        self.closed = True
+        self._drained.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def depth(self):
+        return self.queue.qsize()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+PDF 按页提取结果缓存
+
+同一个 PDF 反复上传（例如多次总结都带着同一个 context_pdf）时不用重新解析：
+- 文档记录以文件内容的 SHA-256 为 key，保存总页数和每一页的页面 key；整个文档命中时完全不进入解析进程
+- 页面文本以页面 key（页面内容流、字体、旋转角度的 SHA-256）为 key，
+  修改过的文档只重新解析变化的页，没变的页直接复用
+- 内存中按 LRU 淘汰（最多 max_memory_bytes），同时写入磁盘目录（最多 max_disk_bytes，超出时删除最久未用的），
+  重启后仍然有效；磁盘读写在线程池中执行，不阻塞事件循环
+"""
+
+import asyncio
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class PdfPageCache:
+    """cache_dir 为 None 或 max_disk_bytes 为 0 时只缓存在内存中"""
+
+    def __init__(self, cache_dir=None, max_memory_bytes=32 * 1024 * 1024, max_disk_bytes=512 * 1024 * 1024,
+                 max_documents=1000):
+        self.cache_dir = cache_dir if max_disk_bytes else None
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_documents = max_documents
+        self._pages = OrderedDict()  # {页面 key: 文本}，最近使用的在末尾
+        self._memory_bytes = 0
+        self._documents = OrderedDict()  # {文档 SHA-256: (总页数, [页面 key])}
+        self._disk = OrderedDict()  # {相对路径: 字节数}，最久未用的在前面
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'document_hits': 0, 'document_misses': 0, 'memory_hits': 0, 'disk_hits': 0,
+                       'page_misses': 0, 'stores': 0, 'memory_evictions': 0, 'disk_evictions': 0}
+        if self.cache_dir:
+            self._scan()
+
+    # ---------- 磁盘 ----------
+
+    @staticmethod
+    def _page_path(key):
+        return os.path.join('pages', key[:2], key + '.txt')
+
+    @staticmethod
+    def _document_path(digest):
+        return os.path.join('documents', digest[:2], digest + '.json')
+
+    def _scan(self):
+        """启动时按修改时间加载磁盘上已有的缓存文件"""
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith('.tmp'):
+                    os.remove(path)  # 上次没写完的文件
+                    continue
+                st = os.stat(path)
+                files.append((st.st_mtime, os.path.relpath(path, self.cache_dir), st.st_size))
+        for _, rel, size in sorted(files):
+            self._disk[rel] = size
+            self._disk_bytes += size
+        if files:
+            print(f'✅ PDF页面缓存: 磁盘上有 {len(files)} 个文件, {self._disk_bytes // 1024}KB')
+
+    def _read_file(self, rel):
+        try:
+            with open(os.path.join(self.cache_dir, rel), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_files(self, writes, deletes):
+        with self._lock:
+            for rel, data in writes:
+                path = os.path.join(self.cache_dir, rel)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(path + '.tmp', path)
+            for rel in deletes:
+                try:
+                    os.remove(os.path.join(self.cache_dir, rel))
+                except OSError:
+                    pass
+
+    async def _store(self, items):
+        """把 [(相对路径, 文本)] 写入磁盘，超出 max_disk_bytes 时删除最久未用的文件"""
+        if not self.cache_dir:
+            return
+        writes = []
+        for rel, data in items:
+            size = len(data.encode('utf-8'))
+            self._disk_bytes += size - self._disk.pop(rel, 0)
+            self._disk[rel] = size
+            writes.append((rel, data))
+        deletes = []
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > len(writes):
+            rel, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            deletes.append(rel)
+        self._stats['disk_evictions'] += len(deletes)
+        try:
+            await asyncio.to_thread(self._write_files, writes, deletes)
+        except OSError as e:
+            print(f'⚠️ PDF页面缓存写入失败: {e}')
+
+    async def _load(self, rel):
+        if not self.cache_dir or rel not in self._disk:
+            return None
+        data = await asyncio.to_thread(self._read_file, rel)
+        if data is None:
+            # 文件已被删除
+            self._disk_bytes -= self._disk.pop(rel, 0)
+        elif rel in self._disk:
+            self._disk.move_to_end(rel)
+        return data
+
+    # ---------- 内存 ----------
+
+    def _remember_page(self, key, text):
+        size = len(text.encode('utf-8'))
+        if key in self._pages:
+            self._memory_bytes -= len(self._pages.pop(key).encode('utf-8'))
+        self._pages[key] = text
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes and len(self._pages) > 1:
+            _, evicted = self._pages.popitem(last=False)
+            self._memory_bytes -= len(evicted.encode('utf-8'))
+            self._stats['memory_evictions'] += 1
+
+    def _remember_document(self, digest, page_count, page_keys):
+        self._documents[digest] = (page_count, page_keys)
+        self._documents.move_to_end(digest)
+        while len(self._documents) > self.max_documents:
+            self._documents.popitem(last=False)
+
+    # ---------- 接口 ----------
+
+    async def get_document(self, digest):
+        """返回文档的 (总页数, [页面 key])，没有记录返回 None"""
+        entry = self._documents.get(digest)
+        if entry is not None:
+            self._documents.move_to_end(digest)
+            return entry
+        data = await self._load(self._document_path(digest))
+        if data is None:
+            return None
+        try:
+            record = json.loads(data)
+            entry = (record['page_count'], record['pages'])
+        except (ValueError, KeyError):
+            return None
+        self._remember_document(digest, *entry)
+        return entry
+
+    async def put_document(self, digest, page_count, page_keys):
+        self._remember_document(digest, page_count, page_keys)
+        await self._store([(self._document_path(digest),
+                            json.dumps({'page_count': page_count, 'pages': page_keys}))])
+
+    async def get_page(self, key):
+        """返回页面文本，没有缓存返回 None"""
+        text = self._pages.get(key)
+        if text is not None:
+            self._pages.move_to_end(key)
+            self._stats['memory_hits'] += 1
+            return text
+        text = await self._load(self._page_path(key))
+        if text is None:
+            self._stats['page_misses'] += 1
+            return None
+        self._stats['disk_hits'] += 1
+        self._remember_page(key, text)
+        return text
+
+    async def get_pages(self, keys):
+        """返回 {页面 key: 文本}，只包含命中的页"""
+        found = {}
+        for key in keys:
+            if key not in found:
+                text = await self.get_page(key)
+                if text is not None:
+                    found[key] = text
+        return found
+
+    async def put_pages(self, pages):
+        """pages 为 {页面 key: 文本}"""
+        for key, text in pages.items():
+            self._remember_page(key, text)
+        self._stats['stores'] += len(pages)
+        await self._store([(self._page_path(key), text) for key, text in pages.items()])
+
+    def record_document(self, hit):
+        """记录文档级别的命中（整个文档不用解析）或未命中"""
+        self._stats['document_hits' if hit else 'document_misses'] += 1
+
+    def stats(self):
+        page_hits = self._stats['memory_hits'] + self._stats['disk_hits']
+        page_lookups = page_hits + self._stats['page_misses']
+        document_lookups = self._stats['document_hits'] + self._stats['document_misses']
+        return {
+            **self._stats,
+            'document_hit_rate': self._stats['document_hits'] / document_lookups if document_lookups else 0.0,
+            'page_hit_rate': page_hits / page_lookups if page_lookups else 0.0,
+            'memory_pages': len(self._pages),
+            'memory_bytes': self._memory_bytes,
+            'max_memory_bytes': self.max_memory_bytes,
+            'disk_files': len(self._disk),
+            'disk_bytes': self._disk_bytes,
+            'max_disk_bytes': self.max_disk_bytes
+        }
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+PDF 文本提取（进程池）
+
+PyPDF2 解析是纯 CPU 计算，在事件循环里直接解析一个大 PDF 会卡住所有连接（聊天、视频信令、3D战场）。
+这里把解析放到独立的工作进程中：
+- 同时解析的文档数等于工作进程数，其余排队等待
+- 每个文档有解析超时，超时的工作进程会被终止，进程池重建
+- 最多提取前 max_pages 页
+- 上传的 PDF 已经在临时文件中时只传文件路径，工作进程用内存映射读取
+- 配置了 PdfPageCache 时按文档哈希和页面 key 复用之前的提取结果：整个文档命中时不进入工作进程，
+  部分页面变化时先计算页面 key（只读内容流，比提取文本快得多），再只提取没有缓存的页
+"""
+
+import asyncio
+import hashlib
+import io
+import mmap
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import PyPDF2
+    from PyPDF2.generic import IndirectObject, StreamObject
+    PDF_SUPPORT = True
+except ImportError:
+    PDF_SUPPORT = False
+
+# 页面 key 的版本，修改提取方式后改这里，旧的缓存自动失效
+PAGE_KEY_VERSION = b'pypdf2-extract-text-1'
+
+
+class PdfExtractError(Exception):
+    pass
+
+
+def _open_source(source):
+    """返回 (可读的流, 需要关闭的对象)；source 为 PDF 字节数据或文件路径（文件以内存映射方式读取，不复制到进程间管道）"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source), None
+    with open(source, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return mm, mm
+
+
+def extract_pages(source, max_pages, page_numbers=None):
+    """在工作进程中执行：返回 (总页数, 页面文本列表)
+
+    page_numbers 为 None 时提取前 max_pages 页，否则只提取指定的页（从 0 开始）
+    """
+    stream, handle = _open_source(source)
+    try:
+        reader = PyPDF2.PdfReader(stream)
+        page_count = len(reader.pages)
+        if page_numbers is None:
+            page_numbers = range(min(page_count, max_pages))
+        return page_count, [reader.pages[page_num].extract_text() or '' for page_num in page_numbers]
+    finally:
+        if handle is not None:
+            handle.close()
+
+
+def page_keys(source, max_pages):
+    """在工作进程中执行：返回 (总页数, 前 max_pages 页的页面 key)"""
+    stream, handle = _open_source(source)
+    try:
+        reader = PyPDF2.PdfReader(stream)
+        page_count = len(reader.pages)
+        memo = {}
+        return page_count, [_page_key(reader.pages[page_num], memo) for page_num in range(min(page_count, max_pages))]
+    finally:
+        if handle is not None:
+            handle.close()
+
+
+def _page_key(page, memo):
+    """页面 key：内容流、用到的字体和表单对象、旋转角度的 SHA-256，提取出的文本只取决于这些"""
+    h = hashlib.sha256(PAGE_KEY_VERSION)
+    h.update(str(page.get('/Rotate', 0)).encode())
+    contents = page.get_contents()
+    h.update(contents.get_data() if contents is not None else b'')
+    h.update(_resources_digest(page.get('/Resources'), memo))
+    return h.hexdigest()
+
+
+def _resources_digest(resources, memo):
+    h = hashlib.sha256()
+    resources = resources.get_object() if resources is not None else {}
+    for group in ('/Font', '/XObject'):
+        entries = resources.get(group)
+        if entries is not None:
+            h.update(group.encode())
+            h.update(_object_digest(entries, memo))
+    return h.digest()
+
+
+def _object_digest(ref, memo):
+    """字体、XObject 等对象的摘要（递归计算引用的对象，不依赖对象编号），同一个文档里共用的对象只计算一次"""
+    ident = (ref.idnum, ref.generation) if isinstance(ref, IndirectObject) else None
+    if ident is not None:
+        if ident in memo:
+            return memo[ident]
+        memo[ident] = b''  # 防止循环引用
+    obj = ref.get_object()
+    h = hashlib.sha256(type(obj).__name__.encode())
+    if isinstance(obj, StreamObject):
+        # 图片数据不影响提取的文本，其他流（ToUnicode、表单、字体文件）计算内容
+        h.update(b'image' if obj.get('/Subtype') == '/Image' else obj.get_data())
+    if hasattr(obj, 'items'):
+        for key, value in sorted(obj.items()):
+            if key not in ('/Parent', '/Length', '/Filter', '/DecodeParms'):
+                h.update(key.encode())
+                h.update(_object_digest(value, memo))
+    elif isinstance(obj, list):
+        for value in obj:
+            h.update(_object_digest(value, memo))
+    else:
+        h.update(repr(obj).encode())
+    digest = h.digest()
+    if ident is not None:
+        memo[ident] = digest
+    return digest
+
+
+def source_digest(source):
+    """PDF 字节数据或文件的 SHA-256（在线程池中调用）"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(source).hexdigest()
+    h = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def format_pages(pages, page_count=None):
+    """拼接成 [第N页] 分隔的文本（跳过空白页），超出页数上限时在末尾注明"""
+    text_content = [f"[第{page_num + 1}页]\n{text}" for page_num, text in enumerate(pages) if text.strip()]
+    if page_count is not None and page_count > len(pages):
+        text_content.append(f"（PDF 共 {page_count} 页，只提取了前 {len(pages)} 页）")
+    return '\n\n'.join(text_content)
+
+
+def _warm_up():
+    return None
+
+
+class PdfExtractor:
+    """max_workers: 工作进程数；timeout: 每个文档的解析超时（秒）；max_pages: 最多提取的页数；
+    cache: PdfPageCache，为 None 时每次都完整解析"""
+
+    def __init__(self, max_workers=2, timeout=60, max_pages=500, cache=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_pages = max_pages
+        self.cache = cache
+        self._pool = None
+        self._slots = None  # 同一时间最多 max_workers 个文档在解析，超时只计算解析时间
+        self._stats = {'documents': 0, 'pages': 0, 'pages_parsed': 0, 'pages_reused': 0, 'truncated': 0,
+                       'timeouts': 0, 'failures': 0, 'restarts': 0, 'extract_time_total': 0.0}
+
+    def _get_pool(self):
+        if self._pool is None:
+            # Linux 上用 fork：spawn 会在工作进程里重新导入 server.py 的模块级代码
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        return self._pool
+
+    async def start(self):
+        """预先启动工作进程（应用启动时调用），第一次解析 PDF 时不用等进程启动"""
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        await asyncio.gather(*[loop.run_in_executor(pool, _warm_up) for _ in range(self.max_workers)])
+
+    def _restart(self, pool):
+        """终止卡住的工作进程，下次解析时重建进程池"""
+        if self._pool is not pool:
+            return
+        self._pool = None
+        self._stats['restarts'] += 1
+        # ProcessPoolExecutor 没有公开的终止接口，只能直接终止它的进程
+        for process in list((getattr(pool, '_processes', None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, deadline, func, *args):
+        """在工作进程中执行 func，deadline 为整个文档的解析截止时间"""
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            pool = self._get_pool()
+            try:
+                return await asyncio.wait_for(loop.run_in_executor(pool, func, *args),
+                                              max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                self._stats['timeouts'] += 1
+                self._restart(pool)
+                raise PdfExtractError(f'PDF解析超时（超过 {self.timeout} 秒）')
+            except BrokenProcessPool:
+                # 其他文档超时导致进程池重建，重试一次
+                self._restart(pool)
+                if attempt == 1:
+                    self._stats['failures'] += 1
+                    raise PdfExtractError('PDF解析进程异常退出')
+            except Exception as e:
+                self._stats['failures'] += 1
+                raise PdfExtractError(f'PDF解析失败: {e}')
+
+    async def _cached_pages(self, digest):
+        """整个文档都在缓存中时返回 (总页数, 页面 key, 页面文本)，否则返回 (总页数, 页面 key, None)"""
+        document = await self.cache.get_document(digest)
+        if document is None:
+            return None, None, None
+        page_count, keys = document
+        if len(keys) < min(page_count, self.max_pages):
+            return None, None, None  # 上次的页数上限比现在小
+        keys = keys[:self.max_pages]
+        found = await self.cache.get_pages(keys)
+        if len(found) < len(set(keys)):
+            return page_count, keys, None
+        return page_count, keys, [found[key] for key in keys]
+
+    async def extract(self, source, digest=None):
+        """source 为 PDF 字节数据或文件路径，返回提取的文本（[第N页] 分隔）；解析失败或超时抛出 PdfExtractError
+
+        digest 为文件内容的 SHA-256（上传时已经算好的可以直接传入），用作缓存的 key
+        """
+        if not PDF_SUPPORT:
+            raise PdfExtractError('PDF处理库未安装，请运行: pip install PyPDF2')
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+
+        if isinstance(source, (str, os.PathLike)):
+            source = os.fspath(source)
+        else:
+            source = bytes(source)
+
+        started_at = time.monotonic()
+        page_count = keys = pages = None
+        if self.cache is not None:
+            if digest is None:
+                digest = await asyncio.to_thread(source_digest, source)
+            page_count, keys, pages = await self._cached_pages(digest)
+            self.cache.record_document(pages is not None)
+
+        reused = 0
+        if pages is None:
+            async with self._slots:
+                deadline = time.monotonic() + self.timeout
+                if self.cache is None:
+                    page_count, pages = await self._run(deadline, extract_pages, source, self.max_pages)
+                    parsed = pages
+                else:
+                    if keys is None:
+                        page_count, keys = await self._run(deadline, page_keys, source, self.max_pages)
+                    found = await self.cache.get_pages(keys)
+                    missing = sorted({page_num for page_num, key in enumerate(keys) if key not in found})
+                    parsed = []
+                    if missing:
+                        _, parsed = await self._run(deadline, extract_pages, source, self.max_pages, missing)
+                        found.update({keys[page_num]: text for page_num, text in zip(missing, parsed)})
+                    pages = [found[key] for key in keys]
+                    reused = len(pages) - len(missing)
+            self._stats['pages_parsed'] += len(parsed)
+            if self.cache is not None:
+                await self.cache.put_pages({keys[page_num]: text for page_num, text in zip(missing, parsed)})
+                await self.cache.put_document(digest, page_count, keys)
+        else:
+            reused = len(pages)
+        self._stats['pages_reused'] += reused
+
+        elapsed = time.monotonic() - started_at
+        self._stats['documents'] += 1
+        self._stats['pages'] += len(pages)
+        self._stats['extract_time_total'] += elapsed
+        if page_count > len(pages):
+            self._stats['truncated'] += 1
+        result = format_pages(pages, page_count)
+        reused_note = f', 复用缓存{reused}页' if reused else ''
+        print(f'✅ PDF解析完成: {page_count}页{reused_note}, {len(result)}字符, {elapsed:.2f}s')
+        return result
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        documents = self._stats['documents']
+        return {
+            **self._stats,
+            'workers': self.max_workers,
+            'timeout': self.timeout,
+            'max_pages': self.max_pages,
+            'extract_time_avg': self._stats['extract_time_total'] / documents if documents else 0.0,
+            'cache': self.cache.stats() if self.cache is not None else None
+        }
+
+
+def make_text_pdf(pages):
+    """生成只包含文本的简单 PDF（测试和性能对比用），pages 为每页的文本行列表"""
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None,
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for lines in pages:
+        ops = ['BT', '/F1 10 Tf', '40 800 Td', '12 TL']
+        for line in lines:
+            escaped = line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            ops.append(f'({escaped}) Tj T*')
+        ops.append('ET')
+        stream = '\n'.join(ops).encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                       b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % content_id)
+        kids.append(len(objects))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+        b' '.join(b'%d 0 R' % kid for kid in kids), len(kids))
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n%s\nendobj\n' % (i, body))
+    xref_offset = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b'%010d 00000 n \n' % offset)
+    out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref_offset))
+    return out.getvalue()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+写后（write-behind）持久化任务 - 把所有磁盘 I/O 移出 asyncio 事件循环
+
+- 所有修改以记录的形式按顺序排队，批量交给存储后端（storage.py）应用
+- 按时间间隔或积压数量触发批量刷新，I/O 在单线程线程池中执行（保证顺序）
+- 需要读取消息的操作（历史分页、群消息已读）用 call() 在写线程中执行，先写完排队的记录，
+  查询结果包含之前的所有修改
+- 持久化模式：
+    always - 每次写入立即刷新并落盘，调用 commit() 会等待写入完成
+    group  - 组提交，按间隔/阈值批量刷新，每批落盘一次
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+DURABILITY_ALWAYS = 'always'
+DURABILITY_GROUP = 'group'
+
+
+class PersistenceWriter:
+    """批量写后持久化"""
+
+    def __init__(self, storage, flush_interval=0.2, batch_size=500, durability=DURABILITY_GROUP):
+        if durability not in (DURABILITY_ALWAYS, DURABILITY_GROUP):
+            raise ValueError(f'未知的持久化模式: {durability}')
+
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.durability = durability
+
+        self._queue = []  # 待写入的记录
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='persistence')
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = False
+
+        # 统计
+        self.flush_count = 0
+        self.records_written = 0
+
+    def append(self, record):
+        """排队一条记录"""
+        self._queue.append(record)
+        self._notify()
+
+    def pending(self):
+        return len(self._queue)
+
+    def _notify(self):
+        if self.durability == DURABILITY_ALWAYS or self.pending() >= self.batch_size:
+            self._wakeup.set()
+
+    def _write_batch(self, records):
+        """在写线程中执行：按顺序应用记录（需要压缩时由存储后端自己压缩）"""
+        self.storage.apply_batch(records)
+        self.records_written += len(records)
+
+    def _call(self, records, func, args):
+        """在写线程中执行：先写完排队的记录，再调用 func"""
+        if records:
+            try:
+                self._write_batch(records)
+                self.flush_count += 1
+            except Exception as e:
+                print(f'❌ 持久化写入失败: {e}')
+        return func(*args)
+
+    async def flush(self):
+        """把当前排队的所有写入刷到磁盘"""
+        async with self._lock:
+            records, self._queue = self._queue, []
+            if not records:
+                return
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(self._executor, self._write_batch, records)
+                self.flush_count += 1
+            except Exception as e:
+                print(f'❌ 持久化写入失败: {e}')
+
+    async def call(self, func, *args):
+        """在写线程中调用 func(*args) 并返回结果（存储查询），此前排队的记录会先写入"""
+        async with self._lock:
+            records, self._queue = self._queue, []
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._call, records, func, args)
+
+    async def commit(self):
+        """always 模式下等待本次修改落盘；group 模式下立即返回"""
+        if self.durability == DURABILITY_ALWAYS:
+            await self.flush()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """停止后台任务并把剩余数据全部写入（服务器关闭时调用）
+
+        用标记 + 唤醒让后台任务自己退出，而不是 cancel：wait_for 等待的事件恰好同时被设置时，
+        Python 3.11 的 wait_for 会吞掉取消，后台任务会继续等下一个 flush_interval。
+        """
+        self._closing = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.storage.close)
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        return {
+            'durability': self.durability,
+            'pending': self.pending(),
+            'flush_count': self.flush_count,
+            'records_written': self.records_written
+        }
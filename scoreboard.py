@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+3D战场积分榜
+
+原来每次击中、加入、离开都把整个积分字典广播给所有玩家，玩家多时每次攻击都是 O(玩家数²)。现在：
+- Scoreboard 用按分数排序的列表（bisect 维护）保存积分，排名和前 K 名查询不用每次排序
+- ScoreFeed 在3D战场的 tick 里合并下发：
+    3d_battle_score_delta - 本 tick 内变化的积分。前 K 名相关的变化广播给所有人（编码一次），
+                            其他人的变化只发给他自己
+    3d_battle_leaderboard - 每 snapshot_ticks 个 tick 最多一次、且积分有变化时下发前 K 名，
+                            附带每个人自己的名次和分数
+"""
+
+import bisect
+import itertools
+
+
+class Scoreboard:
+    """{玩家: 分数}，按分数从高到低排序（同分时先加入的在前）"""
+
+    def __init__(self):
+        self._keys = []  # [(-分数, 加入顺序, 玩家)]，升序即分数从高到低
+        self._entries = {}  # {玩家: (分数, 加入顺序)}
+        self._seq = itertools.count()
+        self._changed = set()
+        self.version = 0  # 每次变化加 1，用来判断是否需要新的快照
+
+    def _key(self, name):
+        score, seq = self._entries[name]
+        return (-score, seq, name)
+
+    def _unlink(self, name):
+        key = self._key(name)
+        del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def set(self, name, score):
+        entry = self._entries.get(name)
+        if entry is not None:
+            if entry[0] == score:
+                return
+            self._unlink(name)
+            seq = entry[1]
+        else:
+            seq = next(self._seq)
+        self._entries[name] = (score, seq)
+        bisect.insort(self._keys, (-score, seq, name))
+        self._changed.add(name)
+        self.version += 1
+
+    def add(self, name, delta):
+        """加分（delta 可以为负），返回新的分数"""
+        score = self._entries[name][0] + delta
+        self.set(name, score)
+        return score
+
+    def remove(self, name):
+        if name in self._entries:
+            self._unlink(name)
+            del self._entries[name]
+            self._changed.discard(name)
+            self.version += 1
+
+    def score(self, name):
+        entry = self._entries.get(name)
+        return entry[0] if entry is not None else None
+
+    def rank(self, name):
+        """名次（从 1 开始），不在榜上返回 None"""
+        if name not in self._entries:
+            return None
+        return bisect.bisect_left(self._keys, self._key(name)) + 1
+
+    def top(self, k):
+        """前 k 名 [(玩家, 分数)]"""
+        return [(name, -neg_score) for neg_score, _, name in self._keys[:k]]
+
+    def take_changes(self):
+        """返回上次调用之后分数变化过的玩家 {玩家: 新分数}"""
+        changed, self._changed = self._changed, set()
+        return {name: self._entries[name][0] for name in changed if name in self._entries}
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ScoreFeed:
+    """把 Scoreboard 的变化按 tick 合并成要发送的消息；top_k: 榜单显示的名次数，snapshot_ticks: 快照最短间隔"""
+
+    def __init__(self, scoreboard, top_k=10, snapshot_ticks=20):
+        self.scoreboard = scoreboard
+        self.top_k = top_k
+        self.snapshot_ticks = snapshot_ticks
+        self._top_names = set()  # 上次快照中的前 K 名
+        self._snapshot_version = None
+        self._last_snapshot_tick = None
+        self._stats = {'delta_broadcasts': 0, 'delta_personal': 0, 'snapshots': 0}
+
+    def snapshot(self, name, top=None):
+        """某个玩家的榜单快照（前 K 名 + 自己的名次和分数）"""
+        if top is None:
+            top = self.scoreboard.top(self.top_k)
+        return {
+            'type': '3d_battle_leaderboard',
+            'top': [[player, score] for player, score in top],
+            'total': len(self.scoreboard),
+            'rank': self.scoreboard.rank(name),
+            'score': self.scoreboard.score(name)
+        }
+
+    def on_tick(self, tick, players):
+        """返回本 tick 要发送的 [(接收者, 消息)]，接收者为 None 表示广播；players 为当前在线的玩家"""
+        messages = []
+        changes = self.scoreboard.take_changes()
+        if changes:
+            board = self.scoreboard
+            top_delta = {name: score for name, score in changes.items()
+                         if name in self._top_names or board.rank(name) <= self.top_k}
+            if top_delta:
+                messages.append((None, {'type': '3d_battle_score_delta', 'scores': top_delta}))
+                self._stats['delta_broadcasts'] += 1
+            for name, score in changes.items():
+                if name not in top_delta and name in players:
+                    messages.append((name, {'type': '3d_battle_score_delta', 'scores': {name: score}}))
+                    self._stats['delta_personal'] += 1
+
+        due = self._last_snapshot_tick is None or tick - self._last_snapshot_tick >= self.snapshot_ticks
+        if due and self.scoreboard.version != self._snapshot_version:
+            self._snapshot_version = self.scoreboard.version
+            self._last_snapshot_tick = tick
+            top = self.scoreboard.top(self.top_k)
+            self._top_names = {name for name, _ in top}
+            messages.extend((name, self.snapshot(name, top)) for name in players)
+            self._stats['snapshots'] += 1
+        return messages
+
+    def stats(self):
+        return {**self._stats, 'players': len(self.scoreboard), 'top_k': self.top_k,
+                'snapshot_ticks': self.snapshot_ticks}
@@ -6,38 +6,167 @@
 """
 
 import asyncio
+import base64
+import binascii
 import json
 import os
-import io
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import unquote
 from aiohttp import web
 import aiohttp_cors
-import aiohttp
-
-# PDF处理库
-try:
-    import PyPDF2
-    PDF_SUPPORT = True
-except ImportError:
-    PDF_SUPPORT = False
+
+from battle_sync import BATTLE_OPS, BattleFrameError, BattleSync, parse_position
+from blob_store import (BLOB_URL_PREFIX, BlobFileResponse, BlobStore, BlobTooLarge, blob_url,
+                        normalize_content_type)
+from connection_registry import ConnectionRegistry
+from geoip_cache import GeoIpCache, is_public_ip
+from geoip_resolver import create_geoip_resolver
+from http_clients import HttpClients
+from llm_client import LLMClient, LLMError, load_llm_config
+from media_transfer import MediaFrameError, MediaUploads, decode_frame, iter_download_frames
+from outbound import JSON_ENCODER, OutboundQueue, encode_json, outbound_stats
+from pdf_cache import PdfPageCache
+from pdf_extract import PDF_SUPPORT, PdfExtractor
+from persistence import PersistenceWriter
+from scoreboard import Scoreboard, ScoreFeed
+from storage import create_storage
+from summarizer import MapReduceSummarizer, estimate_tokens
+from summary_cache import SummaryCache, summary_key
+from upload_spool import UploadBudget, UploadBudgetExceeded, UploadTooLarge, read_field, spool_field
+
+# PDF处理库（解析在 pdf_extract 的工作进程中进行）
+if not PDF_SUPPORT:
     print('⚠️  警告: PyPDF2未安装，PDF功能将不可用。运行: pip install PyPDF2')
 
-# 数据存储文件路径
+# 数据存储目录
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
-MESSAGES_FILE = os.path.join(DATA_DIR, 'messages.json')
-GROUPS_FILE = os.path.join(DATA_DIR, 'groups.json')
-OFFLINE_MESSAGES_FILE = os.path.join(DATA_DIR, 'offline_messages.json')
-BOT_CONFIGS_FILE = os.path.join(DATA_DIR, 'bot_configs.json')
 
 # 确保数据目录存在
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# 存储后端: json（messages.json 快照 + 追加日志，默认）或 sqlite（data/chat.db，WAL 模式）
+# JSON 日志累计 MESSAGE_LOG_COMPACT_THRESHOLD 条记录后压缩为新快照
+# PERSIST_DURABILITY: always（每次写入都落盘，SQLite 使用 synchronous=FULL）或 group（组提交，默认）
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+MESSAGE_LOG_COMPACT_THRESHOLD = int(os.environ.get('MESSAGE_LOG_COMPACT_THRESHOLD', 10000))
+PERSIST_DURABILITY = os.environ.get('PERSIST_DURABILITY', 'group')
+storage = create_storage(STORAGE_BACKEND, DATA_DIR, MESSAGE_LOG_COMPACT_THRESHOLD, PERSIST_DURABILITY)
+
+# 写后持久化：存储 I/O 在线程池中批量执行，不阻塞事件循环
+persistence = PersistenceWriter(
+    storage,
+    flush_interval=float(os.environ.get('PERSIST_FLUSH_INTERVAL', 0.2)),
+    batch_size=int(os.environ.get('PERSIST_BATCH_SIZE', 500)),
+    durability=PERSIST_DURABILITY
+)
+
+# 登录时每个会话推送的最近消息条数，更早的消息由客户端分页拉取（单页最多 HISTORY_PAGE_MAX 条）
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 50))
+HISTORY_PAGE_MAX = 200
+NO_HISTORY = ([], False, None)  # 没有消息的会话：(messages, has_more, cursor)
+# 登录/重连时历史消息分块发送：每个 history_batch 帧最多的消息条数和字节数
+HISTORY_BATCH_MAX_MESSAGES = 500
+HISTORY_BATCH_MAX_BYTES = 256 * 1024
+
+# 图片/语音等媒体文件保存在 data/blobs（按 SHA-256 内容寻址），消息里只保存引用
+BLOB_DIR = os.path.join(DATA_DIR, 'blobs')
+BLOB_MAX_SIZE = int(os.environ.get('BLOB_MAX_SIZE', 20 * 1024 * 1024))
+MEDIA_CONTENT_TYPES = ('image', 'voice')
+blob_store = BlobStore(BLOB_DIR)
+# HTTP 上传的媒体文件在单独的线程中按顺序写入磁盘，不阻塞事件循环
+blob_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='blob')
+
+# 每个连接的发送队列上限和慢连接策略（disconnect: 断开慢连接，drop: 丢弃新帧）
+OUTBOUND_QUEUE_SIZE = int(os.environ.get('OUTBOUND_QUEUE_SIZE', 1000))
+OUTBOUND_QUEUE_POLICY = os.environ.get('OUTBOUND_QUEUE_POLICY', 'disconnect')
+
+# 出站 HTTP 连接池（Claude API、IP 定位、天气共用），超时单位为秒
+http_clients = HttpClients(
+    limit=int(os.environ.get('HTTP_POOL_LIMIT', 100)),
+    limit_per_host=int(os.environ.get('HTTP_POOL_LIMIT_PER_HOST', 20)),
+    keepalive_timeout=float(os.environ.get('HTTP_KEEPALIVE_TIMEOUT', 30)),
+    dns_cache_ttl=int(os.environ.get('HTTP_DNS_CACHE_TTL', 300)),
+    timeouts={
+        'llm': {'total': float(os.environ.get('LLM_TIMEOUT', 90)), 'connect': 10},
+        'geoip': {'total': float(os.environ.get('GEOIP_TIMEOUT', 5)), 'connect': 2},
+        'weather': {'total': float(os.environ.get('WEATHER_TIMEOUT', 10)), 'connect': 3},
+    }
+)
+
+# Claude API 客户端：配置启动时读取一次，LLM_MAX_CONCURRENCY 个请求同时进行，
+# 其余按用户轮转排队（最多 LLM_MAX_QUEUE 个），429/529 时指数退避重试 LLM_MAX_RETRIES 次
+llm_config = load_llm_config(os.path.dirname(os.path.abspath(__file__)))
+llm_client = LLMClient(
+    http_clients,
+    llm_config['api_key'],
+    model=llm_config['model'],
+    api_url=llm_config['api_url'],
+    max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', 4)),
+    max_queue=int(os.environ.get('LLM_MAX_QUEUE', 100)),
+    max_retries=int(os.environ.get('LLM_MAX_RETRIES', 4))
+)
+# 总结结果缓存（data/summary_cache.db）：最多 SUMMARY_CACHE_SIZE 条（0 关闭），
+# SUMMARY_CACHE_TTL 秒后过期（0 表示不过期）
+SUMMARY_CACHE_SIZE = int(os.environ.get('SUMMARY_CACHE_SIZE', 1000))
+SUMMARY_CACHE_TTL = float(os.environ.get('SUMMARY_CACHE_TTL', 7 * 24 * 3600)) or None
+summary_cache = SummaryCache(os.path.join(DATA_DIR, 'summary_cache.db'), SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL)
+# 上传：PDF 单个文件上限 PDF_MAX_SIZE，文本字段上限 UPLOAD_TEXT_MAX_SIZE；
+# 全服务器正在接收和处理的上传字节数不超过 UPLOAD_MAX_IN_FLIGHT（超过时返回 503）
+PDF_MAX_SIZE = 10 * 1024 * 1024
+UPLOAD_TEXT_MAX_SIZE = int(os.environ.get('UPLOAD_TEXT_MAX_SIZE', 5 * 1024 * 1024))
+UPLOAD_REQUEST_MAX_SIZE = 2 * PDF_MAX_SIZE + 3 * UPLOAD_TEXT_MAX_SIZE
+UPLOAD_TMP_DIR = os.environ.get('UPLOAD_TMP_DIR') or None
+upload_budget = UploadBudget(int(os.environ.get('UPLOAD_MAX_IN_FLIGHT', 100 * 1024 * 1024)))
+# PDF 按页提取结果缓存（data/pdf_cache/）：内存中最多 PDF_CACHE_MEMORY_MB，磁盘上最多 PDF_CACHE_DISK_MB（0 只用内存）
+pdf_page_cache = PdfPageCache(
+    os.path.join(DATA_DIR, 'pdf_cache'),
+    max_memory_bytes=int(os.environ.get('PDF_CACHE_MEMORY_MB', 32)) * 1024 * 1024,
+    max_disk_bytes=int(os.environ.get('PDF_CACHE_DISK_MB', 512)) * 1024 * 1024
+)
+# PDF 解析进程池：PDF_WORKERS 个工作进程，每个文档最多解析 PDF_TIMEOUT 秒、前 PDF_MAX_PAGES 页
+pdf_extractor = PdfExtractor(
+    max_workers=int(os.environ.get('PDF_WORKERS', 2)),
+    timeout=float(os.environ.get('PDF_TIMEOUT', 60)),
+    max_pages=int(os.environ.get('PDF_MAX_PAGES', 500)),
+    cache=pdf_page_cache
+)
+# 超过 SUMMARY_CHUNK_TOKENS 的文本分段总结，同时最多 SUMMARY_MAX_PARALLEL 段
+SUMMARY_CHUNK_TOKENS = int(os.environ.get('SUMMARY_CHUNK_TOKENS', 20000))
+SUMMARY_MAX_PARALLEL = int(os.environ.get('SUMMARY_MAX_PARALLEL', 3))
+# 每个连接同时在后台处理的机器人任务上限
+BOT_MAX_JOBS = int(os.environ.get('BOT_MAX_JOBS', 3))
+# 机器人回复使用流式接口，生成过程中通过 bot_message_delta 推送片段（设为 0 时等完整回复再发送）
+BOT_STREAMING = os.environ.get('BOT_STREAMING', '1') != '0'
+
+# IP 地理位置缓存：成功结果缓存 GEOIP_CACHE_TTL 秒，失败结果缓存 GEOIP_NEGATIVE_TTL 秒
+GEOIP_CACHE_SIZE = int(os.environ.get('GEOIP_CACHE_SIZE', 10000))
+GEOIP_CACHE_TTL = float(os.environ.get('GEOIP_CACHE_TTL', 24 * 3600))
+GEOIP_NEGATIVE_TTL = float(os.environ.get('GEOIP_NEGATIVE_TTL', 300))
+# 本地 GeoIP 数据库（python geoip_resolver.py build 生成），存在时优先使用；
+# GEOIP_HTTP_FALLBACK=0 时不再查询 ip-api.com（离线部署）
+GEOIP_DB_PATH = os.environ.get('GEOIP_DB_PATH', os.path.join(DATA_DIR, 'geoip.db'))
+GEOIP_HTTP_FALLBACK = os.environ.get('GEOIP_HTTP_FALLBACK', '1') != '0'
+geoip_resolver = create_geoip_resolver(GEOIP_DB_PATH, http_clients if GEOIP_HTTP_FALLBACK else None)
+geoip_cache = GeoIpCache(geoip_resolver.lookup, GEOIP_CACHE_SIZE, GEOIP_CACHE_TTL, GEOIP_NEGATIVE_TTL)
+
 # 存储连接的用户
 connected_users = {}  # {username: websocket}
+# {websocket: Session} - 每个连接上的聊天用户名、战场玩家名、群组视频；断开通知合并发送
+connections = ConnectionRegistry(lambda sessions: notify_departures(sessions))
+outbound_queues = {}  # {websocket: OutboundQueue} - 每个连接的发送队列
+media_uploads = {}  # {websocket: MediaUploads} - 每个连接正在进行的二进制分块上传
+media_downloads = {}  # {websocket: set(Task)} - 每个连接正在进行的二进制下载
+bot_jobs = {}  # {websocket: {job_id: Task}} - 每个连接正在后台处理的机器人任务
+bot_job_ids = itertools.count(1)
 user_ids = {}  # {username: userId} - 跟踪用户ID
 user_locations = {}  # {username: location_string} - 存储用户地理位置
-# 存储消息（持久化存储）
-messages_store = {}  # {chat_key: [messages]}
+background_tasks = set()  # 后台任务（保持引用，避免任务被回收）
+# 聊天消息不常驻内存：写入只排队记录，历史分页和群消息已读通过 persistence.call 查询存储后端
+# 用户会话索引（登录时按索引查找会话，不再扫描所有 chat_key）
+user_conversations = {}  # {username: {'private': {chat_key: peer}, 'groups': {group_id: None}}}
 # 存储群组
 groups_store = {}  # {group_id: {name, members, creator}}
 group_counter = 0  # 群组ID计数器
@@ -49,133 +178,264 @@ BOT_USERNAME = 'AI总结Bot'  # 聊天记录总结机器人
 bot_configs = {}  # {username: {prompt: str}}
 # 3D战场玩家
 battle_3d_players = {}  # {username: {position: {x, y, z}, websocket}}
-# 3D战场积分
-battle_3d_scores = {}  # {username: score}
+# 3D战场积分（按分数排序，见 scoreboard.py）
+battle_3d_scores = Scoreboard()
+# 3D战场状态同步：每秒 BATTLE_TICK_RATE 次合并下发位置，只包含 BATTLE_VIEW_RADIUS 范围内的玩家
+# （客户端雾效在 50 之外完全看不见，相机在角色后方约 11）
+BATTLE_TICK_RATE = float(os.environ.get('BATTLE_TICK_RATE', 20))
+BATTLE_VIEW_RADIUS = float(os.environ.get('BATTLE_VIEW_RADIUS', 40))
+# 积分榜：积分变化每个 tick 合并下发一次；前 BATTLE_LEADERBOARD_SIZE 名的快照
+# 最多每 BATTLE_LEADERBOARD_INTERVAL 秒下发一次
+BATTLE_LEADERBOARD_SIZE = int(os.environ.get('BATTLE_LEADERBOARD_SIZE', 10))
+BATTLE_LEADERBOARD_INTERVAL = float(os.environ.get('BATTLE_LEADERBOARD_INTERVAL', 1.0))
+battle_score_feed = ScoreFeed(battle_3d_scores, top_k=BATTLE_LEADERBOARD_SIZE,
+                              snapshot_ticks=max(1, round(BATTLE_LEADERBOARD_INTERVAL * BATTLE_TICK_RATE)))
+battle_sync = BattleSync(battle_3d_players, lambda ws, message: send_to(ws, message),
+                         tick_rate=BATTLE_TICK_RATE, view_radius=BATTLE_VIEW_RADIUS,
+                         on_tick=lambda tick: send_battle_scores(tick))
 
 # 加载持久化数据
 def load_data():
-    """从文件加载数据"""
-    global messages_store, groups_store, offline_messages, bot_configs, group_counter
+    """从存储后端加载数据"""
+    global groups_store, offline_messages, bot_configs, group_counter
 
-    # 加载消息
-    if os.path.exists(MESSAGES_FILE):
-        try:
-            with open(MESSAGES_FILE, 'r', encoding='utf-8') as f:
-                messages_store = json.load(f)
-            print(f'✅ 加载了 {len(messages_store)} 个聊天会话的历史消息')
-        except Exception as e:
-            print(f'⚠️  加载消息失败: {e}')
-            messages_store = {}
+    try:
+        data = storage.load()
+    except Exception as e:
+        print(f'⚠️  加载数据失败 ({STORAGE_BACKEND}): {e}')
+        return
 
-    # 加载群组
-    if os.path.exists(GROUPS_FILE):
-        try:
-            with open(GROUPS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                groups_store = data.get('groups', {})
-                group_counter = data.get('counter', 0)
-            print(f'✅ 加载了 {len(groups_store)} 个群组')
-        except Exception as e:
-            print(f'⚠️  加载群组失败: {e}')
-            groups_store = {}
-            group_counter = 0
+    groups_store = data['groups']
+    group_counter = data['group_counter']
+    offline_messages = data['offline_messages']
+    bot_configs = data['bot_configs']
+
+    # 启动时的迁移在事件循环和持久化任务启动之前执行，直接读写存储后端
+    migrate_chat_keys()
+    migrate_inline_media()
+    chat_keys = storage.chat_keys()
+    rebuild_conversation_index(chat_keys)
+
+    print(f'✅ 存储后端: {STORAGE_BACKEND}')
+    print(f'✅ 加载了 {len(chat_keys)} 个聊天会话 (重放 {data["replayed"]} 条日志记录)')
+    print(f'✅ 加载了 {len(groups_store)} 个群组')
+    print(f'✅ 加载了 {sum(len(msgs) for msgs in offline_messages.values())} 条离线消息')
+    print(f'✅ 加载了 {len(bot_configs)} 个机器人配置')
+
+# 保存数据（只排队记录，实际写入由 persistence 在线程池中批量完成）
+
+def save_group(group_id):
+    """保存群组"""
+    persistence.append({
+        'op': 'group_save',
+        'group_id': group_id,
+        'group': groups_store[group_id],
+        'counter': group_counter
+    })
 
-    # 加载离线消息
-    if os.path.exists(OFFLINE_MESSAGES_FILE):
-        try:
-            with open(OFFLINE_MESSAGES_FILE, 'r', encoding='utf-8') as f:
-                offline_messages = json.load(f)
-            print(f'✅ 加载了 {sum(len(msgs) for msgs in offline_messages.values())} 条离线消息')
-        except Exception as e:
-            print(f'⚠️  加载离线消息失败: {e}')
-            offline_messages = {}
+def push_offline_message(username, message):
+    """存储一条离线消息"""
+    offline_messages.setdefault(username, []).append(message)
+    persistence.append({'op': 'offline_push', 'username': username, 'message': message})
+
+def clear_offline_messages(username):
+    """清空已推送的离线消息"""
+    offline_messages[username] = []
+    persistence.append({'op': 'offline_clear', 'username': username})
+
+def save_bot_config(username):
+    """保存机器人配置"""
+    persistence.append({'op': 'bot_config_save', 'username': username, 'config': bot_configs[username]})
+
+def log_new_message(chat_key, message):
+    """记录新消息"""
+    persistence.append({'op': 'append', 'key': chat_key, 'message': message})
+
+def log_mark_read(chat_key, from_user, to_user):
+    """记录私聊已读（from_user 发给 to_user 的未读消息）"""
+    persistence.append({'op': 'mark_read', 'key': chat_key, 'from': from_user, 'to': to_user})
+
+def log_recall(chat_key, timestamp, from_user, notice):
+    """记录消息撤回（撤回通知替换原消息；原消息不存在时存储后端忽略这条记录）"""
+    persistence.append({
+        'op': 'recall',
+        'key': chat_key,
+        'timestamp': timestamp,
+        'from': from_user,
+        'notice': notice
+    })
 
-    # 加载机器人配置
-    if os.path.exists(BOT_CONFIGS_FILE):
-        try:
-            with open(BOT_CONFIGS_FILE, 'r', encoding='utf-8') as f:
-                bot_configs = json.load(f)
-            print(f'✅ 加载了 {len(bot_configs)} 个机器人配置')
-        except Exception as e:
-            print(f'⚠️  加载机器人配置失败: {e}')
-            bot_configs = {}
 
-# 保存数据到文件
-def save_messages():
-    """保存消息到文件"""
+def get_chat_key(user1, user2):
+    """生成聊天记录的唯一key
+
+    使用排序后的 JSON 数组（如 ["alice","bob"]），用户名中含 '_' 也不会冲突；
+    群组 key 是 group_N，不会以 '[' 开头。
+    """
+    return json.dumps(sorted([user1, user2]), ensure_ascii=False, separators=(',', ':'))
+
+
+def index_private_chat(chat_key, user1, user2):
+    """把私聊会话加入双方的会话索引"""
+    user_conversations.setdefault(user1, {'private': {}, 'groups': {}})['private'][chat_key] = user2
+    user_conversations.setdefault(user2, {'private': {}, 'groups': {}})['private'][chat_key] = user1
+
+
+def index_group(group_id, members):
+    """把群组加入所有成员的会话索引"""
+    for member in members:
+        user_conversations.setdefault(member, {'private': {}, 'groups': {}})['groups'][group_id] = None
+
+
+def migrate_chat_keys():
+    """把旧格式的私聊 key（'a_b'）迁移为新格式
+
+    旧格式对含 '_' 的用户名有歧义（'a_b'+'c' 与 'a'+'b_c' 冲突），
+    所以按每条消息自己的 from/to 重新计算 key，冲突的会话也会被拆开。
+    """
+    migrated = {}
+    records = []
+    for chat_key in storage.chat_keys():
+        if chat_key in groups_store or chat_key.startswith('['):
+            continue
+        msgs = storage.get_messages(chat_key)
+        if any('group_id' in msg or not msg.get('from') or not msg.get('to') for msg in msgs):
+            continue  # 群消息或无法识别参与者的会话保持原样
+        for msg in msgs:
+            migrated.setdefault(get_chat_key(msg['from'], msg['to']), []).append(msg)
+        records.append({'op': 'replace', 'key': chat_key, 'messages': []})
+
+    for chat_key, msgs in migrated.items():
+        records.append({'op': 'replace', 'key': chat_key, 'messages': storage.get_messages(chat_key) + msgs})
+
+    if records:
+        storage.apply_batch(records)
+    if migrated:
+        print(f'✅ 迁移了 {len(migrated)} 个私聊会话到新的 key 格式')
+
+
+def externalize_inline_media(message):
+    """把内联 base64 的图片/语音存入 blob 存储，消息只保留引用
+
+    兼容旧客户端和旧数据。返回消息是否被修改。
+    """
+    if message.get('content_type') not in MEDIA_CONTENT_TYPES or message.get('blob_id'):
+        return False
+    content = message.get('content')
+    if not isinstance(content, str) or content.startswith(BLOB_URL_PREFIX):
+        return False
+
+    if content.startswith('data:'):
+        header, _, encoded = content.partition(',')
+        content_type = header[5:].split(';')[0]
+    else:
+        encoded = content
+        content_type = 'audio/webm'  # 旧版语音消息只发送 base64 数据
+    content_type = normalize_content_type(content_type)
+    if content_type is None:
+        return False
     try:
-        with open(MESSAGES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(messages_store, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f'❌ 保存消息失败: {e}')
+        data = base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError):
+        return False
+
+    info = blob_store.put(data, content_type)
+    message['content'] = blob_url(info['blob_id'])
+    message['blob_id'] = info['blob_id']
+    message['size'] = info['size']
+    return True
+
+
+async def resolve_media_content(message, blob_id=None):
+    """图片/语音消息只保存 blob 引用，返回 False 表示引用的 blob 不存在（文件读写在 blob_executor 中执行）"""
+    if message['content_type'] not in MEDIA_CONTENT_TYPES:
+        return True
+    loop = asyncio.get_running_loop()
+    if blob_id:
+        info = await loop.run_in_executor(blob_executor, blob_store.stat, blob_id)
+        if info is None:
+            print(f'⚠️  消息引用的文件不存在: {blob_id}')
+            return False
+        message['content'] = blob_url(blob_id)
+        message['blob_id'] = blob_id
+        message['size'] = info['size']
+        return True
+    # 旧版客户端内联的 base64 内容：解码并写入 blob 存储
+    await loop.run_in_executor(blob_executor, externalize_inline_media, message)
+    return True
+
+
+def migrate_inline_media():
+    """把已保存消息和离线消息中的内联图片/语音迁移到 blob 存储"""
+    migrated = 0
+    for chat_key in storage.chats_with_inline_media(MEDIA_CONTENT_TYPES):
+        msgs = storage.get_messages(chat_key)
+        changed = [msg for msg in msgs if externalize_inline_media(msg)]
+        if changed:
+            migrated += len(changed)
+            storage.apply_batch([{'op': 'replace', 'key': chat_key, 'messages': msgs}])
+
+    for username, msgs in offline_messages.items():
+        if [msg for msg in msgs if externalize_inline_media(msg)]:
+            persistence.append({'op': 'offline_clear', 'username': username})
+            for msg in msgs:
+                persistence.append({'op': 'offline_push', 'username': username, 'message': msg})
 
-def save_groups():
-    """保存群组到文件"""
-    try:
-        with open(GROUPS_FILE, 'w', encoding='utf-8') as f:
-            json.dump({
-                'groups': groups_store,
-                'counter': group_counter
-            }, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f'❌ 保存群组失败: {e}')
+    if migrated:
+        print(f'✅ 迁移了 {migrated} 条内联图片/语音消息到文件存储')
 
-def save_offline_messages():
-    """保存离线消息到文件"""
-    try:
-        with open(OFFLINE_MESSAGES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(offline_messages, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f'❌ 保存离线消息失败: {e}')
 
-def save_bot_configs():
-    """保存机器人配置到文件"""
-    try:
-        with open(BOT_CONFIGS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(bot_configs, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f'❌ 保存机器人配置失败: {e}')
+def rebuild_conversation_index(chat_keys):
+    """根据存储中的会话 key 和群组重建会话索引"""
+    user_conversations.clear()
+    for chat_key in chat_keys:
+        if chat_key in groups_store or not chat_key.startswith('['):
+            continue
+        user1, user2 = json.loads(chat_key)
+        index_private_chat(chat_key, user1, user2)
+    for group_id, group_info in groups_store.items():
+        index_group(group_id, group_info['members'])
 
 
-def get_chat_key(user1, user2):
-    """生成聊天记录的唯一key"""
-    return '_'.join(sorted([user1, user2]))
+async def get_location_from_ip(ip):
+    """通过IP获取地理位置（经过缓存，同一 IP 的并发查询只请求一次）"""
+    if not is_public_ip(ip):
+        return '未知位置'
+    return await geoip_cache.resolve(ip) or '未知位置'
 
 
-async def get_location_from_ip(ip):
-    """通过IP获取地理位置"""
-    try:
-        # 使用免费的ip-api.com服务（无需API key，但有限制：每分钟45请求）
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f'http://ip-api.com/json/{ip}?lang=zh-CN&fields=country,regionName,city,status,message') as response:
-                data = await response.json()
+def locate_user(username, ip):
+    """填充用户位置：缓存命中时立即返回，否则在后台查询，注册不等待上游"""
+    if not is_public_ip(ip):
+        user_locations[username] = '未知位置'
+        return
 
-                if data.get('status') == 'success':
-                    country = data.get('country', '')
-                    region = data.get('regionName', '')
-                    city = data.get('city', '')
-
-                    # 组合位置信息
-                    location_parts = []
-                    if country:
-                        location_parts.append(country)
-                    if region and region != city:  # 避免重复
-                        location_parts.append(region)
-                    if city:
-                        location_parts.append(city)
-
-                    return '·'.join(location_parts) if location_parts else '未知位置'
-                else:
-                    return '未知位置'
-    except Exception as e:
-        print(f'获取地理位置失败: {e}')
-        return '未知位置'
+    found, location = geoip_cache.get_cached(ip)
+    if not found:
+        # 本地数据库查询只需要微秒级，直接同步完成
+        location = geoip_resolver.lookup_local(ip)
+        found = location is not None
+    user_locations[username] = location or '未知位置'
+    if found:
+        print(f'用户 {username} 的位置: {user_locations[username]} (IP: {ip})')
+        return
+
+    async def update_location():
+        location = await get_location_from_ip(ip)
+        user_locations[username] = location
+        print(f'用户 {username} 的位置: {location} (IP: {ip})')
+
+    task = asyncio.create_task(update_location())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
 
 async def websocket_handler(request):
     """WebSocket 连接处理"""
     ws = web.WebSocketResponse()
     await ws.prepare(request)
+    outbound_queues[ws] = OutboundQueue(ws, OUTBOUND_QUEUE_SIZE, OUTBOUND_QUEUE_POLICY)
+    session = connections.open(ws)
 
     username = None
 
@@ -189,58 +449,44 @@ async def websocket_handler(request):
                     # 更新 username（注册后）
                     if data.get('type') == 'register' and username is None:
                         username = data.get('username')
+                        session.username = username
 
                 except json.JSONDecodeError:
-                    await ws.send_json({
+                    send_to(ws, {
                         'type': 'error',
                         'message': '无效的消息格式'
                     })
 
+            elif msg.type == web.WSMsgType.BINARY:
+                if msg.data[:1] and msg.data[0] in BATTLE_OPS:
+                    handle_battle_frame(session, msg.data)
+                else:
+                    await handle_media_frame(ws, msg.data, username)
+
             elif msg.type == web.WSMsgType.ERROR:
                 print(f'WebSocket 错误: {ws.exception()}')
 
     finally:
-        # 用户断开连接
-        if username and username in connected_users:
-            del connected_users[username]
-            # 通知其他用户
-            await broadcast({
-                'type': 'user_offline',
-                'username': username
-            }, exclude=username)
-            print(f'用户离线: {username}')
-
-        # 清理3D战场玩家（通过WebSocket对象查找）
-        battle_username_to_remove = None
-        for battle_user, battle_data in battle_3d_players.items():
-            if battle_data['websocket'] == ws:
-                battle_username_to_remove = battle_user
-                break
-
-        if battle_username_to_remove:
-            del battle_3d_players[battle_username_to_remove]
-            # 清理积分
-            if battle_username_to_remove in battle_3d_scores:
-                del battle_3d_scores[battle_username_to_remove]
-            # 通知其他3D玩家
-            for player_name, player_data in list(battle_3d_players.items()):
-                try:
-                    await player_data['websocket'].send_json({
-                        'type': '3d_battle_player_left',
-                        'username': battle_username_to_remove
-                    })
-                except:
-                    pass
-            # 广播更新后的积分榜
-            for player_name, player_data in list(battle_3d_players.items()):
-                try:
-                    await player_data['websocket'].send_json({
-                        'type': '3d_battle_score_update',
-                        'scores': battle_3d_scores
-                    })
-                except:
-                    pass
-            print(f'3D战场: {battle_username_to_remove} 断开连接')
+        # 按连接取出它的所有身份直接清理；通知由 notify_departures 合并发送
+        release_session(session)
+
+        # 放弃未完成的媒体上传和下载
+        uploads = media_uploads.pop(ws, None)
+        if uploads is not None:
+            uploads.close()
+        for task in media_downloads.pop(ws, ()):
+            task.cancel()
+
+        # 取消这个连接还没完成的机器人任务（释放 LLM 排队名额）
+        for task in bot_jobs.pop(ws, {}).values():
+            task.cancel()
+
+        connections.close(ws)
+
+        # 停止该连接的发送任务
+        queue = outbound_queues.pop(ws, None)
+        if queue is not None:
+            await queue.close()
 
     return ws
 
@@ -260,7 +506,13 @@ async def handle_message(ws, data, current_username, request=None):
         return  # 提前返回，不需要检查current_username
 
     elif msg_type == 'send_message':
-        await handle_send_message(data, current_username)
+        await handle_send_message(data, current_username, ws)
+
+    elif msg_type == 'cancel_bot_job':
+        cancel_bot_job(ws, data)
+
+    elif msg_type == 'history_request':
+        await handle_history_request(ws, data, current_username)
 
     elif msg_type == 'mark_as_read':
         await handle_mark_as_read(data, current_username)
@@ -277,9 +529,110 @@ async def handle_message(ws, data, current_username, request=None):
     elif msg_type == 'mark_group_message_read':
         await handle_mark_group_message_read(data, current_username)
 
+    elif msg_type == 'media_download':
+        await handle_media_download(ws, data, current_username)
+
     # 视频聊天信令（包括群组视频）
     elif msg_type in ['video_invite', 'video_accept', 'video_reject', 'video_offer', 'video_answer', 'ice_candidate', 'video_end', 'group_video_invite', 'group_video_accept', 'group_video_reject', 'group_video_end']:
-        await handle_video_signal(data, current_username)
+        await handle_video_signal(data, current_username, ws)
+
+
+def release_session(session):
+    """连接断开时清理它的聊天用户、3D战场玩家和群组视频成员（同一个名字已经被新连接使用时不清理）"""
+    ws = session.ws
+    username = session.username
+    if username and connected_users.get(username) is ws:
+        del connected_users[username]
+        for group_id in session.video_groups:
+            group = groups_store.get(group_id)
+            if group is not None:
+                group.get('video_members', set()).discard(username)
+        print(f'用户离线: {username}')
+    else:
+        session.username = None  # 注册失败或已被新连接取代，不发离线通知
+
+    battle_username = session.battle_username
+    player = battle_3d_players.get(battle_username)
+    if player is not None and player['websocket'] is ws:
+        remove_battle_player(battle_username)
+        battle_3d_scores.remove(battle_username)
+        print(f'3D战场: {battle_username} 断开连接')
+    else:
+        session.battle_username = None
+
+
+def notify_departures(sessions):
+    """合并发送一批断开连接的通知：每个在线用户、每个战场玩家各只收到一条"""
+    offline = [s.username for s in sessions if s.username and s.username not in connected_users]
+    if len(offline) == 1:
+        send_to_users(list(connected_users), {'type': 'user_offline', 'username': offline[0]})
+    elif offline:
+        send_to_users(list(connected_users), {'type': 'users_offline', 'usernames': offline})
+
+    # 积分榜由下一次 3d_battle_leaderboard 快照更新
+    left = [s.battle_username for s in sessions if s.battle_username and s.battle_username not in battle_3d_players]
+    if len(left) == 1:
+        send_to_battle_players({'type': '3d_battle_player_left', 'username': left[0]})
+    elif left:
+        send_to_battle_players({'type': '3d_battle_players_left', 'usernames': left})
+
+
+def handle_battle_frame(session, data):
+    """处理3D战场的二进制位置帧（无效帧直接丢弃，下一次移动会覆盖）"""
+    try:
+        battle_sync.handle_frame(session.battle_username, data)
+    except BattleFrameError as e:
+        print(f'⚠️ 3D战场二进制帧无效: {e}')
+
+
+async def handle_media_frame(ws, data, current_user):
+    """处理二进制媒体上传帧，最后一块写入后回复 blob 引用（文件写入在 blob_executor 中执行）"""
+    try:
+        frame = decode_frame(data)
+        if not current_user:
+            raise MediaFrameError('请先登录', frame.transfer_id)
+        uploads = media_uploads.get(ws)
+        if uploads is None:
+            uploads = media_uploads[ws] = MediaUploads(blob_store, blob_executor, BLOB_MAX_SIZE)
+        info = await uploads.feed(frame)
+    except MediaFrameError as e:
+        send_to(ws, {'type': 'media_upload_error', 'transfer_id': e.transfer_id, 'message': str(e)})
+        return
+
+    if info is not None:
+        print(f'📎 文件已保存: {info["blob_id"][:12]} ({info["content_type"]}, {info["size"]} 字节, 来自 {current_user})')
+        send_to(ws, {
+            'type': 'media_upload_complete',
+            'transfer_id': frame.transfer_id,
+            'url': blob_url(info['blob_id']),
+            **info
+        })
+
+
+async def handle_media_download(ws, data, current_user):
+    """以二进制分块帧发送一个 blob，在后台任务中按连接速度推进（文件读取在 blob_executor 中执行）"""
+    transfer_id = data.get('transfer_id')
+    info = None
+    if current_user and isinstance(transfer_id, int) and 0 <= transfer_id < 2 ** 32:
+        info = await asyncio.get_running_loop().run_in_executor(blob_executor, blob_store.stat, data.get('blob_id'))
+    if info is None:
+        send_to(ws, {'type': 'media_download_error', 'transfer_id': transfer_id, 'message': '文件不存在'})
+        return
+
+    async def send_frames():
+        queue = outbound_queues.get(ws)
+        frames = iter_download_frames(blob_store, info, transfer_id, blob_executor)
+        try:
+            async for frame in frames:
+                if queue is None or not await queue.put_wait(frame):
+                    break
+        finally:
+            await frames.aclose()
+
+    tasks = media_downloads.setdefault(ws, set())
+    task = asyncio.create_task(send_frames())
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
 
 
 async def handle_register(ws, data, request=None):
@@ -288,14 +641,14 @@ async def handle_register(ws, data, request=None):
     user_id = data.get('userId', '')
 
     if not username:
-        await ws.send_json({
+        send_to(ws, {
             'type': 'register_error',
             'message': '昵称不能为空'
         })
         return
 
     if len(username) > 20:
-        await ws.send_json({
+        send_to(ws, {
             'type': 'register_error',
             'message': '昵称不能超过20个字符'
         })
@@ -305,7 +658,7 @@ async def handle_register(ws, data, request=None):
     is_returning_user = user_id and username in user_ids and user_ids[username] == user_id
 
     if username in connected_users and not is_returning_user:
-        await ws.send_json({
+        send_to(ws, {
             'type': 'register_error',
             'message': '昵称已被使用，请换一个'
         })
@@ -318,10 +671,8 @@ async def handle_register(ws, data, request=None):
              request.headers.get('X-Real-IP', '') or \
              request.remote
 
-        # 解析地理位置
-        location = await get_location_from_ip(ip)
-        user_locations[username] = location
-        print(f'用户 {username} 的位置: {location} (IP: {ip})')
+        # 解析地理位置（后台进行，不阻塞注册）
+        locate_user(username, ip)
     else:
         user_locations[username] = '未知位置'
 
@@ -335,71 +686,76 @@ async def handle_register(ws, data, request=None):
     if BOT_USERNAME not in all_users:
         all_users.append(BOT_USERNAME)
 
-    await ws.send_json({
+    send_to(ws, {
         'type': 'register_success',
         'username': username,
         'users': all_users,
         'bots': [BOT_USERNAME]  # 标记哪些是机器人
     })
 
-    # 推送历史消息（所有与该用户相关的聊天记录）
-    history_count = 0
-    for chat_key, msgs in messages_store.items():
-        # 检查是否是与该用户相关的聊天
-        if username in chat_key.split('_'):
-            for msg in msgs:
-                await ws.send_json({
-                    'type': 'history_message',
-                    **msg
-                })
-                history_count += 1
-
-    if history_count > 0:
-        print(f'推送 {history_count} 条历史消息给 {username}')
+    # 推送历史消息：每个会话只推送最近 HISTORY_PAGE_SIZE 条，更早的由客户端用 history_request 分页拉取
+    # 历史消息和离线消息先收集起来，再用 history_batch 分块发送，而不是每条消息一个帧
+    conversations = get_user_conversations(username)
+    pages = await get_history_pages([chat_key for _, chat_key, _ in conversations])
+    history_cursors = []
+    history_items = []
+    for chat_type, chat_key, chat in conversations:
+        if chat_type != 'private':
+            continue
+        page, has_more, cursor = pages.get(chat_key, NO_HISTORY)
+        history_items.extend({'type': 'history_message', **msg} for msg in page)
+        history_cursors.append(make_history_cursor(chat_type, chat, cursor, has_more))
+
+    if history_items:
+        print(f'推送 {len(history_items)} 条历史消息给 {username}')
 
     # 推送群组列表和群消息历史
     user_groups = []
-    for group_id, group_info in groups_store.items():
-        if username in group_info['members']:
-            user_groups.append({
-                'group_id': group_id,
-                'name': group_info['name'],
-                'members': group_info['members'],
-                'creator': group_info['creator']
-            })
+    for chat_type, group_id, _ in conversations:
+        if chat_type != 'group':
+            continue
+        group_info = groups_store[group_id]
+        user_groups.append({
+            'group_id': group_id,
+            'name': group_info['name'],
+            'members': group_info['members'],
+            'creator': group_info['creator']
+        })
 
     # 先推送群组列表，让客户端初始化群组
     if user_groups:
-        await ws.send_json({
+        send_to(ws, {
             'type': 'group_list',
             'groups': user_groups
         })
         print(f'推送 {len(user_groups)} 个群组给 {username}')
 
     # 再推送群组历史消息
-    for group_id, group_info in groups_store.items():
-        if username in group_info['members']:
-            if group_id in messages_store:
-                group_msg_count = len(messages_store[group_id])
-                for msg in messages_store[group_id]:
-                    await ws.send_json({
-                        'type': 'history_group_message',
-                        **msg
-                    })
-                if group_msg_count > 0:
-                    print(f'推送 {group_msg_count} 条群组历史消息 (群组ID: {group_id}) 给 {username}')
+    for group in user_groups:
+        group_id = group['group_id']
+        page, has_more, cursor = pages.get(group_id, NO_HISTORY)
+        history_items.extend({'type': 'history_group_message', **msg} for msg in page)
+        if page:
+            print(f'推送 {len(page)} 条群组历史消息 (群组ID: {group_id}) 给 {username}')
+        history_cursors.append(make_history_cursor('group', group_id, cursor, has_more))
 
     # 推送离线消息（如果有）
-    if username in offline_messages and offline_messages[username]:
-        print(f'推送 {len(offline_messages[username])} 条离线消息给 {username}')
-        for msg in offline_messages[username]:
-            await ws.send_json({
-                'type': 'new_message',
-                **msg
-            })
+    pending_offline = offline_messages.get(username)
+    if pending_offline:
+        print(f'推送 {len(pending_offline)} 条离线消息给 {username}')
+        history_items.extend({'type': 'new_message', **msg} for msg in pending_offline)
+
+    send_history_batches(ws, history_items)
+
+    if pending_offline:
         # 清空已推送的离线消息
-        offline_messages[username] = []
-        save_offline_messages()  # 保存更新
+        clear_offline_messages(username)
+
+    # 告诉客户端哪些会话还有更早的消息可以分页拉取
+    send_to(ws, {
+        'type': 'history_sync',
+        'conversations': history_cursors
+    })
 
     # 通知其他用户有新用户上线
     await broadcast({
@@ -411,63 +767,178 @@ async def handle_register(ws, data, request=None):
     print(f'当前在线用户: {list(connected_users.keys())}')
 
 
-async def call_llm_api(prompt, user_content):
-    """调用LLM API进行总结 - 支持Claude API"""
-    print(f'[DEBUG] call_llm_api 开始执行...')
+def send_history_batches(ws, items):
+    """把历史/离线消息打包成 history_batch 帧分块发送
+
+    每块最多 HISTORY_BATCH_MAX_MESSAGES 条或约 HISTORY_BATCH_MAX_BYTES 字节。
+    每条消息只编码一次，帧由编码好的片段直接拼接，不再整体重新编码。
+    """
+    parts = []
+    size = 0
+    batches = 0
+    for item in items:
+        # 与其他帧一样用 encode_json（中文不转义），按 UTF-8 字节数计算大小
+        encoded = encode_json(item)
+        encoded_size = len(encoded.encode('utf-8'))
+        if parts and (len(parts) >= HISTORY_BATCH_MAX_MESSAGES or size + encoded_size > HISTORY_BATCH_MAX_BYTES):
+            send_to(ws, '{"type":"history_batch","messages":[' + ','.join(parts) + ']}')
+            batches += 1
+            parts = []
+            size = 0
+        parts.append(encoded)
+        size += encoded_size + 1
+    if parts:
+        send_to(ws, '{"type":"history_batch","messages":[' + ','.join(parts) + ']}')
+        batches += 1
+    return batches
+
+
+def get_user_conversations(username):
+    """返回用户参与的会话列表 [(chat_type, chat_key, chat)]
+
+    chat_type 为 'private' 或 'group'，chat 为私聊对方用户名或群组ID。
+    直接查会话索引，开销只和该用户自己的会话数有关。
+    """
+    index = user_conversations.get(username)
+    if not index:
+        return []
+    conversations = [('private', chat_key, peer) for chat_key, peer in index['private'].items()]
+    conversations.extend(('group', group_id, group_id) for group_id in index['groups'] if group_id in groups_store)
+    return conversations
+
+
+def read_history_pages(chat_keys, before, limit):
+    """在持久化写线程中执行：读取多个会话的一页历史"""
+    return {chat_key: storage.get_history(chat_key, before, limit) for chat_key in chat_keys}
+
+
+async def get_history_pages(chat_keys, before=None, limit=None):
+    """从存储后端取每个会话排在游标 before 之前最近的 limit 条消息（按时间升序）
+
+    返回 {chat_key: (messages, has_more, cursor)}；查询在持久化写线程中执行，排队中的写入会先完成。
+    """
+    if limit is None:
+        limit = HISTORY_PAGE_SIZE
+    if not chat_keys:
+        return {}
+    try:
+        return await persistence.call(read_history_pages, chat_keys, before, limit)
+    except Exception as e:
+        print(f'❌ 读取历史消息失败: {e}')
+        return {}
+
 
-    # 优先从环境变量读取
-    api_key = os.environ.get('ANTHROPIC_API_KEY', '')
+def make_history_cursor(chat_type, chat, cursor, has_more):
+    """会话的分页游标：客户端用 before_timestamp + before_seq 请求更早的一页
 
-    # Railway环境变量备选方案：尝试从配置文件读取
-    if not api_key:
-        try:
-            config_file = os.path.join(os.path.dirname(__file__), '.api_config')
-            if os.path.exists(config_file):
-                with open(config_file, 'r') as f:
-                    api_key = f.read().strip()
-        except:
-            pass
+    消息按 (timestamp, seq) 排序，同一毫秒的多条消息也不会在两页之间重复或漏掉。
+    """
+    return {
+        'chat_type': chat_type,
+        'chat': chat,
+        'has_more': has_more,
+        'before_timestamp': cursor[0] if cursor else None,
+        'before_seq': cursor[1] if cursor else None
+    }
+
+
+def parse_history_cursor(data):
+    """从 history_request 取游标，返回 (timestamp, seq)；没有游标返回 None，格式错误抛出 ValueError
+
+    旧客户端只发 before_timestamp，按 seq=-1 处理（只返回更早时间戳的消息）。
+    """
+    timestamp = data.get('before_timestamp')
+    seq = data.get('before_seq')
+    if timestamp is None:
+        return None
+    if seq is None:
+        seq = -1
+    for value in (timestamp, seq):
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise ValueError(f'无效的历史消息游标: {timestamp!r}, {seq!r}')
+    return (timestamp, int(seq))
+
+
+async def handle_history_request(ws, data, current_user):
+    """处理历史消息分页请求"""
+    chat_type = data.get('chat_type', 'private')
+    chat = data.get('chat')
 
-    print(f'[DEBUG] API密钥状态: {"已配置" if api_key else "未配置"} (长度: {len(api_key) if api_key else 0})')
+    if not current_user or not chat:
+        return
 
-    if not api_key:
-        print('[DEBUG] 错误：未配置API密钥')
-        return "错误：未配置API密钥。请设置ANTHROPIC_API_KEY环境变量。"
+    try:
+        before = parse_history_cursor(data)
+    except ValueError as e:
+        print(f'⚠️  {e}')
+        return
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                'https://api.anthropic.com/v1/messages',
-                headers={
-                    'x-api-key': api_key,
-                    'anthropic-version': '2023-06-01',
-                    'Content-Type': 'application/json'
-                },
-                json={
-                    'model': os.environ.get('ANTHROPIC_MODEL', 'claude-3-5-sonnet-20241022'),
-                    'max_tokens': 4096,
-                    'system': prompt,
-                    'messages': [
-                        {'role': 'user', 'content': user_content}
-                    ],
-                    'temperature': 0.7
-                },
-                timeout=aiohttp.ClientTimeout(total=30)
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result['content'][0]['text']
-                else:
-                    error_text = await response.text()
-                    return f"API调用失败 ({response.status}): {error_text}"
-    except asyncio.TimeoutError:
-        return "错误：API调用超时"
-    except Exception as e:
-        return f"错误：{str(e)}"
+        limit = max(1, min(int(data.get('limit', HISTORY_PAGE_SIZE)), HISTORY_PAGE_MAX))
+    except (TypeError, ValueError):
+        limit = HISTORY_PAGE_SIZE
+
+    if chat_type == 'group':
+        # 只有群成员可以拉取群历史
+        if chat not in groups_store or current_user not in groups_store[chat]['members']:
+            return
+        chat_key = chat
+    else:
+        chat_key = get_chat_key(current_user, chat)
+
+    pages = await get_history_pages([chat_key], before, limit)
+    page, has_more, cursor = pages.get(chat_key, NO_HISTORY)
+    send_to(ws, {
+        'type': 'history_page',
+        'messages': page,
+        **make_history_cursor(chat_type, chat, cursor, has_more)
+    })
+
+
+async def cached_llm_call(system, content, user=None, on_delta=None, max_tokens=4096, temperature=0.7, bypass_cache=False):
+    """带总结缓存的 LLM 调用，失败时抛出 LLMError
+
+    传入 on_delta 且开启了 BOT_STREAMING 时使用流式接口，每收到一段文本调用一次 on_delta(text)；
+    相同的模型、system 和内容直接返回缓存的结果（bypass_cache=True 时重新调用）。
+    """
+    async def compute():
+        if on_delta is None or not BOT_STREAMING:
+            return await llm_client.complete(content, system=system, user=user, max_tokens=max_tokens, temperature=temperature)
+        parts = []
+        async for text in llm_client.stream(content, system=system, user=user, max_tokens=max_tokens, temperature=temperature):
+            parts.append(text)
+            on_delta(text)
+        return ''.join(parts)
+
+    summary, source = await summary_cache.get_or_compute(
+        summary_key(llm_client.model, system, content), compute, bypass=bypass_cache)
+    if source != 'computed':
+        print(f'♻️ 总结缓存命中 ({source})')
+        if on_delta is not None and BOT_STREAMING:
+            on_delta(summary)
+    return summary
+
+
+# 长文本分段总结：每段的要点也经过总结缓存，追加内容后只需处理新增的分段
+summarizer = MapReduceSummarizer(cached_llm_call, SUMMARY_CHUNK_TOKENS, SUMMARY_MAX_PARALLEL)
+
+
+async def call_llm_api(prompt, user_content, user=None, on_delta=None, bypass_cache=False, on_progress=None):
+    """调用LLM API进行总结 - 支持Claude API（失败时返回错误文本）
+
+    超过 SUMMARY_CHUNK_TOKENS 的内容分段提取要点后再合并总结，on_progress(已完成, 总段数) 报告分段进度。
+    """
+    try:
+        if summarizer.needs_chunking(user_content):
+            return await summarizer.summarize(user_content, prompt, user=user, on_delta=on_delta,
+                                              bypass_cache=bypass_cache, on_progress=on_progress)
+        return await cached_llm_call(prompt, user_content, user, on_delta, bypass_cache=bypass_cache)
+    except LLMError as e:
+        return f"错误：{e}"
 
 
-async def handle_bot_message(from_user, content, content_type):
-    """处理发送给机器人的消息"""
+async def handle_bot_message(from_user, content, content_type, on_delta=None, on_progress=None):
+    """处理发送给机器人的消息（on_delta: 流式回复时接收文本片段的回调，on_progress: 分段总结进度回调）"""
     print(f'[DEBUG] handle_bot_message 被调用: from_user={from_user}, content_type={content_type}, content长度={len(content)}')
 
     # 获取用户的机器人配置
@@ -480,6 +951,7 @@ async def handle_bot_message(from_user, content, content_type):
         new_prompt = content[11:].strip()
         if new_prompt:
             bot_configs[from_user] = {'prompt': new_prompt}
+            save_bot_config(from_user)
             return f"✅ Prompt已更新为：\n\n{new_prompt}\n\n现在发送聊天记录或PDF给我，我会使用这个prompt进行总结。"
         else:
             return "❌ Prompt不能为空"
@@ -501,6 +973,8 @@ async def handle_bot_message(from_user, content, content_type):
 
 3. **总结聊天记录**：
    直接粘贴聊天记录文本发送给我
+   相同的内容会直接返回上次的总结，需要重新总结时发送：
+   /nocache <聊天记录>
 
 💡 **提示**：使用UI界面设置Prompt更方便！
 
@@ -513,13 +987,22 @@ async def handle_bot_message(from_user, content, content_type):
 李四: 好的，我负责前端部分
 """
 
+    # /nocache <内容>：跳过总结缓存，重新总结
+    bypass_cache = False
+    if content_type == 'text' and content.startswith('/nocache '):
+        content = content[9:].strip()
+        bypass_cache = True
+
     # 处理文本内容（聊天记录）
     if content_type == 'text':
         print(f'[DEBUG] 准备调用 call_llm_api...')
         # 调用LLM API进行总结
-        summary = await call_llm_api(user_prompt, content)
+        header = "📊 总结结果：\n\n"
+        if on_delta is not None and BOT_STREAMING:
+            on_delta(header)
+        summary = await call_llm_api(user_prompt, content, from_user, on_delta, bypass_cache, on_progress)
         print(f'[DEBUG] call_llm_api 返回结果长度: {len(summary)}')
-        return f"📊 总结结果：\n\n{summary}"
+        return f"{header}{summary}"
 
     # 处理PDF文件
     elif content_type == 'pdf':
@@ -538,7 +1021,7 @@ async def handle_bot_message(from_user, content, content_type):
                 pdf_data = content
 
             # 验证PDF文件大小（最大10MB）
-            if len(pdf_data) > 10 * 1024 * 1024:
+            if len(pdf_data) > PDF_MAX_SIZE:
                 return "❌ PDF文件大小不能超过10MB"
 
             print(f'[DEBUG] 准备解析PDF文件: {len(pdf_data)} 字节')
@@ -553,10 +1036,13 @@ async def handle_bot_message(from_user, content, content_type):
             print(f'[DEBUG] 准备调用 call_llm_api 总结PDF内容...')
 
             # 调用LLM API进行总结
-            summary = await call_llm_api(user_prompt, extracted_text)
+            header = "📊 PDF总结结果：\n\n"
+            if on_delta is not None and BOT_STREAMING:
+                on_delta(header)
+            summary = await call_llm_api(user_prompt, extracted_text, from_user, on_delta, on_progress=on_progress)
             print(f'[DEBUG] call_llm_api 返回结果长度: {len(summary)}')
 
-            return f"📊 PDF总结结果：\n\n{summary}"
+            return f"{header}{summary}"
 
         except Exception as e:
             print(f'❌ PDF处理失败: {str(e)}')
@@ -565,7 +1051,90 @@ async def handle_bot_message(from_user, content, content_type):
     return "❌ 不支持的消息类型"
 
 
-async def handle_send_message(data, from_user):
+def start_bot_job(ws, chat_key, from_user, content, content_type, reply_to):
+    """在后台任务中处理机器人消息，立即回复 bot_job_status（processing，带 job_id）
+
+    长文本分段总结时用 bot_job_status（progress）报告进度，完成后回复以普通 new_message 送达；
+    连接断开时任务被取消。
+    """
+    # 流式片段、状态和最终消息使用同一个 timestamp，客户端据此把它们显示在同一个气泡里
+    bot_timestamp = int(datetime.now().timestamp() * 1000)
+    job_id = str(next(bot_job_ids))
+    jobs = bot_jobs.setdefault(ws, {})
+    status = {
+        'type': 'bot_job_status',
+        'job_id': job_id,
+        'from': BOT_USERNAME,
+        'to': from_user,
+        'timestamp': bot_timestamp,
+        'reply_to': reply_to
+    }
+
+    if len(jobs) >= BOT_MAX_JOBS:
+        send_to(ws, {**status, 'status': 'rejected', 'message': f'❌ 已有 {len(jobs)} 个任务正在处理，请稍后再试'})
+        return
+
+    def send_delta(text):
+        send_to(ws, {
+            'type': 'bot_message_delta',
+            'job_id': job_id,
+            'from': BOT_USERNAME,
+            'to': from_user,
+            'timestamp': bot_timestamp,
+            'delta': text
+        })
+
+    def send_progress(done, total):
+        send_to(ws, {**status, 'status': 'progress', 'done': done, 'total': total})
+
+    async def run():
+        started_at = time.monotonic()
+        try:
+            bot_response = await handle_bot_message(from_user, content, content_type, send_delta, send_progress)
+        except asyncio.CancelledError:
+            print(f'🛑 机器人任务 {job_id} 已取消 ({from_user})')
+            send_to(ws, {**status, 'status': 'cancelled'})
+            raise
+        except Exception as e:
+            print(f'❌ 机器人任务 {job_id} 失败: {e}')
+            bot_response = f"❌ 处理失败：{e}"
+
+        # 发送机器人回复（完整内容，保存到消息记录）
+        bot_message = {
+            'from': BOT_USERNAME,
+            'to': from_user,
+            'content': bot_response,
+            'content_type': 'text',
+            'timestamp': bot_timestamp,
+            'read': False
+        }
+
+        log_new_message(chat_key, bot_message)  # 保存消息
+
+        if from_user in connected_users:
+            send_to(connected_users[from_user], {
+                'type': 'new_message',
+                'job_id': job_id,
+                **bot_message
+            })
+        else:
+            push_offline_message(from_user, bot_message)
+        print(f'🤖 机器人任务 {job_id} 完成 ({from_user}, {time.monotonic() - started_at:.1f}s)')
+
+    task = asyncio.create_task(run())
+    jobs[job_id] = task
+    task.add_done_callback(lambda _: jobs.pop(job_id, None))
+    send_to(ws, {**status, 'status': 'processing'})
+
+
+def cancel_bot_job(ws, data):
+    """用户主动取消正在处理的机器人任务"""
+    task = bot_jobs.get(ws, {}).get(data.get('job_id'))
+    if task is not None:
+        task.cancel()
+
+
+async def handle_send_message(data, from_user, ws=None):
     """处理发送消息"""
     to_user = data.get('to')
     content = data.get('content')
@@ -577,11 +1146,6 @@ async def handle_send_message(data, from_user):
     if not to_user or not content or not from_user:
         return
 
-    # 保存消息
-    chat_key = get_chat_key(from_user, to_user)
-    if chat_key not in messages_store:
-        messages_store[chat_key] = []
-
     message = {
         'from': from_user,
         'to': to_user,
@@ -600,51 +1164,30 @@ async def handle_send_message(data, from_user):
     if duration is not None:
         message['duration'] = duration
 
-    messages_store[chat_key].append(message)
-    save_messages()  # 保存消息
+    if not await resolve_media_content(message, data.get('blob_id')):
+        return
 
-    # 如果是发送给机器人的消息，处理并回复
+    # 保存消息
+    chat_key = get_chat_key(from_user, to_user)
+    index_private_chat(chat_key, from_user, to_user)
+    log_new_message(chat_key, message)  # 保存消息
+    await persistence.commit()
+
+    # 如果是发送给机器人的消息，放到后台处理，不阻塞这个连接的后续消息
     if to_user == BOT_USERNAME:
         print(f'机器人消息: {from_user} -> {BOT_USERNAME} ({content_type})')
-
-        # 处理机器人消息
-        bot_response = await handle_bot_message(from_user, content, content_type)
-
-        # 发送机器人回复
-        bot_message = {
-            'from': BOT_USERNAME,
-            'to': from_user,
-            'content': bot_response,
-            'content_type': 'text',
-            'timestamp': int(datetime.now().timestamp() * 1000),
-            'read': False
-        }
-
-        messages_store[chat_key].append(bot_message)
-        save_messages()  # 保存消息
-
-        if from_user in connected_users:
-            await connected_users[from_user].send_json({
-                'type': 'new_message',
-                **bot_message
-            })
-        else:
-            if from_user not in offline_messages:
-                offline_messages[from_user] = []
-            offline_messages[from_user].append(bot_message)
+        start_bot_job(ws or connected_users.get(from_user), chat_key, from_user, content, content_type, timestamp)
 
     # 转发消息给接收者（如果在线）或存储为离线消息
     elif to_user in connected_users:
-        await connected_users[to_user].send_json({
+        send_to(connected_users[to_user], {
             'type': 'new_message',
             **message
         })
         print(f'消息: {from_user} -> {to_user} ({content_type}) [已送达]')
     else:
         # 接收者离线，存储为离线消息
-        if to_user not in offline_messages:
-            offline_messages[to_user] = []
-        offline_messages[to_user].append(message)
+        push_offline_message(to_user, message)
         print(f'消息: {from_user} -> {to_user} ({content_type}) [离线存储]')
 
 
@@ -655,16 +1198,12 @@ async def handle_mark_as_read(data, current_user):
     if not from_user:
         return
 
-    # 更新消息状态
-    chat_key = get_chat_key(current_user, from_user)
-    if chat_key in messages_store:
-        for msg in messages_store[chat_key]:
-            if msg['to'] == current_user and msg['from'] == from_user:
-                msg['read'] = True
+    # 更新消息状态（存储后端按 (from, to) 索引只改写未读的消息）
+    log_mark_read(get_chat_key(current_user, from_user), from_user, current_user)
 
     # 通知发送者消息已读
     if from_user in connected_users:
-        await connected_users[from_user].send_json({
+        send_to(connected_users[from_user], {
             'type': 'message_read',
             'user': current_user
         })
@@ -692,44 +1231,24 @@ async def handle_recall_message(data, current_user):
         if current_user not in group['members']:
             return
 
-        # 从消息存储中删除原消息，但为其他用户保留撤回痕迹
-        if group_id in messages_store:
-            # 找到被撤回的消息
-            original_msg = None
-            for msg in messages_store[group_id]:
-                if msg.get('timestamp') == timestamp and msg.get('from') == current_user:
-                    original_msg = msg
-                    break
-
-            # 删除原消息
-            messages_store[group_id] = [
-                msg for msg in messages_store[group_id]
-                if not (msg.get('timestamp') == timestamp and msg.get('from') == current_user)
-            ]
-
-            # 添加撤回通知消息到历史记录
-            if original_msg:
-                recall_notice = {
-                    'type': 'recall_notice',
-                    'from': current_user,
-                    'group_id': group_id,
-                    'timestamp': timestamp,
-                    'content': f'{current_user} 撤回了一条消息',
-                    'content_type': 'recall_notice',
-                    'original_timestamp': timestamp
-                }
-                messages_store[group_id].append(recall_notice)
-                save_messages()
+        # 用撤回通知替换原消息，为其他用户保留撤回痕迹
+        log_recall(group_id, timestamp, current_user, {
+            'type': 'recall_notice',
+            'from': current_user,
+            'group_id': group_id,
+            'timestamp': timestamp,
+            'content': f'{current_user} 撤回了一条消息',
+            'content_type': 'recall_notice',
+            'original_timestamp': timestamp
+        })
 
         # 通知所有群成员（除了自己）
-        for member in group['members']:
-            if member != current_user and member in connected_users:
-                await connected_users[member].send_json({
-                    'type': 'message_recalled',
-                    'timestamp': timestamp,
-                    'group_id': group_id,
-                    'from': current_user
-                })
+        send_to_users(group['members'], {
+            'type': 'message_recalled',
+            'timestamp': timestamp,
+            'group_id': group_id,
+            'from': current_user
+        }, exclude=current_user)
 
         print(f'群聊消息撤回: {current_user} 在群 {group_id} 中撤回消息 {timestamp}')
 
@@ -740,38 +1259,20 @@ async def handle_recall_message(data, current_user):
 
         chat_key = get_chat_key(current_user, to_user)
 
-        # 从消息存储中删除原消息，但为对方保留撤回痕迹
-        if chat_key in messages_store:
-            # 找到被撤回的消息
-            original_msg = None
-            for msg in messages_store[chat_key]:
-                if msg.get('timestamp') == timestamp and msg.get('from') == current_user:
-                    original_msg = msg
-                    break
-
-            # 删除原消息
-            messages_store[chat_key] = [
-                msg for msg in messages_store[chat_key]
-                if not (msg.get('timestamp') == timestamp and msg.get('from') == current_user)
-            ]
-
-            # 添加撤回通知消息到历史记录
-            if original_msg:
-                recall_notice = {
-                    'type': 'recall_notice',
-                    'from': current_user,
-                    'to': to_user,
-                    'timestamp': timestamp,
-                    'content': f'{current_user} 撤回了一条消息',
-                    'content_type': 'recall_notice',
-                    'original_timestamp': timestamp
-                }
-                messages_store[chat_key].append(recall_notice)
-                save_messages()
+        # 用撤回通知替换原消息，为对方保留撤回痕迹
+        log_recall(chat_key, timestamp, current_user, {
+            'type': 'recall_notice',
+            'from': current_user,
+            'to': to_user,
+            'timestamp': timestamp,
+            'content': f'{current_user} 撤回了一条消息',
+            'content_type': 'recall_notice',
+            'original_timestamp': timestamp
+        })
 
         # 通知对方
         if to_user in connected_users:
-            await connected_users[to_user].send_json({
+            send_to(connected_users[to_user], {
                 'type': 'message_recalled',
                 'timestamp': timestamp,
                 'from': current_user
@@ -780,14 +1281,60 @@ async def handle_recall_message(data, current_user):
         print(f'私聊消息撤回: {current_user} 撤回发给 {to_user} 的消息 {timestamp}')
 
 
+def send_to(ws, message):
+    """把一帧（dict、已编码的 str 或二进制 bytes）放进连接的发送队列，不等待网络发送"""
+    queue = outbound_queues.get(ws)
+    if queue is not None:
+        queue.put(message)
+
+
+def send_to_many(websockets, message):
+    """扇出：消息只编码一次，同一个已编码的帧放进每个接收者的发送队列"""
+    frame = None
+    for ws in websockets:
+        queue = outbound_queues.get(ws)
+        if queue is None:
+            continue
+        if frame is None:
+            frame = encode_json(message)
+        queue.put(frame)
+
+
+def send_to_users(usernames, message, exclude=None):
+    """扇出给一组用户中在线的人（可排除一个用户）"""
+    send_to_many(
+        [connected_users[name] for name in usernames if name != exclude and name in connected_users],
+        message
+    )
+
+
+def remove_battle_player(username):
+    """把玩家移出3D战场（不发送通知）"""
+    del battle_3d_players[username]
+    battle_sync.leave(username)
+
+
+def send_battle_scores(tick):
+    """battle_sync 每个 tick 调用：下发本 tick 合并后的积分变化和到期的积分榜快照"""
+    for name, message in battle_score_feed.on_tick(tick, battle_3d_players):
+        if name is None:
+            send_to_battle_players(message)
+        elif name in battle_3d_players:
+            send_to(battle_3d_players[name]['websocket'], message)
+
+
+def send_to_battle_players(message, exclude=None, only=None):
+    """扇出给所有3D战场玩家（可排除一个玩家），only 不为 None 时只发给其中的玩家"""
+    names = battle_3d_players if only is None else only
+    send_to_many(
+        [battle_3d_players[name]['websocket'] for name in names if name != exclude and name in battle_3d_players],
+        message
+    )
+
+
 async def broadcast(message, exclude=None):
     """广播消息给所有用户（除了排除的用户）"""
-    for username, ws in connected_users.items():
-        if username != exclude:
-            try:
-                await ws.send_json(message)
-            except Exception as e:
-                print(f'发送消息给 {username} 失败: {e}')
+    send_to_users(list(connected_users), message, exclude=exclude)
 
 
 async def handle_create_group(ws, data, creator):
@@ -798,14 +1345,14 @@ async def handle_create_group(ws, data, creator):
     members = data.get('members', [])
 
     if not group_name:
-        await ws.send_json({
+        send_to(ws, {
             'type': 'error',
             'message': '群名称不能为空'
         })
         return
 
     if len(members) < 2:
-        await ws.send_json({
+        send_to(ws, {
             'type': 'error',
             'message': '至少需要2个成员'
         })
@@ -825,18 +1372,18 @@ async def handle_create_group(ws, data, creator):
         'members': all_members,
         'creator': creator
     }
-    save_groups()  # 保存群组
+    save_group(group_id)  # 保存群组
+    index_group(group_id, all_members)
+    await persistence.commit()
 
     # 通知所有成员（包括创建者）
-    for member in all_members:
-        if member in connected_users:
-            await connected_users[member].send_json({
-                'type': 'group_created',
-                'group_id': group_id,
-                'name': group_name,
-                'members': all_members,
-                'creator': creator
-            })
+    send_to_users(all_members, {
+        'type': 'group_created',
+        'group_id': group_id,
+        'name': group_name,
+        'members': all_members,
+        'creator': creator
+    })
 
     print(f'群组创建: {group_name} (ID: {group_id}), 成员: {all_members}')
 
@@ -863,10 +1410,6 @@ async def handle_send_group_message(data, from_user):
     if from_user not in group['members']:
         return
 
-    # 保存消息
-    if group_id not in messages_store:
-        messages_store[group_id] = []
-
     # 初始化已读列表：发送者自动标记为已读
     read_by = [from_user]
     unread_members = [m for m in group['members'] if m != from_user]
@@ -891,16 +1434,17 @@ async def handle_send_group_message(data, from_user):
     if duration is not None:
         message['duration'] = duration
 
-    messages_store[group_id].append(message)
-    save_messages()  # 保存消息
+    if not await resolve_media_content(message, data.get('blob_id')):
+        return
 
-    # 广播消息给所有群成员（除了发送者）
-    for member in group['members']:
-        if member != from_user and member in connected_users:
-            await connected_users[member].send_json({
-                'type': 'new_group_message',
-                **message
-            })
+    log_new_message(group_id, message)  # 保存消息
+    await persistence.commit()
+
+    # 广播消息给所有群成员（除了发送者），只编码一次
+    send_to_users(group['members'], {
+        'type': 'new_group_message',
+        **message
+    }, exclude=from_user)
 
     print(f'群组消息: {from_user} -> {group["name"]} ({content_type})')
 
@@ -914,45 +1458,33 @@ async def handle_mark_group_message_read(data, current_user):
         return
 
     # 检查群组是否存在
-    if group_id not in groups_store or group_id not in messages_store:
+    if group_id not in groups_store:
         return
+    group = groups_store[group_id]
 
-    # 查找消息并更新已读状态
-    for msg in messages_store[group_id]:
-        if msg.get('timestamp') == timestamp:
-            # 如果是历史消息，初始化阅读状态字段
-            if 'read_by' not in msg or 'unread_members' not in msg:
-                group = groups_store[group_id]
-                msg_sender = msg.get('from')
-                # 初始化已读列表（发送者已读）
-                msg['read_by'] = [msg_sender] if msg_sender else []
-                # 初始化未读列表（其他所有成员）
-                msg['unread_members'] = [m for m in group['members'] if m != msg_sender]
-
-            # 将当前用户从未读列表移除，添加到已读列表
-            if current_user in msg.get('unread_members', []):
-                msg['unread_members'].remove(current_user)
-            if current_user not in msg.get('read_by', []):
-                msg['read_by'].append(current_user)
-
-            # 广播更新后的阅读状态给群内所有在线成员
-            group = groups_store[group_id]
-            for member in group['members']:
-                if member in connected_users:
-                    await connected_users[member].send_json({
-                        'type': 'group_message_read_update',
-                        'group_id': group_id,
-                        'timestamp': timestamp,
-                        'read_by': msg['read_by'],
-                        'unread_members': msg['unread_members'],
-                        'reader': current_user
-                    })
+    # 在存储中按 (group_id, timestamp) 查找消息并更新已读状态（旧消息会先初始化阅读状态字段）
+    try:
+        fields = await persistence.call(storage.mark_group_read, group_id, timestamp, current_user, list(group['members']))
+    except Exception as e:
+        print(f'❌ 更新群消息已读状态失败: {e}')
+        return
+    if fields is None:
+        return
+
+    # 广播更新后的阅读状态给群内所有在线成员
+    send_to_users(group['members'], {
+        'type': 'group_message_read_update',
+        'group_id': group_id,
+        'timestamp': timestamp,
+        'read_by': fields['read_by'],
+        'unread_members': fields['unread_members'],
+        'reader': current_user
+    })
 
-            print(f'群消息已读: {current_user} 已读群 {group_id} 的消息 {timestamp}')
-            break
+    print(f'群消息已读: {current_user} 已读群 {group_id} 的消息 {timestamp}')
 
 
-async def handle_video_signal(data, current_user):
+async def handle_video_signal(data, current_user, ws=None):
     """处理视频聊天信令"""
     msg_type = data.get('type')
     group_id = data.get('group_id')
@@ -970,6 +1502,14 @@ async def handle_video_signal(data, current_user):
             group['video_members'] = set()
 
         # 处理invite信号 - 发起人加入
+        # 记录连接加入的群组视频，断开时从成员列表中移除
+        session = connections.get(ws)
+        if session is not None:
+            if msg_type == 'group_video_end':
+                session.video_groups.discard(group_id)
+            else:
+                session.video_groups.add(group_id)
+
         if msg_type == 'group_video_invite':
             group['video_members'].add(current_user)
             print(f'群组视频invite: {current_user} 发起群 {group_id} 视频')
@@ -984,16 +1524,14 @@ async def handle_video_signal(data, current_user):
 
             # 给新加入的成员发送当前成员列表
             if current_user in connected_users:
-                await connected_users[current_user].send_json({
+                send_to(connected_users[current_user], {
                     'type': 'group_video_members',
                     'group_id': group_id,
                     'members': current_members
                 })
 
             # 广播给群内其他在线成员
-            for member in group['members']:
-                if member != current_user and member in connected_users:
-                    await connected_users[member].send_json(data)
+            send_to_users(group['members'], data, exclude=current_user)
 
             print(f'群组视频accept: {current_user} 加入群 {group_id}, 当前成员: {list(group["video_members"])}')
             return
@@ -1008,9 +1546,7 @@ async def handle_video_signal(data, current_user):
                 group['video_members'] = set()
 
         # 广播给群内所有在线成员（除了发送者）
-        for member in group['members']:
-            if member != current_user and member in connected_users:
-                await connected_users[member].send_json(data)
+        send_to_users(group['members'], data, exclude=current_user)
 
         print(f'群组视频信令: {msg_type} from {current_user} to group {group_id}')
         return
@@ -1029,7 +1565,7 @@ async def handle_video_signal(data, current_user):
         return
 
     # 转发信令给目标用户
-    await connected_users[to_user].send_json(data)
+    send_to(connected_users[to_user], data)
     print(f'视频信令: {msg_type} from {from_user} to {to_user}')
 
 
@@ -1038,127 +1574,116 @@ async def handle_3d_battle_message(data, current_user, ws):
     msg_type = data.get('type')
     username = data.get('username', current_user)
 
+    session = connections.get(ws)
+
     if msg_type == '3d_battle_join':
-        # 玩家加入战场
-        position = data.get('position', {'x': 0, 'y': 0, 'z': 0})
+        # 玩家加入战场（同一个连接换了名字时先移除原来的玩家）
+        if session is not None and session.battle_username not in (None, username):
+            previous = session.battle_username
+            if previous in battle_3d_players and battle_3d_players[previous]['websocket'] is ws:
+                remove_battle_player(previous)
+                send_to_battle_players({'type': '3d_battle_player_left', 'username': previous})
+        if session is not None:
+            session.battle_username = username
+        position = parse_position(data.get('position', {})) or {'x': 0.0, 'y': 0.0, 'z': 0.0}
         battle_3d_players[username] = {
             'position': position,
-            'websocket': ws
+            'websocket': ws,
+            'binary': bool(data.get('binary'))  # 位置使用二进制帧（battle_sync.py）
         }
+        player_id = battle_sync.join(username)
 
         # 初始化积分
         if username not in battle_3d_scores:
-            battle_3d_scores[username] = 0
+            battle_3d_scores.set(username, 0)
 
         # 通知所有其他玩家
-        for player_name, player_data in list(battle_3d_players.items()):
-            if player_name != username:
-                await player_data['websocket'].send_json({
-                    'type': '3d_battle_player_joined',
-                    'username': username,
-                    'position': position
-                })
-
-        # 发送当前玩家列表给新加入的玩家
+        send_to_battle_players({
+            'type': '3d_battle_player_joined',
+            'username': username,
+            'id': player_id,
+            'position': position
+        }, exclude=username)
+
+        # 发送当前玩家列表给新加入的玩家（视野内的位置由下一个 tick 的 3d_battle_state 下发）
         players_list = [
-            {'username': name, 'position': pdata['position']}
+            {'username': name, 'id': battle_sync.ids[name], 'position': pdata['position']}
             for name, pdata in battle_3d_players.items()
             if name != username
         ]
-        await ws.send_json({
+        send_to(ws, {
             'type': '3d_battle_players_list',
+            'id': player_id,
             'players': players_list
         })
 
-        # 发送积分榜给新玩家
-        await ws.send_json({
-            'type': '3d_battle_score_update',
-            'scores': battle_3d_scores
-        })
+        # 发送积分榜快照给新玩家（其他玩家在下一次快照中看到他）
+        send_to(ws, battle_score_feed.snapshot(username))
 
         print(f'3D战场: {username} 加入，当前玩家数: {len(battle_3d_players)}')
 
     elif msg_type == '3d_battle_leave':
         # 玩家离开战场
+        if session is not None and session.battle_username == username:
+            session.battle_username = None
         if username in battle_3d_players:
-            del battle_3d_players[username]
+            remove_battle_player(username)
 
             # 通知所有其他玩家
-            for player_name, player_data in list(battle_3d_players.items()):
-                await player_data['websocket'].send_json({
-                    'type': '3d_battle_player_left',
-                    'username': username
-                })
+            send_to_battle_players({
+                'type': '3d_battle_player_left',
+                'username': username
+            })
 
             print(f'3D战场: {username} 离开，当前玩家数: {len(battle_3d_players)}')
 
     elif msg_type == '3d_battle_move':
-        # 玩家移动
-        position = data.get('position', {'x': 0, 'y': 0, 'z': 0})
-
-        if username in battle_3d_players:
-            battle_3d_players[username]['position'] = position
-
-            # 广播给所有其他玩家
-            for player_name, player_data in list(battle_3d_players.items()):
-                if player_name != username:
-                    await player_data['websocket'].send_json({
-                        'type': '3d_battle_move',
-                        'username': username,
-                        'position': position
-                    })
+        # 玩家移动：只记录最新位置，由 battle_sync 的 tick 合并下发给视野内的玩家
+        position = parse_position(data.get('position'))
+        if position is not None:
+            battle_sync.move(username, position)
 
     elif msg_type == '3d_battle_attack':
         # 玩家攻击
         position = data.get('position', {'x': 0, 'y': 0, 'z': 0})
         hit_players = data.get('hitPlayers', [])
 
-        # 广播攻击动作给所有其他玩家
-        for player_name, player_data in list(battle_3d_players.items()):
-            if player_name != username:
-                await player_data['websocket'].send_json({
-                    'type': '3d_battle_attack',
-                    'username': username,
-                    'position': position,
-                    'hitPlayers': hit_players
-                })
+        # 攻击动作只发给视野内的其他玩家（被击中的人一定在攻击范围内）
+        attacker = battle_3d_players.get(username)
+        viewers = battle_sync.nearby(attacker['position'], exclude=username) if attacker else []
+        send_to_battle_players({
+            'type': '3d_battle_attack',
+            'username': username,
+            'position': position,
+            'hitPlayers': hit_players
+        }, only=viewers)
 
         # 单独通知每个被击中的玩家并更新积分
         for hit_username in hit_players:
             if hit_username in battle_3d_players:
-                # 更新积分：攻击者+1，被击中者-1
+                # 更新积分：攻击者+1，被击中者-1（变化在下一个 tick 合并下发）
                 if username in battle_3d_scores:
-                    battle_3d_scores[username] += 1
+                    battle_3d_scores.add(username, 1)
                 if hit_username in battle_3d_scores:
-                    battle_3d_scores[hit_username] -= 1
-
-                # 通知所有玩家这个人被击中了（用于显示其他人的被击中动画）
-                for player_name, player_data in list(battle_3d_players.items()):
-                    await player_data['websocket'].send_json({
-                        'type': '3d_battle_hit',
-                        'attacker': username,
-                        'hitUsername': hit_username
-                    })
+                    battle_3d_scores.add(hit_username, -1)
 
-        # 如果有人被击中，广播积分更新
-        if hit_players:
-            for player_name, player_data in list(battle_3d_players.items()):
-                await player_data['websocket'].send_json({
-                    'type': '3d_battle_score_update',
-                    'scores': battle_3d_scores
-                })
+                # 通知能看到的玩家这个人被击中了（用于显示其他人的被击中动画）
+                send_to_battle_players({
+                    'type': '3d_battle_hit',
+                    'attacker': username,
+                    'hitUsername': hit_username
+                }, only=battle_sync.nearby(battle_3d_players[hit_username]['position']))
 
     elif msg_type == '3d_battle_chat':
         # 聊天消息
         message = data.get('message', '')
 
         # 广播给所有玩家（包括自己）
-        for player_name, player_data in list(battle_3d_players.items()):
-            await player_data['websocket'].send_json({
-                'type': '3d_battle_chat',
-                'username': username,
-                'message': message
-            })
+        send_to_battle_players({
+            'type': '3d_battle_chat',
+            'username': username,
+            'message': message
+        })
 
 
 async def index_handler(request):
@@ -1172,28 +1697,22 @@ async def static_handler(request):
     return web.FileResponse(f'./{filename}')
 
 
-async def extract_text_from_pdf(pdf_data):
-    """从PDF字节数据中提取文本"""
-    if not PDF_SUPPORT:
-        raise Exception('PDF处理库未安装，请运行: pip install PyPDF2')
+def get_request_user(request):
+    """HTTP 请求对应的已注册用户，未注册返回 None
 
-    try:
-        pdf_file = io.BytesIO(pdf_data)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-
-        text_content = []
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text = page.extract_text()
-            if text.strip():
-                text_content.append(f"[第{page_num + 1}页]\n{text}")
-
-        result = '\n\n'.join(text_content)
-        print(f'✅ PDF解析完成: {len(pdf_reader.pages)}页, {len(result)}字符')
-        return result
-    except Exception as e:
-        print(f'❌ PDF解析失败: {str(e)}')
-        raise Exception(f'PDF解析失败: {str(e)}')
+    客户端在 X-Chat-User（URL 编码的用户名）和 X-Chat-User-Id 中带上注册时的用户名和 userId，
+    必须与本次运行中注册过的一致；WebSocket 断线重连期间也可以使用（HTTP 上传正是断线时的备用通道）。
+    """
+    username = unquote(request.headers.get('X-Chat-User', ''))
+    user_id = request.headers.get('X-Chat-User-Id', '')
+    if username and user_id and user_ids.get(username) == user_id:
+        return username
+    return None
+
+
+async def extract_text_from_pdf(pdf_data, digest=None):
+    """从PDF字节数据或文件路径中提取文本（在工作进程中解析，不阻塞事件循环；解析过的页面从缓存读取）"""
+    return await pdf_extractor.extract(pdf_data, digest)
 
 
 def create_app():
@@ -1212,8 +1731,19 @@ def create_app():
     # AI聊天总结API处理函数（支持两种模式）
     async def summarize_chat_handler(request):
         """处理AI聊天总结请求 - 支持JSON（旧版）和multipart（新版）两种格式"""
+        # 文本字段占用的上传额度在整个请求（包括分段总结和 Claude 调用）结束后才归还
+        reserved = 0
+
+        async def read_text(field, max_size):
+            nonlocal reserved
+            data = await read_field(field, max_size, upload_budget)
+            reserved += len(data)
+            return data.decode('utf-8')
+
         try:
             content_type = request.headers.get('Content-Type', '')
+            # ?no_cache=1（或表单/JSON 中的 no_cache 字段）跳过总结缓存
+            bypass_cache = request.query.get('no_cache') in ('1', 'true')
 
             # 判断请求类型
             if 'application/json' in content_type:
@@ -1224,12 +1754,14 @@ def create_app():
                 end_date = data.get('end_date', '')
                 chat_content = data.get('chat_content', '')
                 custom_prompt = data.get('custom_prompt', '')
+                bypass_cache = bypass_cache or bool(data.get('no_cache'))
 
                 print(f'📊 收到AI总结请求（旧版）: 用户={users}, 消息数量={len(chat_content.split(chr(10)))}条')
 
                 # 构建总结prompt（旧版）
-                if custom_prompt:
-                    prompt = f"""{custom_prompt}
+                def build_prompt(chat_content):
+                    if custom_prompt:
+                        return f"""{custom_prompt}
 
 【重要】请严格按照以下信息进行分析：
 - 关注用户：{', '.join(users)}
@@ -1237,8 +1769,7 @@ def create_app():
 
 聊天记录：
 {chat_content}"""
-                else:
-                    prompt = f"""请对以下聊天记录进行详细总结分析。
+                    return f"""请对以下聊天记录进行详细总结分析。
 
 【关键信息】
 - 关注用户：{', '.join(users)}
@@ -1257,42 +1788,52 @@ def create_app():
 
 请用清晰、简洁的中文进行总结。"""
 
+                materials = [chat_content]
+
             else:
                 # 新版模式：上下文+待总结内容（multipart格式）
+                # 声明的请求大小已经超过两个 PDF 加文本的上限时，不读取请求体直接拒绝
+                if request.content_length is not None and request.content_length > UPLOAD_REQUEST_MAX_SIZE:
+                    return web.json_response({
+                        'error': f'上传内容过大，PDF文件大小不能超过{PDF_MAX_SIZE // 1024 // 1024}MB'
+                    }, status=413)
                 reader = await request.multipart()
 
                 context_text = ''
                 content_text = ''
                 custom_prompt = ''
 
-                # 处理表单字段
+                # 处理表单字段（分块读取，超过大小上限立即中止；PDF 写入临时文件后按路径交给解析进程）
                 async for field in reader:
-                    if field.name == 'context_text':
-                        context_text = (await field.read()).decode('utf-8')
-                        print(f'📝 收到上下文文本: {len(context_text)} 字符')
-                    elif field.name == 'context_pdf':
-                        pdf_data = await field.read()
-                        # 验证PDF文件大小（最大10MB）
-                        if len(pdf_data) > 10 * 1024 * 1024:
-                            return web.json_response({
-                                'error': '上下文PDF文件大小不能超过10MB'
-                            }, status=400)
-                        context_text = await extract_text_from_pdf(pdf_data)
-                        print(f'📎 收到上下文PDF: {len(pdf_data)} 字节, 提取 {len(context_text)} 字符')
-                    elif field.name == 'content_text':
-                        content_text = (await field.read()).decode('utf-8')
-                        print(f'📝 收到总结文本: {len(content_text)} 字符')
-                    elif field.name == 'content_pdf':
-                        pdf_data = await field.read()
-                        # 验证PDF文件大小（最大10MB）
-                        if len(pdf_data) > 10 * 1024 * 1024:
-                            return web.json_response({
-                                'error': '总结PDF文件大小不能超过10MB'
-                            }, status=400)
-                        content_text = await extract_text_from_pdf(pdf_data)
-                        print(f'📎 收到总结PDF: {len(pdf_data)} 字节, 提取 {len(content_text)} 字符')
-                    elif field.name == 'custom_prompt':
-                        custom_prompt = (await field.read()).decode('utf-8')
+                    # 没有名字的字段和嵌套的 multipart 直接跳过（读取下一个字段时会丢弃其内容）
+                    if not getattr(field, 'name', None):
+                        continue
+                    label = '上下文' if field.name.startswith('context_') else '总结'
+                    try:
+                        if field.name == 'context_text':
+                            context_text = await read_text(field, UPLOAD_TEXT_MAX_SIZE)
+                            print(f'📝 收到上下文文本: {len(context_text)} 字符')
+                        elif field.name in ('context_pdf', 'content_pdf'):
+                            with await spool_field(field, PDF_MAX_SIZE, upload_budget, UPLOAD_TMP_DIR) as upload:
+                                pdf_text = await extract_text_from_pdf(upload.path, upload.sha256)
+                            print(f'📎 收到{label}PDF: {upload.size} 字节, 提取 {len(pdf_text)} 字符')
+                            if field.name == 'context_pdf':
+                                context_text = pdf_text
+                            else:
+                                content_text = pdf_text
+                        elif field.name == 'content_text':
+                            content_text = await read_text(field, UPLOAD_TEXT_MAX_SIZE)
+                            print(f'📝 收到总结文本: {len(content_text)} 字符')
+                        elif field.name == 'custom_prompt':
+                            custom_prompt = await read_text(field, UPLOAD_TEXT_MAX_SIZE)
+                        elif field.name == 'no_cache':
+                            bypass_cache = (await read_text(field, 16)) in ('1', 'true')
+                    except UploadTooLarge as e:
+                        return web.json_response({
+                            'error': f'{label}{"PDF文件" if field.name.endswith("_pdf") else "文本"}{e}'
+                        }, status=400)
+                    except UploadBudgetExceeded as e:
+                        return web.json_response({'error': str(e)}, status=503)
 
                 print(f'📊 AI总结请求（新版）: 上下文={len(context_text)}字符, 内容={len(content_text)}字符')
 
@@ -1303,16 +1844,16 @@ def create_app():
                     }, status=400)
 
                 # 构建总结prompt（新版）
-                if custom_prompt:
-                    prompt = f"""{custom_prompt}
+                def build_prompt(context_text, content_text):
+                    if custom_prompt:
+                        return f"""{custom_prompt}
 
 【上下文信息】（历史聊天记录作为背景）：
 {context_text}
 
 【需要总结的聊天记录】：
 {content_text}"""
-                else:
-                    prompt = f"""请对以下聊天记录进行详细总结分析。
+                    return f"""请对以下聊天记录进行详细总结分析。
 
 【上下文信息】（历史聊天记录作为背景）：
 {context_text}
@@ -1331,44 +1872,38 @@ def create_app():
 
 请用清晰、简洁的中文进行总结。"""
 
-            # 调用Claude API进行总结
-            api_key = os.environ.get('ANTHROPIC_API_KEY', '')
-            if not api_key:
-                return web.json_response({
-                    'error': 'API密钥未配置'
-                }, status=500)
-
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    'https://api.anthropic.com/v1/messages',
-                    headers={
-                        'x-api-key': api_key,
-                        'anthropic-version': '2023-06-01',
-                        'content-type': 'application/json'
-                    },
-                    json={
-                        'model': 'claude-3-5-sonnet-20241022',
-                        'max_tokens': 2048,
-                        'messages': [{
-                            'role': 'user',
-                            'content': prompt
-                        }]
-                    }
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        print(f'❌ Claude API错误: {error_text}')
-                        return web.json_response({
-                            'error': f'API调用失败: {error_text}'
-                        }, status=500)
+                materials = [context_text, content_text]
 
-                    result = await response.json()
-                    summary = result['content'][0]['text']
-                    print(f'✅ AI总结完成，长度={len(summary)}字符')
+            # 调用Claude API进行总结（按客户端地址公平排队），相同内容直接返回缓存的总结
+            async def compute():
+                return await llm_client.complete(prompt, user=request.remote, max_tokens=2048)
 
-                    return web.json_response({
-                        'summary': summary
-                    })
+            try:
+                prompt = build_prompt(*materials)
+                # 太长时先把聊天记录（和上下文）分段提取要点，再用要点代替原文
+                # 预算扣除 prompt 模板后按材料平分，压缩后整个 prompt 不超过 chunk_tokens
+                if summarizer.needs_chunking(prompt):
+                    overhead = estimate_tokens(build_prompt(*[''] * len(materials)))
+                    budget = max(1, (summarizer.chunk_tokens - overhead) // len(materials))
+                    materials = [
+                        await summarizer.condense(material, user=request.remote, bypass_cache=bypass_cache,
+                                                  budget=budget)
+                        for material in materials
+                    ]
+                    prompt = build_prompt(*materials)
+                summary, source = await summary_cache.get_or_compute(
+                    summary_key(llm_client.model, None, prompt), compute, bypass=bypass_cache)
+            except LLMError as e:
+                print(f'❌ Claude API错误: {e}')
+                return web.json_response({
+                    'error': str(e)
+                }, status=503 if e.status in (429, 503, 529) else 500)
+
+            print(f'✅ AI总结完成，长度={len(summary)}字符' + ('（缓存）' if source != 'computed' else ''))
+            return web.json_response({
+                'summary': summary,
+                'cached': source != 'computed'
+            })
 
         except Exception as e:
             print(f'❌ AI总结处理错误: {str(e)}')
@@ -1377,6 +1912,8 @@ def create_app():
             return web.json_response({
                 'error': str(e)
             }, status=500)
+        finally:
+            upload_budget.release(reserved)
 
     # 天气API处理器
     async def weather_handler(request):
@@ -1398,25 +1935,25 @@ def create_app():
             print(f'🌤️ 获取天气信息: lat={lat}, lon={lon}')
 
             # 调用OpenWeatherMap API
-            async with aiohttp.ClientSession() as session:
-                async with session.get(weather_url) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        print(f'❌ 天气API错误: {error_text}')
-                        return web.json_response({
-                            'error': f'天气API调用失败: {error_text}'
-                        }, status=500)
+            session = await http_clients.session()
+            async with session.get(weather_url, timeout=http_clients.timeout('weather')) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    print(f'❌ 天气API错误: {error_text}')
+                    return web.json_response({
+                        'error': f'天气API调用失败: {error_text}'
+                    }, status=500)
 
-                    data = await response.json()
-                    print(f'✅ 天气数据获取成功: {data.get("name")}')
+                data = await response.json()
+                print(f'✅ 天气数据获取成功: {data.get("name")}')
 
-                    # 返回处理后的天气数据
-                    return web.json_response({
-                        'temp': round(data['main']['temp']),
-                        'description': data['weather'][0]['description'],
-                        'city': data['name'],
-                        'weather_main': data['weather'][0]['main']
-                    })
+                # 返回处理后的天气数据
+                return web.json_response({
+                    'temp': round(data['main']['temp']),
+                    'description': data['weather'][0]['description'],
+                    'city': data['name'],
+                    'weather_main': data['weather'][0]['main']
+                })
 
         except Exception as e:
             print(f'❌ 天气处理错误: {str(e)}')
@@ -1426,11 +1963,145 @@ def create_app():
                 'error': str(e)
             }, status=500)
 
+    # 媒体文件上传：请求体是文件原始字节，Content-Type 是文件类型
+    async def blob_upload_handler(request):
+        """流式保存上传的图片/语音，返回 blob 引用（只接受已注册用户的上传，磁盘写入在线程池中执行）"""
+        username = get_request_user(request)
+        if username is None:
+            return web.json_response({'error': '请先登录'}, status=401)
+        content_type = normalize_content_type(request.headers.get('Content-Type'))
+        if content_type is None:
+            return web.json_response({'error': '不支持的文件类型'}, status=415)
+        if request.content_length is not None and request.content_length > BLOB_MAX_SIZE:
+            return web.json_response({'error': f'文件过大，最大 {BLOB_MAX_SIZE // 1024 // 1024}MB'}, status=413)
+
+        loop = asyncio.get_running_loop()
+        writer = await loop.run_in_executor(blob_executor, blob_store.writer, content_type, BLOB_MAX_SIZE)
+        reserved = 0
+        try:
+            async for chunk in request.content.iter_chunked(64 * 1024):
+                upload_budget.reserve(len(chunk))
+                reserved += len(chunk)
+                await loop.run_in_executor(blob_executor, writer.write, chunk)
+            info = await loop.run_in_executor(blob_executor, writer.commit)
+        except BlobTooLarge:
+            return web.json_response({'error': f'文件过大，最大 {BLOB_MAX_SIZE // 1024 // 1024}MB'}, status=413)
+        except BaseException as e:
+            # 包括客户端断开导致的取消：清理排在还没完成的写入之后，不等待
+            blob_executor.submit(writer.abort)
+            if isinstance(e, UploadBudgetExceeded):
+                return web.json_response({'error': str(e)}, status=503)
+            raise
+        finally:
+            upload_budget.release(reserved)
+
+        print(f'📎 文件已保存: {info["blob_id"][:12]} ({content_type}, {info["size"]} 字节, {username})')
+        return web.json_response({**info, 'url': blob_url(info['blob_id'])})
+
+    # 媒体文件下载：内容不可变，ETag 就是内容哈希，支持 Range 断点/分段读取
+    async def blob_download_handler(request):
+        """返回 blob 内容（FileResponse 在线程中读取文件或用 sendfile，并处理 Range）"""
+        blob_id = request.match_info['blob_id']
+        info = await asyncio.get_running_loop().run_in_executor(blob_executor, blob_store.stat, blob_id)
+        if info is None:
+            return web.json_response({'error': '文件不存在'}, status=404)
+
+        etag = f'"{blob_id}"'
+        headers = {
+            'ETag': etag,
+            'Cache-Control': 'public, max-age=31536000, immutable',
+            'X-Content-Type-Options': 'nosniff'
+        }
+        if_none_match = request.headers.get('If-None-Match', '')
+        if if_none_match == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return web.Response(status=304, headers=headers)
+
+        return BlobFileResponse(blob_store.path(blob_id), blob_id,
+                                headers={**headers, 'Content-Type': info['content_type']})
+
+    # 运行指标
+    async def metrics_handler(request):
+        """返回发送队列、持久化等运行指标"""
+        depths = [queue.depth() for queue in outbound_queues.values()]
+        return web.json_response({
+            'connections': len(outbound_queues),
+            'online_users': len(connected_users),
+            'outbound': {
+                **outbound_stats,
+                'queue_depth_total': sum(depths),
+                'queue_depth_max': max(depths, default=0),
+                'queue_size_limit': OUTBOUND_QUEUE_SIZE,
+                'policy': OUTBOUND_QUEUE_POLICY,
+                'json_encoder': JSON_ENCODER
+            },
+            'persistence': persistence.stats(),
+            'blobs': blob_store.stats,
+            'http_clients': http_clients.stats(),
+            'geoip_cache': geoip_cache.stats(),
+            'geoip_resolver': geoip_resolver.stats(),
+            'llm': llm_client.stats(),
+            'summary_cache': summary_cache.stats(),
+            'summarizer': summarizer.stats(),
+            'pdf': pdf_extractor.stats(),
+            'battle': battle_sync.stats(),
+            'scoreboard': battle_score_feed.stats(),
+            'sessions': connections.stats(),
+            'uploads': upload_budget.stats()
+        })
+
+    # 启动写后持久化任务，关闭时把剩余数据写入磁盘
+    async def start_persistence(app):
+        persistence.start()
+
+    async def stop_persistence(app):
+        await persistence.close()
+        summary_cache.close()
+
+    # 总结缓存数据库在启动时打开（导入模块时不访问磁盘）
+    async def start_summary_cache(app):
+        await asyncio.to_thread(summary_cache.open)
+        print('💾 持久化数据已全部写入')
+
+    # 出站 HTTP 连接池随应用启动和关闭
+    async def start_http_clients(app):
+        await http_clients.start()
+
+    async def stop_http_clients(app):
+        await http_clients.close()
+
+    # PDF 解析工作进程随应用启动和关闭
+    async def start_pdf_extractor(app):
+        if PDF_SUPPORT:
+            await pdf_extractor.start()
+
+    async def stop_pdf_extractor(app):
+        pdf_extractor.close()
+
+    # 3D战场同步 tick 随应用启动和关闭
+    async def start_battle_sync(app):
+        battle_sync.start()
+
+    async def stop_battle_sync(app):
+        await battle_sync.close()
+
+    app.on_startup.append(start_persistence)
+    app.on_startup.append(start_summary_cache)
+    app.on_startup.append(start_http_clients)
+    app.on_startup.append(start_pdf_extractor)
+    app.on_startup.append(start_battle_sync)
+    app.on_cleanup.append(stop_battle_sync)
+    app.on_cleanup.append(stop_pdf_extractor)
+    app.on_cleanup.append(stop_http_clients)
+    app.on_cleanup.append(stop_persistence)
+
     # 添加路由
     app.router.add_get('/', index_handler)
     app.router.add_get('/ws', websocket_handler)
     app.router.add_post('/api/summarize_chat', summarize_chat_handler)
     app.router.add_get('/api/weather', weather_handler)
+    app.router.add_get('/api/metrics', metrics_handler)
+    app.router.add_post('/api/blobs', blob_upload_handler)
+    app.router.add_get('/api/blobs/{blob_id}', blob_download_handler)
     app.router.add_get('/{filename}', static_handler)
 
     # 配置 CORS
@@ -1443,7 +2114,7 @@ def create_app():
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
-    api_key = os.environ.get('ANTHROPIC_API_KEY', '')
+    api_key = llm_client.api_key
     print('=' * 60)
     print(f'🚀 实时聊天应用启动')
     print(f'📍 访问地址: http://localhost:{port}')
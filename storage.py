@@ -0,0 +1,633 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+存储后端 - 消息、群组、离线消息、机器人配置的持久化
+
+所有修改都以"记录"的形式提交（由 persistence 在写线程中批量调用 apply_batch）：
+    append / mark_read / update / recall   - 聊天消息
+    replace                                - 整个会话替换（会话 key 迁移）
+    group_save                             - 群组创建/更新
+    offline_push / offline_clear           - 离线消息队列
+    bot_config_save                        - 机器人配置
+
+聊天消息不常驻在事件循环中：历史分页、群消息已读这类需要读取消息的操作
+通过 persistence.call 在写线程中执行，先写完排队的记录再查询，结果包含之前的所有修改。
+
+后端：
+    JsonStorage   - messages.json 快照 + 追加日志，其余数据为 JSON 文件；
+                    消息在写线程中按会话保存（ChatHistory），按时间戳和未读状态建索引
+    SqliteStorage - SQLite（WAL 模式），按 chat_key/group_id + timestamp 建索引，
+                    已读、撤回、历史查询都是索引查询；首次启动时自动从 JSON 文件迁移
+"""
+
+import bisect
+import json
+import os
+import sqlite3
+
+from message_log import MessageLog
+from persistence import DURABILITY_ALWAYS, DURABILITY_GROUP
+
+MESSAGE_OPS = ('append', 'mark_read', 'update', 'recall', 'replace')
+
+_ANY = object()
+
+
+def _read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_json_atomic(path, data):
+    """先写临时文件再替换，避免写到一半时崩溃损坏原文件"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _strip_runtime_fields(group):
+    """群组视频成员是运行时状态，不持久化"""
+    return {k: v for k, v in group.items() if k != 'video_members'}
+
+
+def _timestamp(value):
+    """排序用的时间戳：时间戳由客户端提供，不是数字时按 0 处理"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return 0
+
+
+def _group_read_fields(message, reader, members):
+    """群消息已读：返回把 reader 从未读移到已读之后的 {read_by, unread_members}，不修改 message"""
+    sender = message.get('from')
+    if 'read_by' in message and 'unread_members' in message:
+        read_by = list(message['read_by'])
+        unread_members = list(message['unread_members'])
+    else:
+        # 旧消息没有阅读状态：发送者已读，其他成员未读
+        read_by = [sender] if sender else []
+        unread_members = [m for m in members if m != sender]
+    if reader in unread_members:
+        unread_members.remove(reader)
+    if reader not in read_by:
+        read_by.append(reader)
+    return {'read_by': read_by, 'unread_members': unread_members}
+
+
+class Storage:
+    """存储后端接口（除 load 外都在持久化写线程中调用）"""
+
+    def load(self):
+        """加载群组、离线消息和机器人配置，返回 {groups, group_counter, offline_messages, bot_configs, replayed}"""
+        raise NotImplementedError
+
+    def apply_batch(self, records):
+        """按顺序应用一批记录"""
+        raise NotImplementedError
+
+    def chat_keys(self):
+        """所有有消息的会话 key"""
+        raise NotImplementedError
+
+    def get_messages(self, chat_key):
+        """会话的全部消息（按时间升序，只用于启动时的迁移）"""
+        raise NotImplementedError
+
+    def get_history(self, chat_key, before=None, limit=50):
+        """会话中排在游标 before 之前最近的 limit 条消息（按时间升序）
+
+        消息按 (timestamp, seq) 排序，seq 是同一时间戳内的到达顺序；before 为上一页返回的游标 (timestamp, seq)。
+        返回 (messages, has_more, cursor)，cursor 是本页最早一条消息的 (timestamp, seq)，没有消息时为 None。
+        """
+        raise NotImplementedError
+
+    def mark_group_read(self, chat_key, timestamp, reader, members):
+        """把群消息标记为 reader 已读，返回新的 {read_by, unread_members}；消息不存在时返回 None"""
+        raise NotImplementedError
+
+    def chats_with_inline_media(self, content_types):
+        """含有未转存的内联图片/语音的会话 key（启动时迁移用）"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ChatHistory:
+    """JSON 后端中一个会话的消息，只在写线程中使用
+
+    按 (timestamp, seq) 排序，seq 是到达顺序；另外按 (from, to) 记录未读的私聊消息，
+    分页、撤回、已读都不用扫描整个会话。
+    seq 在每次启动加载时按原顺序重新编号，只会变小：重启前拿到的分页游标可能重复返回边界上的消息，但不会跳过消息。
+    """
+
+    def __init__(self, messages=()):
+        self._keys = []  # [(timestamp, seq)]，升序
+        self._messages = {}  # {seq: message}
+        self._unread = {}  # {(from, to): [seq]}
+        self._next_seq = 0
+        for message in messages:
+            self.append(message)
+
+    def append(self, message):
+        seq = self._next_seq
+        self._next_seq += 1
+        bisect.insort(self._keys, (_timestamp(message.get('timestamp')), seq))
+        self._messages[seq] = message
+        if message.get('read') is False and 'to' in message:
+            self._unread.setdefault((message.get('from'), message['to']), []).append(seq)
+
+    def _find(self, timestamp, sender=_ANY):
+        """时间戳相同（且发送者相同）的消息 seq，按到达顺序"""
+        key = _timestamp(timestamp)
+        i = bisect.bisect_left(self._keys, (key, -1))
+        seqs = []
+        while i < len(self._keys) and self._keys[i][0] == key:
+            seq = self._keys[i][1]
+            message = self._messages[seq]
+            if message.get('timestamp') == timestamp and (sender is _ANY or message.get('from') == sender):
+                seqs.append(seq)
+            i += 1
+        return seqs
+
+    def get(self, timestamp):
+        """时间戳对应的第一条消息"""
+        seqs = self._find(timestamp)
+        return self._messages[seqs[0]] if seqs else None
+
+    def mark_read(self, from_user, to_user):
+        for seq in self._unread.pop((from_user, to_user), []):
+            message = self._messages.get(seq)
+            if message is not None and message.get('read') is False:
+                message['read'] = True
+
+    def update(self, timestamp, fields):
+        message = self.get(timestamp)
+        if message is not None:
+            message.update(fields)
+
+    def recall(self, timestamp, sender, notice):
+        """撤回通知替换原消息（保持原来的位置），返回是否找到原消息"""
+        seqs = self._find(timestamp, sender)
+        if not seqs:
+            return False
+        if notice:
+            self._messages[seqs[0]] = dict(notice)
+            seqs = seqs[1:]
+        for seq in seqs:
+            self._keys.remove((_timestamp(timestamp), seq))
+            del self._messages[seq]
+        return True
+
+    def page(self, before=None, limit=50):
+        end = len(self._keys)
+        if before is not None:
+            end = bisect.bisect_left(self._keys, before)
+        start = max(0, end - limit)
+        keys = self._keys[start:end]
+        # 返回副本：写线程之后还会修改这些消息（已读状态），事件循环正在编码的不能是同一个字典
+        return [dict(self._messages[seq]) for _, seq in keys], start > 0, keys[0] if keys else None
+
+    def messages(self):
+        return [self._messages[seq] for _, seq in self._keys]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def _apply_message_record(chats, record):
+    """把一条消息记录应用到 {chat_key: ChatHistory}（写入和重放日志共用）"""
+    op = record.get('op')
+    chat_key = record.get('key')
+
+    if op == 'append':
+        chat = chats.get(chat_key)
+        if chat is None:
+            chat = chats[chat_key] = ChatHistory()
+        chat.append(dict(record['message']))  # 复制一份，事件循环之后怎么改原字典都不影响这里
+        return
+
+    if op == 'replace':
+        # 空列表表示删除
+        if record.get('messages'):
+            chats[chat_key] = ChatHistory(dict(message) for message in record['messages'])
+        else:
+            chats.pop(chat_key, None)
+        return
+
+    chat = chats.get(chat_key)
+    if chat is None:
+        return
+    if op == 'mark_read':
+        chat.mark_read(record.get('from'), record.get('to'))
+    elif op == 'update':
+        chat.update(record.get('timestamp'), record.get('fields', {}))
+    elif op == 'recall':
+        chat.recall(record.get('timestamp'), record.get('from'), record.get('notice'))
+
+
+class JsonStorage(Storage):
+    """JSON 文件后端：消息走追加日志，其余数据整文件写入（同一批内合并为一次）
+
+    消息保存在写线程持有的 {chat_key: ChatHistory} 中（JSON 快照只能整体加载），
+    日志记录数达到 compact_threshold 时在写线程中压缩为新快照。
+    """
+
+    def __init__(self, data_dir, compact_threshold=10000, durability=DURABILITY_GROUP):
+        self.durability = durability
+        self.messages_file = os.path.join(data_dir, 'messages.json')
+        self.messages_log_file = os.path.join(data_dir, 'messages.log')
+        self.groups_file = os.path.join(data_dir, 'groups.json')
+        self.offline_messages_file = os.path.join(data_dir, 'offline_messages.json')
+        self.bot_configs_file = os.path.join(data_dir, 'bot_configs.json')
+        self.message_log = MessageLog(self.messages_file, self.messages_log_file, compact_threshold)
+
+        # 写线程持有的镜像，只在写线程中修改，序列化时不会与事件循环竞争
+        self._chats = {}
+        self._groups = {}
+        self._group_counter = 0
+        self._offline_messages = {}
+        self._bot_configs = {}
+
+    def load(self):
+        self._chats = self.message_log.load(
+            _apply_message_record,
+            store_factory=lambda chats: {chat_key: ChatHistory(msgs) for chat_key, msgs in chats.items()}
+        )
+
+        data = _read_json(self.groups_file, {})
+        groups = data.get('groups', {})
+        group_counter = data.get('counter', 0)
+        for group in groups.values():
+            group.pop('video_members', None)
+
+        offline_messages = _read_json(self.offline_messages_file, {})
+        bot_configs = _read_json(self.bot_configs_file, {})
+
+        self._groups = {gid: dict(group) for gid, group in groups.items()}
+        self._group_counter = group_counter
+        self._offline_messages = {user: list(msgs) for user, msgs in offline_messages.items()}
+        self._bot_configs = dict(bot_configs)
+
+        return {
+            'groups': groups,
+            'group_counter': group_counter,
+            'offline_messages': offline_messages,
+            'bot_configs': bot_configs,
+            'replayed': self.message_log.pending_records
+        }
+
+    def _write_messages(self, records, fsync=True):
+        """追加日志并应用到内存中的会话，达到阈值时压缩"""
+        self.message_log.append_many(records, fsync=fsync)
+        for record in records:
+            _apply_message_record(self._chats, record)
+        if self.message_log.needs_compaction():
+            self.compact()
+
+    def apply_batch(self, records):
+        message_records = []
+        dirty = set()
+
+        for record in records:
+            op = record['op']
+            if op in MESSAGE_OPS:
+                message_records.append(record)
+            elif op == 'group_save':
+                self._groups[record['group_id']] = _strip_runtime_fields(record['group'])
+                self._group_counter = max(self._group_counter, record.get('counter', 0))
+                dirty.add('groups')
+            elif op == 'offline_push':
+                self._offline_messages.setdefault(record['username'], []).append(record['message'])
+                dirty.add('offline_messages')
+            elif op == 'offline_clear':
+                self._offline_messages[record['username']] = []
+                dirty.add('offline_messages')
+            elif op == 'bot_config_save':
+                self._bot_configs[record['username']] = record['config']
+                dirty.add('bot_configs')
+
+        if message_records:
+            self._write_messages(message_records)
+
+        if 'groups' in dirty:
+            _write_json_atomic(self.groups_file, {'groups': self._groups, 'counter': self._group_counter})
+        if 'offline_messages' in dirty:
+            _write_json_atomic(self.offline_messages_file, self._offline_messages)
+        if 'bot_configs' in dirty:
+            _write_json_atomic(self.bot_configs_file, self._bot_configs)
+
+    def compact(self):
+        """把当前消息写成新快照并清空日志"""
+        chats = {chat_key: chat.messages() for chat_key, chat in self._chats.items()}
+        self.message_log.compact(chats)
+        print(f'🗜️  消息日志已压缩: {len(chats)} 个聊天会话')
+
+    def chat_keys(self):
+        return list(self._chats)
+
+    def get_messages(self, chat_key):
+        chat = self._chats.get(chat_key)
+        return [dict(message) for message in chat.messages()] if chat else []
+
+    def get_history(self, chat_key, before=None, limit=50):
+        chat = self._chats.get(chat_key)
+        if chat is None:
+            return [], False, None
+        return chat.page(before, limit)
+
+    def mark_group_read(self, chat_key, timestamp, reader, members):
+        chat = self._chats.get(chat_key)
+        message = chat.get(timestamp) if chat else None
+        if message is None:
+            return None
+        fields = _group_read_fields(message, reader, members)
+        if fields['read_by'] != message.get('read_by') or fields['unread_members'] != message.get('unread_members'):
+            # group 模式下不单独 fsync，随下一批写入一起落盘；always 模式下立即落盘
+            self._write_messages([{'op': 'update', 'key': chat_key, 'timestamp': timestamp, 'fields': fields}],
+                                 fsync=self.durability == DURABILITY_ALWAYS)
+        return fields
+
+    def chats_with_inline_media(self, content_types):
+        return [
+            chat_key for chat_key, chat in self._chats.items()
+            if any(m.get('content_type') in content_types and not m.get('blob_id') for m in chat.messages())
+        ]
+
+    def close(self):
+        self.message_log.close()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_key TEXT NOT NULL,
+    timestamp INTEGER,
+    sender TEXT,
+    recipient TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_chat_ts ON messages (chat_key, timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_chat_pair ON messages (chat_key, recipient, sender);
+
+CREATE TABLE IF NOT EXISTS groups (
+    group_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS offline_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_offline_username ON offline_messages (username);
+
+CREATE TABLE IF NOT EXISTS bot_configs (
+    username TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+class SqliteStorage(Storage):
+    """SQLite 后端（WAL 模式）
+
+    读写都在持久化写线程中使用同一个连接，查询能看到之前提交的所有写入；
+    消息不加载到内存，历史、已读、撤回都按 (chat_key, timestamp) / (chat_key, recipient, sender) 索引查询。
+    """
+
+    def __init__(self, db_path, data_dir=None, durability=DURABILITY_GROUP):
+        self.db_path = db_path
+        self.data_dir = data_dir  # 首次启动时从这里的 JSON 文件迁移
+        self.durability = durability
+        self._conn = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # WAL 下 NORMAL 在断电时可能丢失最近提交的事务；always 模式要求提交即落盘，用 FULL
+        conn.execute('PRAGMA synchronous=FULL' if self.durability == DURABILITY_ALWAYS else 'PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _writer(self):
+        if self._conn is None:
+            self._conn = self._connect()
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _get_meta(self, key, default=None):
+        row = self._writer().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def load(self):
+        conn = self._writer()
+
+        if self._get_meta('initialized') is None:
+            if self.data_dir:
+                migrate_json_to_sqlite(JsonStorage(self.data_dir), self)
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('initialized', '1')")
+
+        groups = {group_id: json.loads(data) for group_id, data in conn.execute('SELECT group_id, data FROM groups')}
+
+        offline_messages = {}
+        for username, data in conn.execute('SELECT username, data FROM offline_messages ORDER BY id'):
+            offline_messages.setdefault(username, []).append(json.loads(data))
+
+        bot_configs = {username: json.loads(data) for username, data in conn.execute('SELECT username, data FROM bot_configs')}
+
+        return {
+            'groups': groups,
+            'group_counter': int(self._get_meta('group_counter', 0)),
+            'offline_messages': offline_messages,
+            'bot_configs': bot_configs,
+            'replayed': 0
+        }
+
+    def _insert_message(self, conn, chat_key, message):
+        conn.execute(
+            'INSERT INTO messages (chat_key, timestamp, sender, recipient, data) VALUES (?, ?, ?, ?, ?)',
+            (chat_key, message.get('timestamp'), message.get('from'), message.get('to'), _dumps(message))
+        )
+
+    def apply_batch(self, records):
+        conn = self._writer()
+        with conn:  # 一批记录一个事务
+            for record in records:
+                op = record['op']
+                chat_key = record.get('key')
+
+                if op == 'append':
+                    self._insert_message(conn, chat_key, record['message'])
+
+                elif op == 'mark_read':
+                    # 索引 (chat_key, recipient, sender)，只改写未读的消息
+                    conn.execute(
+                        "UPDATE messages SET data = json_set(data, '$.read', json('true')) "
+                        "WHERE chat_key = ? AND recipient = ? AND sender = ? AND json_extract(data, '$.read') = 0",
+                        (chat_key, record['to'], record['from'])
+                    )
+
+                elif op == 'update':
+                    # 索引 (chat_key, timestamp)，只更新第一条匹配的消息
+                    row = conn.execute(
+                        'SELECT id, data FROM messages WHERE chat_key = ? AND timestamp = ? ORDER BY id LIMIT 1',
+                        (chat_key, record['timestamp'])
+                    ).fetchone()
+                    if row:
+                        message = json.loads(row[1])
+                        message.update(record.get('fields', {}))
+                        conn.execute('UPDATE messages SET data = ? WHERE id = ?', (_dumps(message), row[0]))
+
+                elif op == 'recall':
+                    # 撤回通知替换原消息（保持原来的位置），原消息不存在时什么都不做
+                    ids = [row[0] for row in conn.execute(
+                        'SELECT id FROM messages WHERE chat_key = ? AND timestamp = ? AND sender = ? ORDER BY id',
+                        (chat_key, record['timestamp'], record['from'])
+                    )]
+                    notice = record.get('notice')
+                    if ids and notice:
+                        conn.execute(
+                            'UPDATE messages SET sender = ?, recipient = ?, data = ? WHERE id = ?',
+                            (notice.get('from'), notice.get('to'), _dumps(notice), ids[0])
+                        )
+                        ids = ids[1:]
+                    conn.executemany('DELETE FROM messages WHERE id = ?', [(i,) for i in ids])
+
+                elif op == 'replace':
+                    conn.execute('DELETE FROM messages WHERE chat_key = ?', (chat_key,))
+                    for message in record.get('messages') or []:
+                        self._insert_message(conn, chat_key, message)
+
+                elif op == 'group_save':
+                    conn.execute(
+                        'INSERT OR REPLACE INTO groups (group_id, data) VALUES (?, ?)',
+                        (record['group_id'], _dumps(_strip_runtime_fields(record['group'])))
+                    )
+                    conn.execute(
+                        "INSERT INTO meta (key, value) VALUES ('group_counter', ?) "
+                        'ON CONFLICT(key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))',
+                        (str(record.get('counter', 0)),)
+                    )
+
+                elif op == 'offline_push':
+                    conn.execute(
+                        'INSERT INTO offline_messages (username, data) VALUES (?, ?)',
+                        (record['username'], _dumps(record['message']))
+                    )
+
+                elif op == 'offline_clear':
+                    conn.execute('DELETE FROM offline_messages WHERE username = ?', (record['username'],))
+
+                elif op == 'bot_config_save':
+                    conn.execute(
+                        'INSERT OR REPLACE INTO bot_configs (username, data) VALUES (?, ?)',
+                        (record['username'], _dumps(record['config']))
+                    )
+
+    def chat_keys(self):
+        return [chat_key for (chat_key,) in self._writer().execute('SELECT DISTINCT chat_key FROM messages')]
+
+    def get_messages(self, chat_key):
+        rows = self._writer().execute(
+            'SELECT data FROM messages WHERE chat_key = ? ORDER BY timestamp, id', (chat_key,)
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def get_history(self, chat_key, before=None, limit=50):
+        # 游标中的 seq 是行 id；多取一条判断是否还有更早的消息
+        if before is None:
+            rows = self._writer().execute(
+                'SELECT timestamp, id, data FROM messages WHERE chat_key = ? '
+                'ORDER BY timestamp DESC, id DESC LIMIT ?',
+                (chat_key, limit + 1)
+            ).fetchall()
+        else:
+            timestamp, seq = before
+            rows = self._writer().execute(
+                'SELECT timestamp, id, data FROM messages WHERE chat_key = ? '
+                'AND (timestamp < ? OR (timestamp = ? AND id < ?)) '
+                'ORDER BY timestamp DESC, id DESC LIMIT ?',
+                (chat_key, timestamp, timestamp, seq, limit + 1)
+            ).fetchall()
+        page = rows[:limit]
+        cursor = (page[-1][0], page[-1][1]) if page else None
+        return [json.loads(data) for _, _, data in reversed(page)], len(rows) > limit, cursor
+
+    def mark_group_read(self, chat_key, timestamp, reader, members):
+        conn = self._writer()
+        row = conn.execute(
+            'SELECT id, data FROM messages WHERE chat_key = ? AND timestamp = ? ORDER BY id LIMIT 1',
+            (chat_key, timestamp)
+        ).fetchone()
+        if row is None:
+            return None
+        message = json.loads(row[1])
+        fields = _group_read_fields(message, reader, members)
+        if fields['read_by'] != message.get('read_by') or fields['unread_members'] != message.get('unread_members'):
+            message.update(fields)
+            with conn:
+                conn.execute('UPDATE messages SET data = ? WHERE id = ?', (_dumps(message), row[0]))
+        return fields
+
+    def chats_with_inline_media(self, content_types):
+        placeholders = ','.join('?' * len(content_types))
+        rows = self._writer().execute(
+            f"SELECT DISTINCT chat_key FROM messages WHERE json_extract(data, '$.content_type') IN ({placeholders}) "
+            "AND json_extract(data, '$.blob_id') IS NULL",
+            tuple(content_types)
+        )
+        return [chat_key for (chat_key,) in rows]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def migrate_json_to_sqlite(json_storage, sqlite_storage):
+    """一次性把 JSON 文件中的数据导入 SQLite"""
+    data = json_storage.load()
+    chat_keys = json_storage.chat_keys()
+
+    records = []
+    for chat_key in chat_keys:
+        for message in json_storage.get_messages(chat_key):
+            records.append({'op': 'append', 'key': chat_key, 'message': message})
+    json_storage.close()
+    for group_id, group in data['groups'].items():
+        records.append({'op': 'group_save', 'group_id': group_id, 'group': group, 'counter': data['group_counter']})
+    for username, msgs in data['offline_messages'].items():
+        for message in msgs:
+            records.append({'op': 'offline_push', 'username': username, 'message': message})
+    for username, config in data['bot_configs'].items():
+        records.append({'op': 'bot_config_save', 'username': username, 'config': config})
+
+    if records:
+        sqlite_storage.apply_batch(records)
+        print(f'✅ 已从 JSON 文件迁移 {len(chat_keys)} 个会话、{len(data["groups"])} 个群组到 SQLite')
+    return len(records)
+
+
+def create_storage(backend, data_dir, compact_threshold=10000, durability=DURABILITY_GROUP):
+    """按名称创建存储后端: json 或 sqlite（durability 与 PersistenceWriter 的持久化模式一致）"""
+    if backend == 'json':
+        return JsonStorage(data_dir, compact_threshold, durability)
+    if backend == 'sqlite':
+        return SqliteStorage(os.path.join(data_dir, 'chat.db'), data_dir, durability)
+    raise ValueError(f'未知的存储后端: {backend}')
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+长文本分段总结（map-reduce）
+
+超过 token 预算的聊天记录或 PDF 文本不再一次性发给 Claude：
+1. 按页（PDF 的 [第N页] 标记）或按消息（空行分隔的段落 / 行）切分，装箱成不超过预算的分段
+2. 各分段并发提取要点（同时进行的数量有上限），分段结果按内容缓存
+3. 把各分段要点合并，再做一次总结（合并后仍然太长时先对要点再分段提取一轮）
+
+分段从头开始装箱，长聊天记录追加内容后，前面的分段不变，重新总结时只需要处理新增的分段。
+"""
+
+import asyncio
+import re
+
+# 分段提取要点时的说明（不包含分段序号，保证同一段内容的缓存 key 不变）
+MAP_INSTRUCTION = '以下是一份长文本中的一段。请提取这一段的要点（主题、关键信息、结论、待办事项），供之后合并总结使用，不需要开场白。'
+REDUCE_HEADER = '以下是一份长文本按顺序分段提取的要点，请据此对全文进行总结：'
+
+_PAGE_MARKER = re.compile(r'\n\n(?=\[第\d+页\]\n)')
+_BLANK_LINES = re.compile(r'\n\s*\n')
+_ASCII = re.compile(r'[\x00-\x7f]')
+
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中文等非 ASCII 字符约 1 个 token，ASCII 约 4 个字符 1 个 token"""
+    ascii_chars = len(_ASCII.findall(text))
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def split_units(text):
+    """按自然边界切分：PDF 按页，聊天记录按消息（有空行时按段落，否则按行），返回 (分隔符, 片段列表)"""
+    if _PAGE_MARKER.search(text):
+        return '\n\n', _PAGE_MARKER.split(text)
+    if _BLANK_LINES.search(text):
+        return '\n\n', [unit for unit in _BLANK_LINES.split(text) if unit.strip()]
+    return '\n', text.split('\n')
+
+
+def _split_oversized(unit, max_tokens):
+    """单个片段超过预算时按行切，单行仍然太长时按字符切"""
+    if '\n' in unit:
+        return chunk_units('\n', unit.split('\n'), max_tokens)
+    # 按最坏情况（每个字符 1 个 token）切分
+    size = max(1, max_tokens - 1)
+    return [unit[i:i + size] for i in range(0, len(unit), size)]
+
+
+def chunk_units(separator, units, max_tokens):
+    chunks = []
+    current = []
+    current_tokens = 0
+    for unit in units:
+        tokens = estimate_tokens(unit)
+        if tokens > max_tokens:
+            if current:
+                chunks.append(separator.join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_oversized(unit, max_tokens))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def chunk_text(text, max_tokens):
+    """切分成不超过 max_tokens 的分段（从头开始贪心装箱）"""
+    separator, units = split_units(text)
+    return chunk_units(separator, units, max_tokens)
+
+
+class MapReduceSummarizer:
+    """llm_call(system, content, user=None, on_delta=None, max_tokens=..., bypass_cache=False) -> 文本（带缓存的 LLM 调用）"""
+
+    def __init__(self, llm_call, chunk_tokens=20000, max_parallel=3, map_max_tokens=1024, max_rounds=3):
+        self.llm_call = llm_call
+        self.chunk_tokens = chunk_tokens
+        self.max_parallel = max_parallel
+        self.map_max_tokens = map_max_tokens
+        self.max_rounds = max_rounds
+        self._stats = {'documents': 0, 'chunks': 0, 'rounds': 0}
+
+    def needs_chunking(self, text):
+        return estimate_tokens(text) > self.chunk_tokens
+
+    async def _map(self, chunks, map_system, user, bypass_cache, on_progress):
+        semaphore = asyncio.Semaphore(self.max_parallel)
+        done = 0
+
+        async def run(chunk):
+            nonlocal done
+            async with semaphore:
+                result = await self.llm_call(map_system, chunk, user=user, max_tokens=self.map_max_tokens,
+                                             bypass_cache=bypass_cache)
+            done += 1
+            if on_progress is not None:
+                on_progress(done, len(chunks))
+            return result
+
+        tasks = [asyncio.create_task(run(chunk)) for chunk in chunks]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # 任一分段失败时取消其余分段
+            for task in tasks:
+                task.cancel()
+
+    async def condense(self, text, prompt=None, user=None, bypass_cache=False, on_progress=None, budget=None):
+        """把超长文本压缩成各分段要点（必要时多轮），返回合并后的要点文本
+
+        budget 为压缩后的 token 上限，默认为 chunk_tokens；多份材料拼进同一个 prompt 时由调用方分配。
+        """
+        map_system = f'{prompt}\n\n{MAP_INSTRUCTION}' if prompt else MAP_INSTRUCTION
+        budget = self.chunk_tokens if budget is None else budget
+        for _ in range(self.max_rounds):
+            if estimate_tokens(text) <= budget:
+                break
+            chunks = chunk_text(text, self.chunk_tokens)
+            self._stats['chunks'] += len(chunks)
+            self._stats['rounds'] += 1
+            print(f'✂️ 分段总结: {estimate_tokens(text)} tokens → {len(chunks)} 段')
+            partials = await self._map(chunks, map_system, user, bypass_cache, on_progress)
+            condensed = '\n\n'.join(f'[第{i + 1}部分]\n{partial}' for i, partial in enumerate(partials))
+            if estimate_tokens(condensed) >= estimate_tokens(text):
+                break  # 要点没有比原文短，继续分段也不会收敛
+            text = condensed
+        return text
+
+    async def summarize(self, text, prompt, reduce=None, user=None, on_delta=None, bypass_cache=False, on_progress=None):
+        """分段提取要点后合并总结
+
+        reduce(要点文本) 返回最后一次调用的 (system, content)，默认用 prompt 作为 system。
+        on_delta 只用于最后的合并总结（流式输出）。
+        """
+        self._stats['documents'] += 1
+        condensed = await self.condense(text, prompt, user, bypass_cache, on_progress)
+        if reduce is None:
+            system, content = prompt, f'{REDUCE_HEADER}\n\n{condensed}'
+        else:
+            system, content = reduce(condensed)
+        return await self.llm_call(system, content, user=user, on_delta=on_delta, bypass_cache=bypass_cache)
+
+    def stats(self):
+        return {**self._stats, 'chunk_tokens': self.chunk_tokens, 'max_parallel': self.max_parallel}
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+总结结果缓存
+
+同一份聊天记录或 PDF 用同一个 prompt 重复总结时，直接返回上次的结果，不再调用 Claude API：
+- key 为 SHA-256(模型, system prompt, 内容)，换模型或改 prompt 都会重新总结
+- 内存中按 LRU 淘汰（最多 max_entries 条），可选 TTL
+- 持久化到 SQLite（data/summary_cache.db），重启后仍然有效；写入在线程池中执行，不阻塞事件循环
+- 同一个 key 的并发请求共用一次计算
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def summary_key(model, system, content):
+    """(模型, system prompt, 内容) 的 SHA-256"""
+    data = json.dumps([model, system or '', content], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class SummaryCache:
+    """db_path 为 None 时只缓存在内存中；max_entries 为 0 时关闭缓存"""
+
+    def __init__(self, db_path=None, max_entries=1000, ttl=None, clock=time.time):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # {key: (created_at, summary)}，最近使用的在末尾
+        self._touched = set()  # 命中过、还没写回 last_used 的 key
+        self._inflight = {}  # {key: Future}
+        self._conn = None
+        self._lock = threading.Lock()  # 线程池中的写入串行执行
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'bypassed': 0,
+                       'stores': 0, 'evictions': 0, 'expired': 0}
+
+    def open(self):
+        """打开数据库并加载已有的缓存（创建时不访问磁盘，服务器启动时调用；重复调用无效果）"""
+        if self.db_path and self.enabled and self._conn is None:
+            self._load()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    # ---------- SQLite ----------
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            # 写入在线程池中执行，连接需要允许跨线程使用（同一时间只有一个写入）
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS summaries (
+                key TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )''')
+        return self._conn
+
+    def _load(self):
+        conn = self._connect()
+        rows = conn.execute(
+            'SELECT key, summary, created_at FROM summaries ORDER BY last_used DESC LIMIT ?',
+            (self.max_entries,)
+        ).fetchall()
+        for key, summary, created_at in reversed(rows):
+            if not self._expired(created_at):
+                self._entries[key] = (created_at, summary)
+        # 超出上限或已过期的记录直接删除
+        with conn:
+            if self.ttl is not None:
+                conn.execute('DELETE FROM summaries WHERE created_at <= ?', (self.clock() - self.ttl,))
+            conn.execute('DELETE FROM summaries WHERE key NOT IN '
+                         '(SELECT key FROM summaries ORDER BY last_used DESC LIMIT ?)', (self.max_entries,))
+        print(f'✅ 加载了 {len(self._entries)} 条总结缓存')
+
+    def _write(self, key, summary, created_at, evicted, touched):
+        with self._lock, self._connect() as conn:
+            if key is not None:
+                conn.execute('INSERT OR REPLACE INTO summaries (key, summary, created_at, last_used) VALUES (?, ?, ?, ?)',
+                             (key, summary, created_at, created_at))
+            if evicted:
+                conn.executemany('DELETE FROM summaries WHERE key = ?', [(k,) for k in evicted])
+            if touched:
+                conn.executemany('UPDATE summaries SET last_used = ? WHERE key = ?', touched)
+
+    async def _persist(self, key=None, summary=None, created_at=None, evicted=()):
+        if not self.db_path:
+            return
+        now = self.clock()
+        touched = [(now, k) for k in self._touched if k in self._entries]
+        self._touched.clear()
+        await asyncio.to_thread(self._write, key, summary, created_at, list(evicted), touched)
+
+    # ---------- 缓存 ----------
+
+    def _expired(self, created_at):
+        return self.ttl is not None and created_at + self.ttl <= self.clock()
+
+    def get(self, key):
+        """返回缓存的总结，没有或已过期返回 None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created_at, summary = entry
+        if self._expired(created_at):
+            del self._entries[key]
+            self._stats['expired'] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._touched.add(key)
+        return summary
+
+    async def put(self, key, summary):
+        if not self.enabled:
+            return
+        created_at = self.clock()
+        self._entries[key] = (created_at, summary)
+        self._entries.move_to_end(key)
+        self._stats['stores'] += 1
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            evicted.append(self._entries.popitem(last=False)[0])
+        self._stats['evictions'] += len(evicted)
+        try:
+            await self._persist(key, summary, created_at, evicted)
+        except sqlite3.Error as e:
+            print(f'⚠️ 总结缓存写入失败: {e}')
+
+    async def get_or_compute(self, key, compute, bypass=False):
+        """返回 (总结, 来源)，来源为 'hit' / 'coalesced' / 'computed'
+
+        compute 为返回总结文本的协程函数，抛出的异常原样传给调用方（失败结果不缓存）。
+        bypass=True 时跳过读缓存，重新计算并覆盖缓存。
+        """
+        if not self.enabled:
+            return await compute(), 'computed'
+
+        if bypass:
+            self._stats['bypassed'] += 1
+        else:
+            summary = self.get(key)
+            if summary is not None:
+                self._stats['hits'] += 1
+                return summary, 'hit'
+            future = self._inflight.get(key)
+            while future is not None:
+                # 等待正在进行的同一个计算；它被取消（发起的用户断开）时由这里重新计算
+                await asyncio.wait([future])
+                if not future.cancelled():
+                    self._stats['coalesced'] += 1
+                    return future.result(), 'coalesced'
+                future = self._inflight.get(key)
+            self._stats['misses'] += 1
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            summary = await compute()
+            future.set_result(summary)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有其他等待者时不报 "exception was never retrieved"
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        await self.put(key, summary)
+        return summary, 'computed'
+
+    def close(self):
+        if self._conn is not None:
+            if self._touched:
+                try:
+                    now = self.clock()
+                    self._write(None, None, None, [], [(now, k) for k in self._touched if k in self._entries])
+                except sqlite3.Error:
+                    pass
+                self._touched.clear()
+            self._conn.close()
+            self._conn = None
+
+    def stats(self):
+        lookups = self._stats['hits'] + self._stats['misses'] + self._stats['coalesced']
+        return {
+            **self._stats,
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hit_rate': (self._stats['hits'] + self._stats['coalesced']) / lookups if lookups else 0.0,
+            'inflight': len(self._inflight)
+        }
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试3D战场定时同步：同一 tick 内的移动合并、按视野过滤、离开/重新进入视野、tick 频率、二进制位置帧
+"""
+
+import asyncio
+
+from battle_sync import (BattleFrameError, BattleSync, SpatialGrid, decode_move, decode_state, encode_move,
+                         parse_position)
+
+
+def pos(x, z, y=0.0):
+    return {'x': float(x), 'y': float(y), 'z': float(z)}
+
+
+def make_battle(positions, binary=(), **kwargs):
+    players = {}
+    sent = []
+    sync = BattleSync(players, lambda ws, message: sent.append((ws, message)), **kwargs)
+    for name, position in positions.items():
+        players[name] = {'position': position, 'websocket': name, 'binary': name in binary}
+        sync.join(name)
+    return sync, sent
+
+
+def frames_for(sent, name):
+    return [message for ws, message in sent if ws == name]
+
+
+def test_grid():
+    print('\n🗺️  测试1: 网格空间索引')
+    grid = SpatialGrid(10)
+    grid.update('a', pos(1, 1))
+    grid.update('b', pos(15, 1))
+    grid.update('c', pos(100, 100))
+    assert set(grid.query(pos(0, 0), 10)) == {'a', 'b'}
+    grid.update('c', pos(-5, 2))
+    assert set(grid.query(pos(0, 0), 10)) == {'a', 'b', 'c'}
+    grid.remove('a')
+    assert set(grid.query(pos(0, 0), 10)) == {'b', 'c'} and len(grid) == 2
+
+    assert parse_position({'x': '1.5', 'z': 2}) == pos(1.5, 2)
+    assert parse_position({'x': float('nan')}) is None and parse_position('bad') is None
+    print('✅ 只查询附近的格子，位置校验正常')
+
+
+def test_coalesce_and_interest():
+    print('\n📡 测试2: 合并移动 + 视野过滤')
+    sync, sent = make_battle({'a': pos(0, 0), 'b': pos(5, 0), 'far': pos(200, 200)}, view_radius=40)
+    sync.tick()
+    first = frames_for(sent, 'a')
+    assert len(first) == 1 and set(first[0]['players']) == {'b'}  # 看不到远处的玩家
+    assert frames_for(sent, 'far') == []
+
+    # 一个 tick 内移动 10 次，只下发最后的位置
+    sent.clear()
+    for i in range(10):
+        sync.move('b', pos(5 + i, 0))
+    sync.tick()
+    frames = frames_for(sent, 'a')
+    assert len(frames) == 1 and frames[0]['players'] == {'b': pos(14, 0)}
+    assert frames_for(sent, 'b') == []  # a 没动，b 不用收到任何东西
+
+    # 没有变化时不发送
+    sent.clear()
+    sync.tick()
+    assert sent == []
+
+    # b 走出视野 -> removed；回来 -> 完整位置
+    sync.move('b', pos(100, 0))
+    sync.tick()
+    assert frames_for(sent, 'a')[-1] == {'type': '3d_battle_state', 'tick': sync._tick, 'players': {},
+                                          'removed': ['b']}
+    sent.clear()
+    sync.move('b', pos(10, 0))
+    sync.tick()
+    assert frames_for(sent, 'a')[-1]['players'] == {'b': pos(10, 0)}
+
+    assert set(sync.nearby(pos(0, 0))) == {'a', 'b'}
+    sync.leave('b')
+    assert sync.nearby(pos(0, 0)) == ['a']
+    print('✅ 每个观察者每个 tick 最多一帧，只包含视野内有变化的玩家')
+
+
+def test_tick_rate():
+    print('\n⏱️  测试3: 固定频率 tick')
+
+    async def run():
+        sync, sent = make_battle({'a': pos(0, 0), 'b': pos(1, 0)}, tick_rate=50)
+        sync.start()
+        for i in range(20):
+            sync.move('b', pos(1 + i * 0.01, 0))
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0.05)
+        await sync.close()
+        stats = sync.stats()
+        # 0.15 秒内约 7 个 tick，远少于 20 次移动
+        assert 4 <= stats['ticks'] <= 10, stats['ticks']
+        assert stats['moves'] == 20 and len(frames_for(sent, 'a')) <= stats['ticks']
+        print(f"✅ {stats['moves']} 次移动合并为 {len(frames_for(sent, 'a'))} 帧")
+
+    asyncio.run(run())
+
+
+def test_binary_frames():
+    print('\n📦 测试4: 二进制位置帧')
+    assert decode_move(encode_move(pos(1.234, -5.678))) == pos(1.23, -5.68)
+    assert decode_move(encode_move(pos(1000, 0)))['x'] == 327.67  # 超出范围时截断
+
+    sync, sent = make_battle({'a': pos(0, 0), 'b': pos(5, 0), 'c': pos(6, 1)}, binary={'a'})
+    assert len({sync.ids[name] for name in 'abc'}) == 3
+    sync.tick()
+    frame = frames_for(sent, 'a')[0]
+    assert isinstance(frame, bytes) and len(frame) == 9 + 2 * 8
+    tick, players, removed = decode_state(frame)
+    assert tick == 1 and players == {sync.ids['b']: pos(5, 0), sync.ids['c']: pos(6, 1)} and removed == []
+    assert isinstance(frames_for(sent, 'b')[0], dict)  # 没有选择二进制的客户端仍然收到 JSON
+
+    # 客户端的二进制移动帧
+    sent.clear()
+    sync.handle_frame('c', encode_move(pos(200, 0)))
+    sync.tick()
+    _, players, removed = decode_state(frames_for(sent, 'a')[0])
+    assert players == {} and removed == [sync.ids['c']]
+    try:
+        sync.handle_frame('unknown', encode_move(pos(0, 0)))
+        assert False, '应该失败'
+    except BattleFrameError:
+        pass
+    try:
+        decode_move(b'\x10\x00')
+        assert False, '应该失败'
+    except BattleFrameError:
+        pass
+
+    # 离开后 id 释放，新玩家不会拿到正在使用的 id
+    old_id = sync.ids['c']
+    del sync.players['c']
+    sync.leave('c')
+    assert old_id not in sync._names and 'c' not in sync.ids
+    print(f"✅ 每个玩家位置 8 字节，统计 {sync.stats()['binary_frames_sent']} 个二进制帧")
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试3D战场定时同步')
+    print('=' * 60)
+    test_grid()
+    test_coalesce_and_interest()
+    test_tick_rate()
+    test_binary_frames()
+    print('\n' + '=' * 60)
+    print('3D战场定时同步测试完成!')
+    print('=' * 60)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试内容寻址的媒体文件存储：SHA-256 命名、去重、大小上限、分段读取、HTTP 下载
+"""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import server
+from blob_store import BlobStore, BlobTooLarge, blob_url, normalize_content_type
+
+
+def test_put_and_dedup():
+    print('\n📎 测试1: 保存与去重')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = BlobStore(tmp_dir)
+        data = os.urandom(100000)
+        info = store.put(data, 'image/png')
+        assert info['blob_id'] == hashlib.sha256(data).hexdigest()
+        assert info == {'blob_id': info['blob_id'], 'content_type': 'image/png', 'size': 100000}
+
+        # 流式写入相同内容，得到同一个 blob
+        writer = store.writer('image/png')
+        for i in range(0, len(data), 4096):
+            writer.write(data[i:i + 4096])
+        assert writer.commit() == info
+        assert store.stats['blobs_stored'] == 1 and store.stats['dedup_hits'] == 1
+        assert os.listdir(store.tmp_dir) == []
+
+        assert b''.join(store.read_range(info['blob_id'], 10, 20)) == data[10:20]
+        assert b''.join(store.read_range(info['blob_id'], 0, 100000)) == data
+        assert store.stat('0' * 64) is None
+        assert store.stat('../../etc/passwd') is None
+        print('✅ 相同内容只保存一份')
+
+
+def test_size_limit():
+    print('\n🚫 测试2: 大小上限')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = BlobStore(tmp_dir)
+        writer = store.writer('audio/webm', max_size=10)
+        writer.write(b'12345')
+        try:
+            writer.write(b'678901')
+            assert False, '应该超过上限'
+        except BlobTooLarge:
+            pass
+        assert os.listdir(store.tmp_dir) == []
+        print('✅ 超过上限时放弃写入并删除临时文件')
+
+
+def test_content_types():
+    print('\n🏷️  测试3: 内容类型')
+    assert normalize_content_type('audio/webm;codecs=opus') == 'audio/webm'
+    assert normalize_content_type('IMAGE/JPEG') == 'image/jpeg'
+    assert normalize_content_type('image/svg+xml') is None
+    assert normalize_content_type('text/html') is None
+    assert normalize_content_type(None) is None
+    print('✅ 只接受图片和音频类型')
+
+
+def test_download():
+    print('\n📥 测试4: HTTP 下载（ETag、Range、304）')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            saved_store = server.blob_store
+            server.blob_store = store = BlobStore(tmp_dir)
+            data = os.urandom(200000)
+            info = store.put(data, 'audio/webm')
+            url = blob_url(info['blob_id'])
+            etag = f'"{info["blob_id"]}"'
+            client = TestClient(TestServer(server.create_app()))
+            await client.start_server()
+            try:
+                response = await client.get(url)
+                assert response.status == 200 and await response.read() == data
+                assert response.headers['ETag'] == etag and response.headers['Content-Type'] == 'audio/webm'
+                assert 'immutable' in response.headers['Cache-Control']
+                assert response.headers['X-Content-Type-Options'] == 'nosniff'
+
+                response = await client.get(url, headers={'Range': 'bytes=100-199'})
+                assert response.status == 206 and await response.read() == data[100:200]
+                assert response.headers['Content-Range'] == f'bytes 100-199/{len(data)}'
+                assert response.headers['ETag'] == etag
+
+                response = await client.get(url, headers={'Range': 'bytes=-10'})
+                assert response.status == 206 and await response.read() == data[-10:]
+
+                response = await client.get(url, headers={'Range': f'bytes={len(data)}-'})
+                assert response.status == 416
+
+                response = await client.get(url, headers={'If-None-Match': etag})
+                assert response.status == 304 and response.headers['ETag'] == etag
+
+                response = await client.head(url)
+                assert response.status == 200 and int(response.headers['Content-Length']) == len(data)
+
+                assert (await client.get(blob_url('0' * 64))).status == 404
+            finally:
+                await client.close()
+                server.blob_store = saved_store
+            print('✅ 完整内容、分段、缓存校验和 HEAD 结果正确')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试媒体文件存储')
+    print('=' * 60)
+    test_put_and_dedup()
+    test_size_limit()
+    test_content_types()
+    test_download()
+    print('\n' + '=' * 60)
+    print('媒体文件存储测试完成!')
+    print('=' * 60)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试机器人后台任务：processing 回执、结果以带 job_id 的 new_message 送达、取消、每个连接的任务上限、
+处理中断开连接时任务被取消
+（机器人处理函数替换为可控的假实现，不调用 Claude API）
+"""
+
+import asyncio
+import json
+import tempfile
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import server
+from persistence import PersistenceWriter
+from storage import JsonStorage
+
+handle_bot_message = server.handle_bot_message
+
+
+class FakeQueue:
+    """代替 OutboundQueue，记录放进发送队列的帧"""
+
+    def __init__(self):
+        self.frames = []
+
+    def put(self, message):
+        self.frames.append(json.loads(message) if isinstance(message, str) else message)
+
+    def of_type(self, msg_type, status=None):
+        return [f for f in self.frames if f['type'] == msg_type and (status is None or f.get('status') == status)]
+
+
+class FakeBot:
+    """代替 handle_bot_message：报告一次进度后等待 release，记录开始和被取消的任务"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = []
+        self.cancelled = []
+
+    async def __call__(self, from_user, content, content_type, on_delta=None, on_progress=None):
+        self.started.append(content)
+        try:
+            on_progress(1, 2)
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled.append(content)
+            raise
+        return f'总结: {content}'
+
+
+def setup(tmp_dir):
+    storage = JsonStorage(tmp_dir)
+    storage.load()
+    server.storage = storage
+    server.persistence = PersistenceWriter(storage, flush_interval=60)
+    bot = FakeBot()
+    server.handle_bot_message = bot
+    return storage, bot
+
+
+def connect(username):
+    ws = object()
+    queue = FakeQueue()
+    server.outbound_queues[ws] = queue
+    server.connected_users[username] = ws
+    return ws, queue
+
+
+def cleanup(*usernames):
+    for username in usernames:
+        server.connected_users.pop(username, None)
+        server.user_locations.pop(username, None)
+    server.outbound_queues.clear()
+    server.bot_jobs.clear()
+    server.user_conversations.clear()
+    server.handle_bot_message = handle_bot_message
+
+
+def test_ack_and_result():
+    print('\n🤖 测试1: processing 回执和带 job_id 的结果')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage, bot = setup(tmp_dir)
+            ws, queue = connect('u')
+            chat_key = server.get_chat_key('u', server.BOT_USERNAME)
+            try:
+                server.start_bot_job(ws, chat_key, 'u', '很长的聊天记录', 'text', 123)
+                # 回执立即发出，不等待处理
+                ack = queue.frames[0]
+                assert ack['type'] == 'bot_job_status' and ack['status'] == 'processing' and ack['reply_to'] == 123
+                job_id = ack['job_id']
+                assert job_id in server.bot_jobs[ws]
+
+                await asyncio.sleep(0)
+                assert bot.started == ['很长的聊天记录']
+                assert queue.of_type('bot_job_status', 'progress')[0]['done'] == 1
+
+                bot.release.set()
+                await asyncio.gather(*server.bot_jobs[ws].values())
+                result = queue.of_type('new_message')
+                assert len(result) == 1 and result[0]['job_id'] == job_id
+                assert result[0]['from'] == server.BOT_USERNAME and result[0]['content'] == '总结: 很长的聊天记录'
+                assert result[0]['timestamp'] == ack['timestamp']  # 与状态、流式片段在同一个气泡
+                assert not server.bot_jobs[ws]
+
+                # 回复写入了消息记录
+                page, _, _ = await server.persistence.call(storage.get_history, chat_key, None, 10)
+                assert [m['content'] for m in page] == ['总结: 很长的聊天记录']
+            finally:
+                cleanup('u')
+                await server.persistence.close()
+            print(f'✅ 任务 {job_id}: processing -> progress -> new_message')
+
+    asyncio.run(run())
+
+
+def test_cancel():
+    print('\n🛑 测试2: 取消任务')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage, bot = setup(tmp_dir)
+            ws, queue = connect('u')
+            chat_key = server.get_chat_key('u', server.BOT_USERNAME)
+            try:
+                server.start_bot_job(ws, chat_key, 'u', 'a', 'text', 1)
+                job_id = queue.frames[0]['job_id']
+                await asyncio.sleep(0)
+
+                server.cancel_bot_job(ws, {'job_id': 'no-such-job'})  # 未知任务忽略
+                server.cancel_bot_job(ws, {'job_id': job_id})
+                await asyncio.gather(*server.bot_jobs[ws].values(), return_exceptions=True)
+
+                assert bot.cancelled == ['a']
+                assert queue.of_type('bot_job_status', 'cancelled')[0]['job_id'] == job_id
+                assert not queue.of_type('new_message') and not server.bot_jobs[ws]
+                page, _, _ = await server.persistence.call(storage.get_history, chat_key, None, 10)
+                assert page == []
+            finally:
+                cleanup('u')
+                await server.persistence.close()
+            print('✅ 取消后回复 cancelled，不保存也不发送结果')
+
+    asyncio.run(run())
+
+
+def test_max_jobs():
+    print('\n🚦 测试3: 每个连接的任务上限')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage, bot = setup(tmp_dir)
+            ws, queue = connect('u')
+            other_ws, other_queue = connect('v')
+            chat_key = server.get_chat_key('u', server.BOT_USERNAME)
+            try:
+                for i in range(server.BOT_MAX_JOBS + 1):
+                    server.start_bot_job(ws, chat_key, 'u', str(i), 'text', i)
+                statuses = [f['status'] for f in queue.of_type('bot_job_status')]
+                assert statuses == ['processing'] * server.BOT_MAX_JOBS + ['rejected'], statuses
+                assert len(server.bot_jobs[ws]) == server.BOT_MAX_JOBS
+
+                # 上限按连接计算，其他连接不受影响
+                server.start_bot_job(other_ws, server.get_chat_key('v', server.BOT_USERNAME), 'v', 'x', 'text', 9)
+                assert other_queue.frames[0]['status'] == 'processing'
+
+                # 有任务完成后可以再提交
+                bot.release.set()
+                await asyncio.gather(*server.bot_jobs[ws].values(), *server.bot_jobs[other_ws].values())
+                server.start_bot_job(ws, chat_key, 'u', 'again', 'text', 10)
+                assert queue.of_type('bot_job_status')[-1]['status'] == 'processing'
+                await asyncio.gather(*server.bot_jobs[ws].values())
+                assert len(queue.of_type('new_message')) == server.BOT_MAX_JOBS + 1
+            finally:
+                cleanup('u', 'v')
+                await server.persistence.close()
+            print(f'✅ 第 {server.BOT_MAX_JOBS + 1} 个任务被拒绝，完成后可以继续提交')
+
+    asyncio.run(run())
+
+
+def test_disconnect_cancels():
+    print('\n🔌 测试4: 处理中断开连接')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage, bot = setup(tmp_dir)
+            client = TestClient(TestServer(server.create_app()))
+            await client.start_server()
+            try:
+                ws = await client.ws_connect('/ws')
+                await ws.send_json({'type': 'register', 'username': 'u'})
+                while (await ws.receive_json())['type'] != 'history_sync':
+                    pass
+                await ws.send_json({'type': 'send_message', 'to': server.BOT_USERNAME, 'content': 'a',
+                                    'timestamp': 1})
+                while True:
+                    frame = await ws.receive_json()
+                    if frame['type'] == 'bot_job_status' and frame['status'] == 'processing':
+                        break
+                await ws.close()
+
+                for _ in range(100):
+                    if bot.cancelled:
+                        break
+                    await asyncio.sleep(0.01)
+                assert bot.cancelled == ['a']
+                assert not server.bot_jobs and not server.offline_messages.get('u')
+
+                # 只保存了用户发出的消息，没有机器人回复
+                chat_key = server.get_chat_key('u', server.BOT_USERNAME)
+                page, _, _ = await server.persistence.call(storage.get_history, chat_key, None, 10)
+                assert [m['from'] for m in page] == ['u']
+            finally:
+                await client.close()
+                cleanup('u')
+            print('✅ 断开连接时任务被取消，回复不会保存为离线消息')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试机器人后台任务')
+    print('=' * 60)
+    test_ack_and_result()
+    test_cancel()
+    test_max_jobs()
+    test_disconnect_cancels()
+    print('\n' + '=' * 60)
+    print('机器人后台任务测试完成!')
+    print('=' * 60)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试私聊会话 key：含 '_' 的用户名不冲突、旧 key 迁移、会话索引重建、重启后重放迁移记录
+"""
+
+import json
+import os
+import tempfile
+
+import server
+from storage import JsonStorage, SqliteStorage
+
+GROUPS = {'group_1': {'name': 'g', 'members': ['a', 'b_c', 'x'], 'creator': 'a'}}
+
+
+def legacy_records():
+    """旧格式数据：'a_b'+'c' 和 'a'+'b_c' 都保存在 'a_b_c' 下"""
+    return [
+        {'op': 'append', 'key': 'a_b_c', 'message': {'from': 'a_b', 'to': 'c', 'content': '1', 'timestamp': 1}},
+        {'op': 'append', 'key': 'a_b_c', 'message': {'from': 'a', 'to': 'b_c', 'content': '2', 'timestamp': 2}},
+        {'op': 'append', 'key': 'a_b_c', 'message': {'from': 'c', 'to': 'a_b', 'content': '3', 'timestamp': 3}},
+        # 新格式下已经有消息的会话，迁移时合并
+        {'op': 'append', 'key': server.get_chat_key('x', 'y'), 'message': {'from': 'y', 'to': 'x', 'content': '4',
+                                                                          'timestamp': 4}},
+        {'op': 'append', 'key': 'x_y', 'message': {'from': 'x', 'to': 'y', 'content': '5', 'timestamp': 5}},
+        # 群消息和无法识别参与者的会话保持原样
+        {'op': 'append', 'key': 'group_1', 'message': {'from': 'a', 'group_id': 'group_1', 'content': '6',
+                                                       'timestamp': 6}},
+        {'op': 'append', 'key': 'old_unknown', 'message': {'from': 'a', 'content': '7', 'timestamp': 7}},
+    ]
+
+
+def contents(storage, chat_key):
+    return [m['content'] for m in storage.get_messages(chat_key)]
+
+
+def test_chat_key_format():
+    print('\n🔑 测试1: 会话 key 格式')
+    assert server.get_chat_key('a_b', 'c') == '["a_b","c"]'
+    assert server.get_chat_key('a', 'b_c') == '["a","b_c"]'
+    assert server.get_chat_key('c', 'a_b') == server.get_chat_key('a_b', 'c')
+    # 与 app.js 的 JSON.stringify([a, b].sort(...)) 一致：紧凑分隔符，不转义中文
+    assert server.get_chat_key('李四', '张三') == '["张三","李四"]'
+    assert json.loads(server.get_chat_key('b', 'a')) == ['a', 'b']
+    print('✅ 含 _ 的用户名得到不同的 key')
+
+
+def check_migration(make_storage):
+    storage = make_storage()
+    storage.load()
+    storage.apply_batch(legacy_records())
+
+    server.storage = storage
+    server.groups_store = GROUPS
+    server.migrate_chat_keys()
+
+    key_ab_c = server.get_chat_key('a_b', 'c')
+    key_a_bc = server.get_chat_key('a', 'b_c')
+    key_xy = server.get_chat_key('x', 'y')
+    expected_keys = sorted([key_ab_c, key_a_bc, key_xy, 'group_1', 'old_unknown'])
+    assert sorted(storage.chat_keys()) == expected_keys, storage.chat_keys()
+    assert contents(storage, key_ab_c) == ['1', '3']
+    assert contents(storage, key_a_bc) == ['2']
+    assert contents(storage, key_xy) == ['4', '5']
+    assert contents(storage, 'old_unknown') == ['7']
+
+    # 再次迁移不会改变任何东西
+    server.migrate_chat_keys()
+    assert sorted(storage.chat_keys()) == expected_keys
+
+    # 会话索引按新 key 重建
+    server.rebuild_conversation_index(storage.chat_keys())
+    assert server.user_conversations['a_b']['private'] == {key_ab_c: 'c'}
+    assert server.user_conversations['c']['private'] == {key_ab_c: 'a_b'}
+    assert server.user_conversations['a']['private'] == {key_a_bc: 'b_c'}
+    assert server.user_conversations['b_c']['private'] == {key_a_bc: 'a'}
+    assert server.user_conversations['b_c']['groups'] == {'group_1': None}
+    assert 'old_unknown' not in server.user_conversations['a']['private']
+    assert [chat for _, _, chat in server.get_user_conversations('a')] == ['b_c', 'group_1']
+    storage.close()
+
+    # 重启后重放迁移写入的 replace 记录，结果不变
+    storage = make_storage()
+    storage.load()
+    assert sorted(storage.chat_keys()) == expected_keys
+    assert contents(storage, key_ab_c) == ['1', '3'] and contents(storage, key_xy) == ['4', '5']
+    return storage
+
+
+def test_migration_json():
+    print('\n🚚 测试2: JSON 后端迁移旧 key')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = check_migration(lambda: JsonStorage(tmp_dir))
+        # 迁移结果来自日志重放，而不是快照
+        assert storage.message_log.pending_records > 0
+        with open(storage.messages_log_file, encoding='utf-8') as f:
+            assert any(json.loads(line)['op'] == 'replace' for line in f)
+        storage.close()
+        print('✅ 冲突的会话被拆开，重启后重放 replace 记录结果一致')
+
+
+def test_migration_sqlite():
+    print('\n🗄️  测试3: SQLite 后端迁移旧 key')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'chat.db')
+        storage = check_migration(lambda: SqliteStorage(db_path))
+        storage.close()
+        print('✅ SQLite 后端迁移结果与 JSON 一致')
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试会话 key')
+    print('=' * 60)
+    test_chat_key_format()
+    test_migration_json()
+    test_migration_sqlite()
+    print('\n' + '=' * 60)
+    print('会话 key 测试完成!')
+    print('=' * 60)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试连接登记表：按连接查找身份、断开通知合并发送
+"""
+
+import asyncio
+
+from connection_registry import ConnectionRegistry
+
+
+def test_sessions():
+    print('\n🔌 测试1: 按连接记录身份')
+
+    async def run():
+        registry = ConnectionRegistry()
+        ws = object()
+        session = registry.open(ws)
+        session.username = 'alice'
+        session.battle_username = 'alice_3d'
+        session.video_groups.add('g1')
+        assert registry.get(ws) is session and len(registry) == 1
+
+        assert registry.close(ws) is session
+        assert registry.get(ws) is None and registry.close(ws) is None
+        assert registry.stats()['closed'] == 1 and registry.stats()['connections'] == 0
+        print('✅ 断开时直接取出连接上的所有身份')
+
+    asyncio.run(run())
+
+
+def test_coalesced_departures():
+    print('\n📣 测试2: 同时断开的连接合并通知')
+
+    async def run():
+        batches = []
+        registry = ConnectionRegistry(batches.append, flush_delay=0.02)
+        sockets = [object() for _ in range(50)]
+        for i, ws in enumerate(sockets):
+            registry.open(ws).username = f'user{i}'
+
+        for ws in sockets[:30]:
+            registry.close(ws)
+            await asyncio.sleep(0)
+        assert batches == []  # 等 flush_delay 之后一起发送
+        await asyncio.sleep(0.05)
+        assert len(batches) == 1 and [s.username for s in batches[0]] == [f'user{i}' for i in range(30)]
+
+        # 之后断开的连接是新的一批
+        registry.close(sockets[30])
+        registry.flush()
+        assert len(batches) == 2 and batches[1][0].username == 'user30'
+        assert registry.stats()['max_batch'] == 30
+        print("✅ 30 个连接断开只通知 1 次")
+
+    asyncio.run(run())
+
+
+def test_callback_error():
+    print('\n🚫 测试3: 通知出错不影响之后的断开')
+
+    async def run():
+        calls = []
+
+        def on_departures(sessions):
+            calls.append(len(sessions))
+            if len(calls) == 1:
+                raise RuntimeError('boom')
+
+        registry = ConnectionRegistry(on_departures, flush_delay=0)
+        first, second = object(), object()
+        registry.open(first)
+        registry.open(second)
+        registry.close(first)
+        await asyncio.sleep(0.01)
+        registry.close(second)
+        await asyncio.sleep(0.01)
+        assert calls == [1, 1] and registry.stats()['pending'] == 0
+        print('✅ 出错后继续发送下一批通知')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试连接登记表')
+    print('=' * 60)
+    test_sessions()
+    test_coalesced_departures()
+    test_callback_error()
+    print('\n' + '=' * 60)
+    print('连接登记表测试完成!')
+    print('=' * 60)
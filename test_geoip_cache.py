@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 IP 地理位置缓存：请求合并、/24 网段命中、负缓存、TTL 与 LRU 淘汰
+"""
+
+import asyncio
+
+from geoip_cache import GeoIpCache, cache_keys, is_public_ip
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(results, **kwargs):
+    """results: {ip: 位置或 None}，记录每次上游查询"""
+    calls = []
+
+    async def lookup(ip):
+        calls.append(ip)
+        await asyncio.sleep(0.01)
+        return results.get(ip)
+
+    clock = FakeClock()
+    return GeoIpCache(lookup, clock=clock, **kwargs), calls, clock
+
+
+def test_coalescing_and_subnet():
+    print('\n🌐 测试1: 请求合并与网段缓存')
+
+    async def run():
+        cache, calls, _ = make_cache({'8.8.8.8': '美国'})
+        locations = await asyncio.gather(*[cache.resolve('8.8.8.8') for _ in range(10)])
+        assert locations == ['美国'] * 10
+        assert calls == ['8.8.8.8']
+        assert cache.stats()['coalesced'] == 9
+
+        # 同一 /24 网段直接命中
+        assert await cache.resolve('8.8.8.4') == '美国'
+        assert calls == ['8.8.8.8']
+        assert cache.stats()['subnet_hits'] == 1
+        print('✅ 10 个并发查询只请求 1 次，同网段 IP 直接命中')
+
+    asyncio.run(run())
+
+
+def test_negative_cache_and_ttl():
+    print('\n⏳ 测试2: 负缓存与过期')
+
+    async def run():
+        cache, calls, clock = make_cache({'1.1.1.1': '澳大利亚'}, ttl=100, negative_ttl=10)
+        assert await cache.resolve('9.9.9.9') is None
+        assert await cache.resolve('9.9.9.9') is None
+        assert calls == ['9.9.9.9']
+
+        clock.now = 11  # 负缓存过期后重新查询
+        await cache.resolve('9.9.9.9')
+        assert calls == ['9.9.9.9', '9.9.9.9']
+
+        await cache.resolve('1.1.1.1')
+        clock.now = 50
+        await cache.resolve('1.1.1.1')
+        clock.now = 200
+        await cache.resolve('1.1.1.1')
+        assert calls.count('1.1.1.1') == 2
+        print('✅ 失败结果短时间缓存，成功结果按 TTL 过期')
+
+    asyncio.run(run())
+
+
+def test_lru_eviction():
+    print('\n🧹 测试3: LRU 淘汰')
+
+    async def run():
+        cache, calls, _ = make_cache({}, max_size=4)
+        for i in range(10):
+            await cache.resolve(f'2001:db8::{i}')
+        assert cache.stats()['size'] == 4
+        found, _ = cache.get_cached('2001:db8::0')
+        assert not found
+        found, _ = cache.get_cached('2001:db8::9')
+        assert found
+        print('✅ 缓存条目不超过上限')
+
+    asyncio.run(run())
+
+
+def test_helpers():
+    print('\n🔎 测试4: 辅助函数')
+    assert cache_keys('1.2.3.4') == ('1.2.3.4', '1.2.3.0/24')
+    assert cache_keys('2001:db8::1') == ('2001:db8::1', None)
+    assert not is_public_ip('127.0.0.1')
+    assert not is_public_ip('192.168.1.1')
+    assert not is_public_ip('not-an-ip')
+    assert is_public_ip('8.8.8.8')
+    print('✅ 内网地址不查询上游')
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试地理位置缓存')
+    print('=' * 60)
+    test_coalescing_and_subnet()
+    test_negative_cache_and_ttl()
+    test_lru_eviction()
+    test_helpers()
+    print('\n' + '=' * 60)
+    print('地理位置缓存测试完成!')
+    print('=' * 60)
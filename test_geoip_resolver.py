@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试本地 GeoIP 数据库：生成、二分查找、边界、与 HTTP 后备组合、文件损坏时停用
+"""
+
+import asyncio
+import os
+import tempfile
+
+from geoip_resolver import (HEADER, ChainedGeoIpResolver, GeoIpResolver, LocalGeoIpDatabase, build_database,
+                            format_location)
+
+ROWS = [
+    ('8.8.8.0', '8.8.8.255', '美国·加利福尼亚'),
+    ('1.0.0.0', '1.0.0.255', '澳大利亚'),
+    ('114.114.114.0', '114.114.114.255', '中国·江苏·南京'),
+    ('2001:db8::', '2001:db8::ff', '不收录 IPv6'),
+]
+
+
+class FakeHttpResolver(GeoIpResolver):
+    def __init__(self):
+        self.calls = []
+
+    async def lookup(self, ip):
+        self.calls.append(ip)
+        return '远程结果'
+
+
+def test_local_lookup():
+    print('\n🗺️  测试1: 本地数据库查询')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'geoip.db')
+        assert build_database(ROWS, db_path) == 3
+
+        db = LocalGeoIpDatabase(db_path)
+        assert db.stats()['loaded'] is False  # 首次查询时才加载
+        assert db.lookup_local('8.8.8.8') == '美国·加利福尼亚'
+        assert db.lookup_local('1.0.0.0') == '澳大利亚'
+        assert db.lookup_local('1.0.0.255') == '澳大利亚'
+        assert db.lookup_local('1.0.1.0') is None
+        assert db.lookup_local('0.0.0.1') is None
+        assert db.lookup_local('255.255.255.255') is None
+        assert db.lookup_local('::ffff:114.114.114.114') == '中国·江苏·南京'
+        assert db.lookup_local('2001:db8::1') is None
+        assert db.lookup_local('not-an-ip') is None
+        assert len(db) == 3
+        db.close()
+        print('✅ 段内、边界和段外地址结果正确')
+
+
+def test_chained_fallback():
+    print('\n🔗 测试2: 本地优先，HTTP 后备')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'geoip.db')
+            build_database(ROWS, db_path)
+            db = LocalGeoIpDatabase(db_path)
+            http = FakeHttpResolver()
+            resolver = ChainedGeoIpResolver([db, http])
+
+            assert await resolver.lookup('8.8.8.8') == '美国·加利福尼亚'
+            assert await resolver.lookup('9.9.9.9') == '远程结果'
+            assert http.calls == ['9.9.9.9']
+            assert resolver.lookup_local('9.9.9.9') is None
+            db.close()
+            print('✅ 本地数据库查不到时才请求 HTTP')
+
+    asyncio.run(run())
+
+
+def test_bad_database():
+    print('\n💥 测试3: 数据库文件损坏时停用本地查询')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            good_path = os.path.join(tmp_dir, 'good.db')
+            build_database(ROWS, good_path)
+            with open(good_path, 'rb') as f:
+                good = f.read()
+            wrong_count = bytearray(good)
+            magic, little_endian, range_count, location_count = HEADER.unpack_from(good)
+            HEADER.pack_into(wrong_count, 0, magic, little_endian, range_count, location_count + 1)
+            bad_files = {
+                'empty.db': b'',
+                'not_geoip.db': b'not a geoip database at all',
+                'short_header.db': good[:10],
+                'truncated.db': good[:40],
+                'bad_locations.db': good[:-5],
+                'wrong_count.db': bytes(wrong_count),
+            }
+            for name, content in bad_files.items():
+                db_path = os.path.join(tmp_dir, name)
+                with open(db_path, 'wb') as f:
+                    f.write(content)
+                db = LocalGeoIpDatabase(db_path)
+                http = FakeHttpResolver()
+                resolver = ChainedGeoIpResolver([db, http])
+
+                # 不抛出异常：本地返回 None，异步查询交给 HTTP 后备
+                assert resolver.lookup_local('8.8.8.8') is None, name
+                assert await resolver.lookup('8.8.8.8') == '远程结果', name
+                assert db.stats()['loaded'] is False and db.stats()['error'], name
+                assert len(db) == 0 and db._mmap is None
+
+                # 只尝试加载一次
+                os.unlink(db_path)
+                assert db.lookup_local('8.8.8.8') is None and db.error == db.stats()['error']
+                db.close()
+            print(f'✅ {len(bad_files)} 种损坏的文件都回退到 HTTP，不影响登录')
+
+    asyncio.run(run())
+
+
+def test_format_location():
+    print('\n🏷️  测试4: 位置格式')
+    assert format_location('中国', '北京', '北京') == '中国·北京'
+    assert format_location('美国', '', '') == '美国'
+    assert format_location('', '', '') == '未知位置'
+    print('✅ 跳过空值和重复地名')
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试本地 GeoIP 数据库')
+    print('=' * 60)
+    test_local_lookup()
+    test_chained_fallback()
+    test_bad_database()
+    test_format_location()
+    print('\n' + '=' * 60)
+    print('本地 GeoIP 数据库测试完成!')
+    print('=' * 60)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试登录时的历史消息分块发送：每帧的条数和字节数上限、超大的单条消息、离线消息排在历史消息之后
+"""
+
+import asyncio
+import json
+import tempfile
+
+import server
+from persistence import PersistenceWriter
+from storage import JsonStorage
+
+EMPTY_FRAME_SIZE = len('{"type":"history_batch","messages":[]}')
+
+
+class FakeQueue:
+    """代替 OutboundQueue，记录放进发送队列的帧"""
+
+    def __init__(self):
+        self.frames = []
+
+    def put(self, message):
+        self.frames.append(message)
+
+
+def capture():
+    ws = object()
+    queue = FakeQueue()
+    server.outbound_queues[ws] = queue
+    return ws, queue
+
+
+def decode(frame):
+    return json.loads(frame) if isinstance(frame, str) else frame
+
+
+def batch_items(queue):
+    """所有 history_batch 帧中的消息（按发送顺序）"""
+    items = []
+    for frame in queue.frames:
+        data = decode(frame)
+        if data['type'] == 'history_batch':
+            items.extend(data['messages'])
+    return items
+
+
+def test_count_bound():
+    print('\n📦 测试1: 每帧消息条数上限')
+    ws, queue = capture()
+    items = [{'type': 'history_message', 'from': 'a', 'content': str(i), 'timestamp': i} for i in range(1200)]
+    batches = server.send_history_batches(ws, items)
+    sizes = [len(decode(frame)['messages']) for frame in queue.frames]
+    assert batches == 3 and sizes == [server.HISTORY_BATCH_MAX_MESSAGES] * 2 + [200], sizes
+    assert batch_items(queue) == items
+    assert server.send_history_batches(ws, []) == 0 and len(queue.frames) == 3
+    del server.outbound_queues[ws]
+    print(f'✅ 1200 条消息分成 {batches} 帧: {sizes}')
+
+
+def test_byte_bound():
+    print('\n📏 测试2: 每帧字节数上限')
+    ws, queue = capture()
+    # 中文不转义为 \uXXXX，按 UTF-8 字节数（每个汉字 3 字节）计算上限
+    items = [{'type': 'history_message', 'content': '消息' * 1500, 'timestamp': i} for i in range(100)]
+    server.send_history_batches(ws, items)
+    assert len(queue.frames) > 1
+    item_size = len(server.encode_json(items[0]).encode('utf-8'))
+    assert item_size < 3000 * 4  # 转义后每个汉字要 6 字节
+    for frame in queue.frames[:-1]:
+        assert isinstance(frame, str) and '消息' in frame and '\\u' not in frame
+        assert len(frame.encode()) <= server.HISTORY_BATCH_MAX_BYTES + EMPTY_FRAME_SIZE
+        assert len(decode(frame)['messages']) == server.HISTORY_BATCH_MAX_BYTES // (item_size + 1)
+    assert batch_items(queue) == items
+    del server.outbound_queues[ws]
+    print(f'✅ {len(items)} 条大消息分成 {len(queue.frames)} 帧，每帧不超过上限')
+
+
+def test_oversized_item():
+    print('\n🐘 测试3: 超过上限的单条消息')
+    ws, queue = capture()
+    big = {'type': 'history_message', 'content': 'x' * (server.HISTORY_BATCH_MAX_BYTES * 2), 'timestamp': 2}
+    items = [{'type': 'history_message', 'content': 'a', 'timestamp': 1}, big,
+             {'type': 'history_message', 'content': 'b', 'timestamp': 3}]
+    assert server.send_history_batches(ws, items) == 3
+    # 超大的消息单独成帧，不会被丢弃，前后的消息也不会和它合并
+    assert [len(decode(frame)['messages']) for frame in queue.frames] == [1, 1, 1]
+    assert batch_items(queue) == items
+    del server.outbound_queues[ws]
+    print('✅ 超大的消息单独发送一帧，顺序不变')
+
+
+def test_offline_after_history():
+    print('\n📬 测试4: 登录时离线消息排在历史消息之后')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = JsonStorage(tmp_dir)
+            storage.load()
+            server.storage = storage
+            server.persistence = PersistenceWriter(storage, flush_interval=60)
+            server.persistence.start()
+            saved_max = server.HISTORY_BATCH_MAX_MESSAGES
+            server.HISTORY_BATCH_MAX_MESSAGES = 3  # 让历史和离线消息跨越多个帧
+            try:
+                chat_key = server.get_chat_key('u', 'p')
+                server.index_private_chat(chat_key, 'u', 'p')
+                for i in range(5):
+                    server.log_new_message(chat_key, {'from': 'p', 'to': 'u', 'content': f'h{i}', 'timestamp': i})
+                server.offline_messages['u'] = [
+                    {'from': 'q', 'to': 'u', 'content': f'o{i}', 'timestamp': 10 + i} for i in range(4)
+                ]
+
+                ws, queue = capture()
+                await server.handle_register(ws, {'type': 'register', 'username': 'u'})
+
+                types = [decode(frame)['type'] for frame in queue.frames]
+                assert types[0] == 'register_success' and types[-1] == 'history_sync', types
+                assert set(types[1:-1]) == {'history_batch'} and len(types[1:-1]) == 3, types
+                items = batch_items(queue)
+                assert [(item['type'], item['content']) for item in items] == \
+                    [('history_message', f'h{i}') for i in range(5)] + [('new_message', f'o{i}') for i in range(4)]
+                assert server.offline_messages['u'] == []
+                sync = decode(queue.frames[-1])
+                assert sync['conversations'][0]['chat'] == 'p' and not sync['conversations'][0]['has_more']
+            finally:
+                server.HISTORY_BATCH_MAX_MESSAGES = saved_max
+                server.connected_users.pop('u', None)
+                server.user_locations.pop('u', None)
+                server.outbound_queues.clear()
+                server.user_conversations.clear()
+                await server.persistence.close()
+            print(f'✅ {len(items)} 条消息分 3 帧发送，离线消息在历史消息之后')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试历史消息分块发送')
+    print('=' * 60)
+    test_count_bound()
+    test_byte_bound()
+    test_oversized_item()
+    test_offline_after_history()
+    print('\n' + '=' * 60)
+    print('历史消息分块发送测试完成!')
+    print('=' * 60)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试共享出站连接池：多次请求复用同一个连接
+"""
+
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from http_clients import HttpClients
+
+
+def test_connection_reuse():
+    print('\n🔌 测试1: keep-alive 连接复用')
+
+    async def run():
+        peers = []
+
+        async def handler(request):
+            peers.append(request.transport.get_extra_info('peername'))
+            return web.json_response({'ok': True})
+
+        app = web.Application()
+        app.router.add_get('/', handler)
+        async with TestServer(app) as server:
+            clients = HttpClients(timeouts={'geoip': {'total': 1}})
+            await clients.start()
+            for _ in range(5):
+                session = await clients.session()
+                async with session.get(server.make_url('/'), timeout=clients.timeout('geoip')) as response:
+                    assert (await response.json()) == {'ok': True}
+            assert clients.timeout('geoip').total == 1
+            assert clients.stats()['open']
+            await clients.close()
+            assert not clients.stats()['open']
+
+        assert len(set(peers)) == 1, peers
+        print('✅ 5 次请求共用 1 个连接')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试出站连接池')
+    print('=' * 60)
+    test_connection_reuse()
+    print('\n' + '=' * 60)
+    print('出站连接池测试完成!')
+    print('=' * 60)
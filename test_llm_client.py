@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试统一的 Claude API 客户端：并发上限、按用户轮转排队、429/529 退避重试、用量统计、SSE 流式响应
+（使用本地模拟的 Messages API，不访问外网）
+"""
+
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from http_clients import HttpClients
+from llm_client import LLMClient, LLMError
+from mock_llm_server import create_mock_llm_app
+
+
+async def start_mock_api(handler):
+    app = web.Application()
+    app.router.add_post('/v1/messages', handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def make_client(server, timeouts=None, **kwargs):
+    clients = HttpClients(timeouts=timeouts)
+    kwargs.setdefault('backoff_base', 0.01)
+    return clients, LLMClient(clients, 'test-key', api_url=str(server.make_url('/v1/messages')), **kwargs)
+
+
+def reply(text):
+    return web.json_response({
+        'content': [{'type': 'text', 'text': text}],
+        'usage': {'input_tokens': 10, 'output_tokens': 5}
+    })
+
+
+def test_retry_on_overload():
+    print('\n🔁 测试1: 429/529 退避重试')
+
+    async def run():
+        statuses = [429, 529]
+
+        async def handler(request):
+            if statuses:
+                return web.Response(status=statuses.pop(0), headers={'retry-after': '0'})
+            body = await request.json()
+            return reply('ok:' + body['messages'][0]['content'])
+
+        server = await start_mock_api(handler)
+        clients, llm = make_client(server)
+        assert await llm.complete('hi', system='s') == 'ok:hi'
+        stats = llm.stats()
+        assert stats['retries'] == 2 and stats['succeeded'] == 1
+        assert stats['input_tokens'] == 10 and stats['output_tokens'] == 5
+
+        # 不可重试的错误直接失败
+        async def bad_request(request):
+            return web.Response(status=400, text='bad')
+        server2 = await start_mock_api(bad_request)
+        clients2, llm2 = make_client(server2)
+        try:
+            await llm2.complete('hi')
+            assert False, '应该失败'
+        except LLMError as e:
+            assert e.status == 400
+        assert llm2.stats()['retries'] == 0
+
+        for c in (clients, clients2):
+            await c.close()
+        await server.close()
+        await server2.close()
+        print('✅ 临时错误重试后成功，400 不重试')
+
+    asyncio.run(run())
+
+
+def test_concurrency_and_fairness():
+    print('\n⚖️  测试2: 并发上限与公平排队')
+
+    async def run():
+        active = 0
+        max_active = 0
+        order = []
+
+        async def handler(request):
+            nonlocal active, max_active
+            active += 1
+            max_active = max(max_active, active)
+            body = await request.json()
+            order.append(body['messages'][0]['content'])
+            await asyncio.sleep(0.02)
+            active -= 1
+            return reply('ok')
+
+        server = await start_mock_api(handler)
+        clients, llm = make_client(server, max_concurrency=1)
+
+        # alice 一次提交 5 个请求，bob 随后提交 1 个：bob 不需要等 alice 全部完成
+        tasks = [asyncio.create_task(llm.complete(f'alice{i}', user='alice')) for i in range(5)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(llm.complete('bob0', user='bob')))
+        await asyncio.gather(*tasks)
+
+        assert max_active == 1
+        assert order.index('bob0') <= 2, order
+        await clients.close()
+        await server.close()
+        print(f'✅ 同时最多 1 个请求，处理顺序: {order}')
+
+    asyncio.run(run())
+
+
+def test_queue_limit():
+    print('\n🚧 测试3: 排队上限')
+
+    async def run():
+        async def handler(request):
+            await asyncio.sleep(0.05)
+            return reply('ok')
+
+        server = await start_mock_api(handler)
+        clients, llm = make_client(server, max_concurrency=1, max_queue=2)
+        results = await asyncio.gather(*[llm.complete(str(i)) for i in range(5)], return_exceptions=True)
+        rejected = [r for r in results if isinstance(r, LLMError)]
+        assert len(rejected) == 2 and all(e.status == 503 for e in rejected)
+        assert llm.stats()['in_flight'] == 0
+        await clients.close()
+        await server.close()
+        print('✅ 超过排队上限的请求立即返回繁忙')
+
+    asyncio.run(run())
+
+
+def test_stream():
+    print('\n🌊 测试4: SSE 流式响应')
+
+    async def run():
+        server = TestServer(create_mock_llm_app(reply_prefix='总结：', chunk_size=3, delay=0))
+        await server.start_server()
+        clients, llm = make_client(server)
+
+        parts = [part async for part in llm.stream('聊天记录内容', system='s', user='alice')]
+        assert len(parts) > 1
+        assert ''.join(parts) == '总结：聊天记录内容'
+        stats = llm.stats()
+        assert stats['succeeded'] == 1 and stats['in_flight'] == 0
+        assert stats['input_tokens'] == 6 and stats['output_tokens'] == 9
+        assert stats['ttft_p50'] is not None
+
+        # 中途关闭也会释放名额
+        stream = llm.stream('abcdefghij')
+        async for part in stream:
+            break
+        await stream.aclose()
+        assert llm.stats()['in_flight'] == 0
+
+        await clients.close()
+        await server.close()
+        print(f'✅ 收到 {len(parts)} 个片段，拼接结果正确')
+
+    asyncio.run(run())
+
+
+def test_stream_error():
+    print('\n💥 测试5: 流式响应中途出错')
+
+    async def run():
+        server = TestServer(create_mock_llm_app(chunk_size=2, delay=0, fail_after=2))
+        await server.start_server()
+        clients, llm = make_client(server)
+
+        parts = []
+        try:
+            async for part in llm.stream('abcdefgh'):
+                parts.append(part)
+            assert False, '应该失败'
+        except LLMError as e:
+            assert e.status == 529
+        assert len(parts) == 2
+        stats = llm.stats()
+        assert stats['failed'] == 1 and stats['in_flight'] == 0
+
+        await clients.close()
+        await server.close()
+        print('✅ error 事件转换为 LLMError，已收到的片段保留')
+
+    asyncio.run(run())
+
+
+def test_body_read_errors():
+    print('\n⌛ 测试6: 读取响应体时超时或断开')
+
+    async def run():
+        async def slow_body(request):
+            # 先返回 200 和响应头，响应体迟迟不发完
+            response = web.StreamResponse(headers={'Content-Type': 'application/json'})
+            await response.prepare(request)
+            await response.write(b'{"content": [')
+            await asyncio.sleep(5)
+            return response
+
+        server = await start_mock_api(slow_body)
+        clients, llm = make_client(server, timeouts={'llm': {'total': 0.3, 'connect': 1}})
+        try:
+            await llm.complete('hi')
+            assert False, '应该超时'
+        except LLMError as e:
+            assert e.status == 504
+        stats = llm.stats()
+        assert stats['failed'] == 1 and stats['in_flight'] == 0
+
+        # 读取中途连接断开按临时错误重试
+        attempts = []
+
+        async def broken_body(request):
+            attempts.append(1)
+            if len(attempts) == 1:
+                response = web.StreamResponse(headers={'Content-Type': 'application/json', 'Content-Length': '100'})
+                await response.prepare(request)
+                await response.write(b'{"content": [')
+                request.transport.close()
+                return response
+            return reply('ok')
+
+        server2 = await start_mock_api(broken_body)
+        clients2, llm2 = make_client(server2)
+        assert await llm2.complete('hi') == 'ok'
+        assert llm2.stats()['retries'] == 1 and len(attempts) == 2
+
+        for c in (clients, clients2):
+            await c.close()
+        await server.close()
+        await server2.close()
+        print('✅ 响应体读取超时转换为 LLMError(504)，连接断开时重试')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试 Claude API 客户端')
+    print('=' * 60)
+    test_retry_on_overload()
+    test_concurrency_and_fairness()
+    test_queue_limit()
+    test_stream()
+    test_stream_error()
+    test_body_read_errors()
+    print('\n' + '=' * 60)
+    print('Claude API 客户端测试完成!')
+    print('=' * 60)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试二进制媒体帧：编解码、分块上传重组、下载分块
+"""
+
+import asyncio
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from blob_store import BlobStore
+from media_transfer import (OP_DOWNLOAD, OP_UPLOAD, MediaFrameError, MediaUploads,
+                            decode_frame, encode_frame, iter_download_frames)
+
+
+def upload_frames(data, transfer_id, content_type, chunk_size):
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)] or [b'']
+    for index, chunk in enumerate(chunks):
+        yield encode_frame(OP_UPLOAD, transfer_id, index, chunk,
+                           content_type if index == 0 else '', last=index == len(chunks) - 1)
+
+
+def test_frame_round_trip():
+    print('\n🧱 测试1: 帧编解码')
+    frame = decode_frame(encode_frame(OP_UPLOAD, 42, 3, b'abc', 'image/png', last=True))
+    assert (frame.op, frame.last, frame.transfer_id, frame.chunk_index, frame.content_type) == \
+        (OP_UPLOAD, True, 42, 3, 'image/png')
+    assert bytes(frame.payload) == b'abc'
+    try:
+        decode_frame(b'\x01\x00')
+        assert False, '应该拒绝过短的帧'
+    except MediaFrameError:
+        pass
+    print('✅ 头部 12 字节 + 内容类型 + 数据')
+
+
+def test_upload_and_download():
+    print('\n📦 测试2: 分块上传与下载')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = BlobStore(tmp_dir)
+            executor = ThreadPoolExecutor(max_workers=1)
+            uploads = MediaUploads(store, executor)
+            data = os.urandom(300000)
+
+            results = [await uploads.feed(decode_frame(f)) for f in upload_frames(data, 1, 'audio/webm', 65536)]
+            assert results[:-1] == [None] * 4
+            info = results[-1]
+            assert info['size'] == len(data) and info['content_type'] == 'audio/webm'
+            assert not uploads.transfers
+
+            frames = [decode_frame(f) async for f in iter_download_frames(store, info, 9, executor, chunk_size=65536)]
+            assert [f.chunk_index for f in frames] == [0, 1, 2, 3, 4]
+            assert all(f.op == OP_DOWNLOAD and f.transfer_id == 9 for f in frames)
+            assert frames[0].content_type == 'audio/webm' and frames[-1].last
+            assert b''.join(bytes(f.payload) for f in frames) == data
+
+            # 中途停止下载时关闭文件
+            frames = iter_download_frames(store, info, 10, executor, chunk_size=65536)
+            await frames.__anext__()
+            await frames.aclose()
+            executor.shutdown(wait=True)
+            print('✅ 5 个分块重组为同一个 blob，下载结果一致')
+
+    asyncio.run(run())
+
+
+def test_upload_errors():
+    print('\n🚫 测试3: 上传错误')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = BlobStore(tmp_dir)
+            executor = ThreadPoolExecutor(max_workers=1)
+            uploads = MediaUploads(store, executor, max_size=100)
+            frames = [decode_frame(f) for f in upload_frames(os.urandom(200), 1, 'image/png', 60)]
+
+            # 跳过一块
+            await uploads.feed(frames[0])
+            try:
+                await uploads.feed(frames[2])
+                assert False, '应该检测到分块顺序错误'
+            except MediaFrameError as e:
+                assert e.transfer_id == 1
+            assert not uploads.transfers
+
+            # 超过大小上限
+            try:
+                for frame in frames:
+                    await uploads.feed(frame)
+                assert False, '应该超过大小上限'
+            except MediaFrameError:
+                pass
+
+            # 不允许的类型
+            try:
+                await uploads.feed(decode_frame(encode_frame(OP_UPLOAD, 2, 0, b'<svg/>', 'image/svg+xml', last=True)))
+                assert False, '应该拒绝 svg'
+            except MediaFrameError:
+                pass
+
+            await uploads.feed(frames[0])
+            uploads.close()
+            executor.shutdown(wait=True)  # 放弃上传不等待，关闭线程池后临时文件已删除
+            assert os.listdir(store.tmp_dir) == []
+            print('✅ 出错或断开时放弃上传并删除临时文件')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试二进制媒体帧')
+    print('=' * 60)
+    test_frame_round_trip()
+    test_upload_and_download()
+    test_upload_errors()
+    print('\n' + '=' * 60)
+    print('二进制媒体帧测试完成!')
+    print('=' * 60)
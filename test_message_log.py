@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试消息追加日志：追加、重放、压缩、损坏尾部恢复
+"""
+
+import json
+import os
+import tempfile
+
+from message_log import MessageLog
+from storage import ChatHistory, _apply_message_record
+
+
+def make_log(tmp_dir, threshold=100):
+    return MessageLog(
+        os.path.join(tmp_dir, 'messages.json'),
+        os.path.join(tmp_dir, 'messages.log'),
+        threshold
+    )
+
+
+def load(log):
+    """按 JsonStorage 的规则重放，返回 {chat_key: [messages]}"""
+    chats = log.load(_apply_message_record,
+                     store_factory=lambda chats: {chat_key: ChatHistory(msgs) for chat_key, msgs in chats.items()})
+    return {chat_key: chat.messages() for chat_key, chat in chats.items()}
+
+
+def test_append_and_replay():
+    """追加的记录重启后可以完整重放"""
+    print('\n📝 测试1: 追加并重放')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log = make_log(tmp_dir)
+        load(log)
+        log.append({'op': 'append', 'key': 'a_b', 'message': {'from': 'a', 'to': 'b', 'timestamp': 1, 'read': False}})
+        log.append({'op': 'append', 'key': 'a_b', 'message': {'from': 'a', 'to': 'b', 'timestamp': 2, 'read': False}})
+        log.append({'op': 'mark_read', 'key': 'a_b', 'from': 'a', 'to': 'b'})
+        log.append({'op': 'recall', 'key': 'a_b', 'timestamp': 2, 'from': 'a',
+                    'notice': {'from': 'a', 'timestamp': 2, 'content_type': 'recall_notice'}})
+        log.close()
+
+        store = load(make_log(tmp_dir))
+        msgs = store['a_b']
+        assert len(msgs) == 2, msgs
+        assert msgs[0]['read'] is True
+        assert msgs[1]['content_type'] == 'recall_notice'
+        print('✅ 重放结果正确')
+
+
+def test_compaction():
+    """压缩后日志清空，快照包含全部消息"""
+    print('\n🗜️  测试2: 日志压缩')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log = make_log(tmp_dir, threshold=3)
+        store = load(log)
+        for i in range(3):
+            message = {'from': 'a', 'group_id': 'group_1', 'timestamp': i}
+            store.setdefault('group_1', []).append(message)
+            log.append({'op': 'append', 'key': 'group_1', 'message': message})
+        assert log.needs_compaction()
+        log.compact(store)
+        assert os.path.getsize(log.log_path) == 0
+
+        # 压缩后继续追加
+        log.append({'op': 'append', 'key': 'group_1', 'message': {'from': 'b', 'timestamp': 3}})
+        log.close()
+
+        reloaded = load(make_log(tmp_dir))
+        assert [m['timestamp'] for m in reloaded['group_1']] == [0, 1, 2, 3]
+        print('✅ 压缩后重放正确')
+
+
+def test_crash_during_compaction():
+    """快照已写入但日志未截断时不会重复应用记录"""
+    print('\n💥 测试3: 压缩中途崩溃')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log = make_log(tmp_dir)
+        store = load(log)
+        message = {'from': 'a', 'to': 'b', 'timestamp': 1}
+        store['a_b'] = [message]
+        log.append({'op': 'append', 'key': 'a_b', 'message': message})
+        log.close()
+        with open(log.snapshot_path, 'w', encoding='utf-8') as f:
+            json.dump({'log_seq': log.seq, 'chats': store}, f)
+
+        reloaded = load(make_log(tmp_dir))
+        assert len(reloaded['a_b']) == 1
+        print('✅ 没有重复消息')
+
+
+def test_torn_tail_and_legacy_snapshot():
+    """兼容旧版 messages.json，并丢弃写了一半的日志行"""
+    print('\n🩹 测试4: 旧版快照 + 损坏尾部')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log = make_log(tmp_dir)
+        with open(log.snapshot_path, 'w', encoding='utf-8') as f:
+            json.dump({'a_b': [{'from': 'a', 'to': 'b', 'timestamp': 1}]}, f)
+        with open(log.log_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'seq': 1, 'op': 'append', 'key': 'a_b',
+                                'message': {'from': 'b', 'to': 'a', 'timestamp': 2}}) + '\n')
+            f.write('{"seq": 2, "op": "app')
+
+        store = load(log)
+        assert len(store['a_b']) == 2
+        log.append({'op': 'append', 'key': 'a_b', 'message': {'from': 'a', 'to': 'b', 'timestamp': 3}})
+        log.close()
+
+        reloaded = load(make_log(tmp_dir))
+        assert [m['timestamp'] for m in reloaded['a_b']] == [1, 2, 3]
+        print('✅ 损坏尾部已截断，后续追加正常')
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试消息追加日志')
+    print('=' * 60)
+    test_append_and_replay()
+    test_compaction()
+    test_crash_during_compaction()
+    test_torn_tail_and_legacy_snapshot()
+    print('\n' + '=' * 60)
+    print('消息追加日志测试完成!')
+    print('=' * 60)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试每连接发送队列：慢客户端不阻塞其他接收者，队列满时按策略处理
+"""
+
+import asyncio
+import json
+
+from outbound import OutboundQueue, encode_json, outbound_stats
+
+
+class FakeWebSocket:
+    """模拟 WebSocket：slow=True 时 send_str 永远卡住"""
+
+    def __init__(self, slow=False):
+        self.slow = slow
+        self.sent = []
+        self.closed_code = None
+
+    async def send_str(self, data):
+        if self.slow:
+            await asyncio.Event().wait()
+        self.sent.append(data)
+
+    async def close(self, code=None, message=b''):
+        self.closed_code = code
+
+
+def test_slow_consumer_does_not_block():
+    """扇出只入队，快客户端不受慢客户端影响"""
+    print('\n🐢 测试1: 慢客户端隔离')
+
+    async def run():
+        fast = FakeWebSocket()
+        slow = FakeWebSocket(slow=True)
+        fast_queue = OutboundQueue(fast, max_size=100)
+        slow_queue = OutboundQueue(slow, max_size=100)
+
+        for i in range(10):
+            for queue in (slow_queue, fast_queue):
+                queue.put({'type': 'new_message', 'i': i})
+
+        await asyncio.sleep(0.05)
+        assert len(fast.sent) == 10
+        assert slow_queue.depth() == 9  # 第一帧卡在发送中
+        await fast_queue.close()
+        await slow_queue.close()
+        print('✅ 快客户端收到全部 10 帧，慢客户端只堆积自己的队列')
+
+    asyncio.run(run())
+
+
+def test_overflow_policies():
+    """队列满：drop 丢弃新帧，disconnect 断开连接"""
+    print('\n🚦 测试2: 队列满策略')
+
+    async def run():
+        dropped_before = outbound_stats['frames_dropped']
+
+        ws = FakeWebSocket(slow=True)
+        queue = OutboundQueue(ws, max_size=2, policy='drop')
+        results = [queue.put('{}') for _ in range(5)]
+        await asyncio.sleep(0.01)
+        assert queue.dropped >= 2 and not queue.closed
+        print(f'✅ drop 策略: 入队结果 {results}')
+        await queue.close()
+
+        ws = FakeWebSocket(slow=True)
+        queue = OutboundQueue(ws, max_size=2, policy='disconnect')
+        for _ in range(5):
+            queue.put('{}')
+        await asyncio.sleep(0.01)
+        assert queue.closed and ws.closed_code is not None
+        print(f'✅ disconnect 策略: 连接以 {int(ws.closed_code)} 关闭')
+        await queue.close()
+
+        assert outbound_stats['frames_dropped'] > dropped_before
+
+    asyncio.run(run())
+
+
+def test_encode_once_fan_out():
+    """扇出时同一个已编码的 str 放进所有队列，写任务不再重复编码"""
+    print('\n📨 测试3: 一次编码扇出')
+
+    async def run():
+        sockets = [FakeWebSocket() for _ in range(3)]
+        queues = [OutboundQueue(ws) for ws in sockets]
+        frame = encode_json({'type': 'new_message', 'content': '你好'})
+        assert json.loads(frame)['content'] == '你好'
+        for queue in queues:
+            queue.put(frame)
+
+        await asyncio.sleep(0.01)
+        assert all(ws.sent[0] is frame for ws in sockets)
+        for queue in queues:
+            await queue.close()
+        print('✅ 3 个接收者收到同一个编码结果')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试发送队列')
+    print('=' * 60)
+    test_slow_consumer_does_not_block()
+    test_overflow_policies()
+    test_encode_once_fan_out()
+    print('\n' + '=' * 60)
+    print('发送队列测试完成!')
+    print('=' * 60)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 PDF 按页提取缓存：重复上传不再解析、修改过的文档只解析变化的页、内存 LRU、磁盘持久化
+"""
+
+import asyncio
+import tempfile
+
+from pdf_cache import PdfPageCache
+from pdf_extract import PdfExtractor, make_text_pdf
+
+
+def make_pages(count, changed=()):
+    return [[f'Page {p} line {i}' + (' changed' if p in changed else '') for i in range(5)] for p in range(count)]
+
+
+def test_repeat_upload():
+    print('\n♻️  测试1: 同一个 PDF 再次上传不进入解析进程')
+
+    async def run():
+        extractor = PdfExtractor(max_workers=1, timeout=30, cache=PdfPageCache())
+        pdf = make_text_pdf(make_pages(6))
+        first = await extractor.extract(pdf)
+        assert extractor.stats()['pages_parsed'] == 6
+
+        extractor.close()  # 进程池关闭后，命中缓存的文档仍然可以返回
+        second = await extractor.extract(pdf)
+        assert second == first
+        stats = extractor.stats()
+        assert stats['pages_parsed'] == 6 and stats['pages_reused'] == 6
+        assert stats['cache']['document_hits'] == 1 and stats['cache']['document_hit_rate'] == 0.5
+        assert extractor._pool is None
+        print('✅ 第二次上传直接返回缓存的文本')
+
+    asyncio.run(run())
+
+
+def test_changed_pages():
+    print('\n📝 测试2: 修改过的文档只解析变化的页')
+
+    async def run():
+        extractor = PdfExtractor(max_workers=1, timeout=30, cache=PdfPageCache())
+        await extractor.extract(make_text_pdf(make_pages(8)))
+        text = await extractor.extract(make_text_pdf(make_pages(8, changed={2, 5})))
+        assert 'Page 2 line 0 changed' in text and 'Page 3 line 0 changed' not in text
+        stats = extractor.stats()
+        assert stats['pages_parsed'] == 10 and stats['pages_reused'] == 6
+        extractor.close()
+        print('✅ 8 页中只重新解析了 2 页')
+
+    asyncio.run(run())
+
+
+def test_memory_and_disk():
+    print('\n💾 测试3: 内存 LRU 淘汰后从磁盘读取，重启后仍然有效')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = PdfPageCache(cache_dir, max_memory_bytes=100)
+            await cache.put_pages({'a' * 64: 'x' * 60, 'b' * 64: 'y' * 60})
+            assert cache.stats()['memory_pages'] == 1 and cache.stats()['memory_evictions'] == 1
+            assert await cache.get_page('a' * 64) == 'x' * 60
+            assert cache.stats()['disk_hits'] == 1
+            await cache.put_document('d' * 64, 3, ['a' * 64, 'b' * 64])
+
+            restarted = PdfPageCache(cache_dir)
+            assert await restarted.get_document('d' * 64) == (3, ['a' * 64, 'b' * 64])
+            assert await restarted.get_page('b' * 64) == 'y' * 60
+            assert await restarted.get_page('c' * 64) is None
+            stats = restarted.stats()
+            assert stats['disk_hits'] == 1 and stats['page_misses'] == 1 and stats['page_hit_rate'] == 0.5
+
+            # 超出磁盘上限时删除最久未用的文件
+            small = PdfPageCache(cache_dir, max_disk_bytes=150)
+            await small.put_pages({'e' * 64: 'z' * 60})
+            assert small.stats()['disk_bytes'] <= 150 and small.stats()['disk_evictions'] > 0
+            assert await small.get_page('e' * 64) == 'z' * 60
+        print('✅ 内存和磁盘两级缓存正常')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试 PDF 按页提取缓存')
+    print('=' * 60)
+    test_repeat_upload()
+    test_changed_pages()
+    test_memory_and_disk()
+    print('\n' + '=' * 60)
+    print('PDF 按页提取缓存测试完成!')
+    print('=' * 60)
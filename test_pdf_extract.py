@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试进程池 PDF 提取：按页提取、页数上限、超时后重建进程池、解析失败
+"""
+
+import asyncio
+
+from pdf_extract import PdfExtractError, PdfExtractor, make_text_pdf
+
+
+def make_pdf(page_count, lines=5):
+    return make_text_pdf([[f'Page {p} line {i}' for i in range(lines)] for p in range(page_count)])
+
+
+def test_extract_pages():
+    print('\n📄 测试1: 在工作进程中按页提取')
+
+    async def run():
+        extractor = PdfExtractor(max_workers=1, timeout=30, max_pages=3)
+        text = await extractor.extract(make_pdf(5))
+        assert text.startswith('[第1页]\nPage 0 line 0')
+        assert '[第3页]' in text and '[第4页]' not in text
+        assert text.endswith('（PDF 共 5 页，只提取了前 3 页）')
+        stats = extractor.stats()
+        assert stats['documents'] == 1 and stats['pages'] == 3 and stats['truncated'] == 1
+        extractor.close()
+        print('✅ 提取前 3 页并注明总页数')
+
+    asyncio.run(run())
+
+
+def test_timeout_and_restart():
+    print('\n⏱️  测试2: 超时后重建进程池')
+
+    async def run():
+        extractor = PdfExtractor(max_workers=1, timeout=0.001, max_pages=1000)
+        await extractor.start()
+        try:
+            await extractor.extract(make_pdf(300, lines=40))
+            assert False, '应该超时'
+        except PdfExtractError as e:
+            assert '超时' in str(e)
+        assert extractor.stats()['timeouts'] == 1 and extractor.stats()['restarts'] == 1
+
+        # 新的进程池可以继续解析
+        extractor.timeout = 30
+        assert '[第1页]' in await extractor.extract(make_pdf(1))
+        extractor.close()
+        print('✅ 卡住的工作进程被终止，之后的文档正常解析')
+
+    asyncio.run(run())
+
+
+def test_invalid_pdf():
+    print('\n🚫 测试3: 无效的 PDF')
+
+    async def run():
+        extractor = PdfExtractor(max_workers=1, timeout=30)
+        try:
+            await extractor.extract(b'not a pdf')
+            assert False, '应该失败'
+        except PdfExtractError as e:
+            assert 'PDF解析失败' in str(e)
+        assert extractor.stats()['failures'] == 1
+        extractor.close()
+        print('✅ 解析失败返回 PdfExtractError')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试进程池 PDF 提取')
+    print('=' * 60)
+    test_extract_pages()
+    test_timeout_and_restart()
+    test_invalid_pdf()
+    print('\n' + '=' * 60)
+    print('进程池 PDF 提取测试完成!')
+    print('=' * 60)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试写后持久化：批量合并、压缩顺序、关闭时刷新、写线程中的查询
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+
+from persistence import PersistenceWriter
+from storage import JsonStorage
+
+
+def make_writer(tmp_dir, compact_threshold=1000, **kwargs):
+    storage = JsonStorage(tmp_dir, compact_threshold)
+    storage.load()
+    return storage, PersistenceWriter(storage, **kwargs)
+
+
+def test_group_commit_coalesces():
+    """多次修改合并为一批写入，关闭时全部落盘"""
+    print('\n📦 测试1: 组提交合并写入')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage, writer = make_writer(tmp_dir, flush_interval=60)
+            writer.start()
+
+            for i in range(100):
+                writer.append({'op': 'bot_config_save', 'username': 'a', 'config': {'prompt': str(i)}})
+                writer.append({'op': 'append', 'key': 'a_b', 'message': {'timestamp': i}})
+
+            # 间隔很长，关闭前不会刷新
+            assert not os.path.exists(storage.bot_configs_file)
+            await writer.close()
+
+            with open(storage.bot_configs_file, encoding='utf-8') as f:
+                assert json.load(f) == {'a': {'prompt': '99'}}
+            assert writer.flush_count == 1
+            storage = JsonStorage(tmp_dir)
+            storage.load()
+            assert len(storage.get_messages('a_b')) == 100
+            print(f'✅ 200 次修改合并为 {writer.flush_count} 次刷新')
+
+    asyncio.run(run())
+
+
+def test_always_mode_commit():
+    """always 模式下 commit() 返回时数据已写入"""
+    print('\n💾 测试2: always 模式')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage, writer = make_writer(tmp_dir, flush_interval=60, durability='always')
+            writer.start()
+            writer.append({'op': 'append', 'key': 'a_b', 'message': {'timestamp': 1}})
+            await writer.commit()
+            assert os.path.getsize(storage.messages_log_file) > 0
+            await writer.close()
+            print('✅ commit() 后日志已落盘')
+
+    asyncio.run(run())
+
+
+def test_compaction_is_ordered():
+    """日志达到阈值时存储后端在写线程中压缩，快照和之后的日志不重复"""
+    print('\n🗜️  测试3: 压缩顺序')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage, writer = make_writer(tmp_dir, compact_threshold=3, flush_interval=60, batch_size=2)
+            writer.start()
+            for i in range(5):
+                writer.append({'op': 'append', 'key': 'a_b', 'message': {'timestamp': i}})
+                await asyncio.sleep(0.01)
+            await writer.close()
+
+            assert os.path.exists(storage.message_log.snapshot_path)
+            assert storage.message_log.pending_records < 3
+            storage = JsonStorage(tmp_dir)
+            storage.load()
+            assert [m['timestamp'] for m in storage.get_messages('a_b')] == [0, 1, 2, 3, 4]
+            print('✅ 快照 + 日志重放结果正确')
+
+    asyncio.run(run())
+
+
+def test_call_reads_own_writes():
+    """call() 先写完排队的记录再查询，返回的消息是副本"""
+    print('\n🔎 测试4: 写线程中的查询')
+
+    async def run():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage, writer = make_writer(tmp_dir, flush_interval=60)
+            writer.start()
+            message = {'from': 'a', 'group_id': 'group_1', 'timestamp': 1, 'read_by': ['a']}
+            writer.append({'op': 'append', 'key': 'group_1', 'message': message})
+
+            page, has_more, _ = await writer.call(storage.get_history, 'group_1', None, 10)
+            assert page == [message] and not has_more and writer.pending() == 0
+
+            # 修改返回的消息不影响存储
+            page[0]['read_by'].append('x')
+            page[0]['unread_members'] = []
+            fields = await writer.call(storage.mark_group_read, 'group_1', 1, 'b', ['a', 'b'])
+            assert fields == {'read_by': ['a', 'b'], 'unread_members': []}
+            await writer.close()
+
+            storage = JsonStorage(tmp_dir)
+            storage.load()
+            assert storage.get_messages('group_1')[0]['read_by'] == ['a', 'b']
+            print('✅ 查询结果包含排队中的写入')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试写后持久化')
+    print('=' * 60)
+    test_group_commit_coalesces()
+    test_always_mode_commit()
+    test_compaction_is_ordered()
+    test_call_reads_own_writes()
+    print('\n' + '=' * 60)
+    print('写后持久化测试完成!')
+    print('=' * 60)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试3D战场积分榜：排序结构的名次和前 K 名、按 tick 合并的积分变化、限频的积分榜快照
+"""
+
+import random
+
+from scoreboard import Scoreboard, ScoreFeed
+
+
+def test_ranking():
+    print('\n🏆 测试1: 名次和前 K 名')
+    board = Scoreboard()
+    for name in ['a', 'b', 'c', 'd']:
+        board.set(name, 0)
+    board.add('c', 3)
+    board.add('b', 1)
+    board.add('d', -2)
+    assert board.top(2) == [('c', 3), ('b', 1)]
+    assert [board.rank(name) for name in 'abcd'] == [3, 2, 1, 4]
+    assert board.add('a', 1) == 1 and board.rank('a') == 2  # 同分时先加入的在前
+    board.remove('c')
+    assert 'c' not in board and board.rank('c') is None and board.score('c') is None
+    assert board.top(10) == [('a', 1), ('b', 1), ('d', -2)] and len(board) == 3
+
+    # 和每次完整排序的结果一致
+    rng = random.Random(1)
+    board = Scoreboard()
+    expected = {}
+    for i in range(2000):
+        name = f'p{rng.randrange(200)}'
+        if name not in board:
+            board.set(name, 0)
+            expected[name] = 0
+        elif rng.random() < 0.05:
+            board.remove(name)
+            del expected[name]
+        else:
+            expected[name] = board.add(name, rng.choice([1, -1]))
+    ordered = sorted(expected.items(), key=lambda item: -item[1])
+    assert [score for _, score in board.top(20)] == [score for _, score in ordered[:20]]
+    everyone = [name for name, _ in board.top(len(board))]
+    for name, score in expected.items():
+        assert board.score(name) == score and board.rank(name) == everyone.index(name) + 1
+        assert board.rank(name) == 1 + sum(1 for other in expected.values() if other > score) + \
+            sum(1 for other in everyone[:everyone.index(name)] if expected[other] == score)
+    print('✅ 名次、前 K 名与完整排序一致')
+
+
+def test_deltas():
+    print('\n📉 测试2: 按 tick 合并积分变化')
+    board = Scoreboard()
+    feed = ScoreFeed(board, top_k=2, snapshot_ticks=20)
+    players = {name: None for name in ['a', 'b', 'c', 'd']}
+    for name in players:
+        board.set(name, 0)
+    feed.on_tick(1, players)  # 第一次快照：前 2 名为 a、b
+
+    # 同一个 tick 内多次击中只下发最终分数
+    for _ in range(5):
+        board.add('a', 1)
+        board.add('b', -1)
+    board.add('d', -1)
+    messages = feed.on_tick(2, players)
+    broadcasts = [message for target, message in messages if target is None]
+    personal = [(target, message) for target, message in messages if target is not None]
+    assert broadcasts == [{'type': '3d_battle_score_delta', 'scores': {'a': 5, 'b': -5}}]
+    # d 不在前 2 名，变化只发给他自己；距离上次快照不到 20 个 tick，不发快照
+    assert personal == [('d', {'type': '3d_battle_score_delta', 'scores': {'d': -1}})]
+
+    assert feed.on_tick(3, players) == []  # 没有变化时不发送
+    board.set('a', 5)
+    assert feed.on_tick(4, players) == []  # 分数没变不算变化
+    print('✅ 只下发变化的积分，前 K 名之外的变化不广播')
+
+
+def test_snapshots():
+    print('\n📸 测试3: 限频的积分榜快照')
+    board = Scoreboard()
+    feed = ScoreFeed(board, top_k=2, snapshot_ticks=20)
+    players = {name: None for name in ['a', 'b', 'c']}
+    for name in players:
+        board.set(name, 0)
+    board.add('c', 2)
+    snapshots = [message for _, message in feed.on_tick(1, players) if message['type'] == '3d_battle_leaderboard']
+    assert len(snapshots) == 3
+    assert snapshots[0] == {'type': '3d_battle_leaderboard', 'top': [['c', 2], ['a', 0]], 'total': 3,
+                            'rank': 2, 'score': 0}
+    assert snapshots[1]['rank'] == 3 and snapshots[1]['score'] == 0  # b 不在前 2 名也知道自己的名次
+
+    # 每 tick 都有变化，快照仍然最多 20 个 tick 一次
+    snapshot_ticks = []
+    for tick in range(2, 62):
+        board.add('b', 1)
+        if any(message['type'] == '3d_battle_leaderboard' for _, message in feed.on_tick(tick, players)):
+            snapshot_ticks.append(tick)
+    assert snapshot_ticks == [21, 41, 61]
+
+    # 离开也会触发下一次快照；没有变化就不再发
+    board.remove('b')
+    assert any(message['type'] == '3d_battle_leaderboard' for _, message in feed.on_tick(81, players))
+    assert feed.on_tick(120, players) == []
+    stats = feed.stats()
+    assert stats['snapshots'] == 5 and stats['players'] == 2
+    assert feed.snapshot('nobody')['rank'] is None
+    print(f"✅ 60 个 tick 的积分变化只发送 {len(snapshot_ticks)} 次快照")
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试3D战场积分榜')
+    print('=' * 60)
+    test_ranking()
+    test_deltas()
+    test_snapshots()
+    print('\n' + '=' * 60)
+    print('3D战场积分榜测试完成!')
+    print('=' * 60)
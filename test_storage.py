@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试存储后端：JSON 与 SQLite 行为一致（写入、历史分页、撤回、群消息已读），以及 JSON -> SQLite 迁移
+"""
+
+import os
+import tempfile
+
+import message_log
+from storage import JsonStorage, SqliteStorage, create_storage
+
+RECORDS = [
+    {'op': 'append', 'key': 'a_b', 'message': {'from': 'a', 'to': 'b', 'content': '1', 'timestamp': 1, 'read': False}},
+    {'op': 'append', 'key': 'a_b', 'message': {'from': 'a', 'to': 'b', 'content': '2', 'timestamp': 2, 'read': False}},
+    {'op': 'append', 'key': 'a_b', 'message': {'from': 'b', 'to': 'a', 'content': '3', 'timestamp': 3, 'read': False}},
+    {'op': 'mark_read', 'key': 'a_b', 'from': 'a', 'to': 'b'},
+    {'op': 'recall', 'key': 'a_b', 'timestamp': 2, 'from': 'a',
+     'notice': {'type': 'recall_notice', 'from': 'a', 'to': 'b', 'timestamp': 2, 'content_type': 'recall_notice'}},
+    {'op': 'group_save', 'group_id': 'group_1', 'counter': 1,
+     'group': {'id': 'group_1', 'name': 'g', 'members': ['a', 'b'], 'creator': 'a', 'video_members': {'a'}}},
+    {'op': 'append', 'key': 'group_1', 'message': {'from': 'a', 'group_id': 'group_1', 'timestamp': 5,
+                                                   'read_by': ['a'], 'unread_members': ['b']}},
+    {'op': 'update', 'key': 'group_1', 'timestamp': 5, 'fields': {'read_by': ['a', 'b'], 'unread_members': []}},
+    {'op': 'offline_push', 'username': 'c', 'message': {'from': 'a', 'to': 'c', 'timestamp': 6}},
+    {'op': 'offline_push', 'username': 'd', 'message': {'from': 'a', 'to': 'd', 'timestamp': 7}},
+    {'op': 'offline_clear', 'username': 'd'},
+    {'op': 'bot_config_save', 'username': 'a', 'config': {'prompt': 'p'}},
+]
+
+
+def check_loaded(storage, data):
+    assert sorted(storage.chat_keys()) == ['a_b', 'group_1']
+    msgs = storage.get_messages('a_b')
+    # 撤回通知替换原消息，保持原来的位置
+    assert [m.get('content', m.get('content_type')) for m in msgs] == ['1', 'recall_notice', '3'], msgs
+    assert msgs[0]['read'] is True and msgs[2]['read'] is False
+    assert storage.get_messages('group_1')[0]['read_by'] == ['a', 'b']
+    assert data['groups']['group_1']['members'] == ['a', 'b']
+    assert 'video_members' not in data['groups']['group_1']
+    assert data['group_counter'] == 1
+    assert len(data['offline_messages']['c']) == 1
+    assert not data['offline_messages'].get('d')
+    assert data['bot_configs'] == {'a': {'prompt': 'p'}}
+
+
+def check_queries(storage):
+    """历史分页、撤回、群消息已读都是存储查询，两个后端结果一致"""
+    page, has_more, cursor = storage.get_history('a_b', limit=1)
+    assert [m['timestamp'] for m in page] == [3] and has_more and cursor[0] == 3
+    page, has_more, cursor = storage.get_history('a_b', before=cursor, limit=10)
+    assert [m['timestamp'] for m in page] == [1, 2] and not has_more and cursor[0] == 1
+    page, has_more, _ = storage.get_history('a_b', before=(2, -1), limit=1)
+    assert [m['timestamp'] for m in page] == [1] and not has_more
+    assert storage.get_history('nobody', limit=10) == ([], False, None)
+
+    # 原消息不存在（已撤回）时撤回记录被忽略，不会再追加通知
+    storage.apply_batch([{'op': 'recall', 'key': 'a_b', 'timestamp': 2, 'from': 'a',
+                          'notice': {'type': 'recall_notice', 'from': 'a', 'timestamp': 2}}])
+    storage.apply_batch([{'op': 'recall', 'key': 'a_b', 'timestamp': 9, 'from': 'a',
+                          'notice': {'type': 'recall_notice', 'from': 'a', 'timestamp': 9}}])
+    assert [m['timestamp'] for m in storage.get_messages('a_b')] == [1, 2, 3]
+
+    # 私聊已读只改 b -> a 的消息
+    storage.apply_batch([{'op': 'mark_read', 'key': 'a_b', 'from': 'b', 'to': 'a'}])
+    assert storage.get_messages('a_b')[2]['read'] is True
+
+    # 群消息已读：旧消息没有阅读状态时先初始化（发送者已读），重复已读不变
+    storage.apply_batch([{'op': 'append', 'key': 'group_1', 'message': {'from': 'a', 'group_id': 'group_1', 'timestamp': 8}}])
+    fields = storage.mark_group_read('group_1', 8, 'b', ['a', 'b', 'c'])
+    assert fields == {'read_by': ['a', 'b'], 'unread_members': ['c']}
+    assert storage.mark_group_read('group_1', 8, 'b', ['a', 'b', 'c']) == fields
+    assert storage.get_messages('group_1')[1]['unread_members'] == ['c']
+    assert storage.mark_group_read('group_1', 404, 'b', ['a', 'b']) is None
+
+
+def check_paging(storage):
+    """同一时间戳的多条消息跨页时不重复、不遗漏，撤回通知留在原位置"""
+    records = []
+    for i in range(10):
+        # 时间戳 100 x3, 101 x3, 102 x3, 103
+        sender = 'a' if i % 2 == 0 else 'b'
+        records.append({'op': 'append', 'key': 'p', 'message': {'from': sender, 'content': str(i),
+                                                                'timestamp': 100 + i // 3}})
+    records.append({'op': 'recall', 'key': 'p', 'timestamp': 101, 'from': 'a',
+                    'notice': {'from': 'a', 'to': 'b', 'content': 'recalled', 'timestamp': 101}})
+    storage.apply_batch(records)
+    expected = ['0', '1', '2', '3', 'recalled', '5', '6', '7', '8', '9']
+    assert [m['content'] for m in storage.get_messages('p')] == expected
+
+    for limit in range(1, 11):
+        collected = []
+        before = None
+        pages = 0
+        while True:
+            page, has_more, cursor = storage.get_history('p', before, limit)
+            pages += 1
+            collected[:0] = [m['content'] for m in page]
+            assert has_more == (len(collected) < len(expected)), (limit, collected)
+            if not has_more:
+                break
+            before = cursor
+        assert collected == expected, (limit, collected)
+        assert pages == -(-len(expected) // limit)
+
+    # 旧客户端只带时间戳：只返回更早时间戳的消息
+    page, has_more, _ = storage.get_history('p', (101, -1), 10)
+    assert [m['content'] for m in page] == ['0', '1', '2'] and not has_more
+
+
+def test_json_storage():
+    print('\n📄 测试1: JSON 后端')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = JsonStorage(tmp_dir)
+        storage.load()
+        storage.apply_batch(RECORDS)
+        storage.close()
+        storage = JsonStorage(tmp_dir)
+        check_loaded(storage, storage.load())
+        check_queries(storage)
+        check_paging(storage)
+        # 撤回、删除之后的 seq 有空洞，重启后重新编号
+        newest, _, cursor = storage.get_history('p', None, 4)
+        storage.close()
+
+        # 重启前拿到的游标最多重复边界上的消息，不会跳过
+        storage = JsonStorage(tmp_dir)
+        storage.load()
+        older, has_more, _ = storage.get_history('p', cursor, 20)
+        contents = [m['content'] for m in older + newest]
+        assert not has_more and contents[:5] == ['0', '1', '2', '3', 'recalled'] and '5' in contents
+        assert len(contents) - len(set(contents)) <= 1
+
+        # 查询中产生的修改（群消息已读）同样写入日志
+        storage = JsonStorage(tmp_dir)
+        storage.load()
+        assert storage.get_messages('group_1')[1]['read_by'] == ['a', 'b']
+        storage.close()
+        print('✅ JSON 后端重放正确')
+
+
+def test_sqlite_storage():
+    print('\n🗄️  测试2: SQLite 后端')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'chat.db')
+        storage = SqliteStorage(db_path)
+        storage.load()
+        storage.apply_batch(RECORDS)
+        storage.close()
+
+        storage = SqliteStorage(db_path)
+        check_loaded(storage, storage.load())
+        check_queries(storage)
+        check_paging(storage)
+        storage.close()
+        print('✅ SQLite 后端结果与 JSON 一致')
+
+
+def test_migration():
+    print('\n🚚 测试3: JSON -> SQLite 迁移')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = JsonStorage(tmp_dir)
+        storage.load()
+        storage.apply_batch(RECORDS)
+        storage.close()
+
+        sqlite_storage = SqliteStorage(os.path.join(tmp_dir, 'chat.db'), tmp_dir)
+        check_loaded(sqlite_storage, sqlite_storage.load())
+        sqlite_storage.close()
+
+        # 只迁移一次
+        sqlite_storage = SqliteStorage(os.path.join(tmp_dir, 'chat.db'), tmp_dir)
+        sqlite_storage.load()
+        assert len(sqlite_storage.get_messages('a_b')) == 3
+        sqlite_storage.close()
+        print('✅ 迁移完成且不会重复导入')
+
+
+def test_durability():
+    print('\n💾 测试4: always 模式下每次写入都落盘')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for durability, expected in (('group', 1), ('always', 2)):  # synchronous: 1=NORMAL, 2=FULL
+            storage = create_storage('sqlite', tmp_dir, durability=durability)
+            storage.load()
+            assert storage._writer().execute('PRAGMA synchronous').fetchone()[0] == expected, durability
+            storage.close()
+
+        # JSON 后端的群消息已读：group 模式随下一批落盘，always 模式立即 fsync
+        fsyncs = []
+        saved_fsync = message_log.os.fsync
+        message_log.os.fsync = lambda fd: fsyncs.append(fd)
+        try:
+            for durability in ('group', 'always'):
+                storage = create_storage('json', os.path.join(tmp_dir, durability), durability=durability)
+                os.makedirs(os.path.join(tmp_dir, durability))
+                storage.load()
+                storage.apply_batch(RECORDS)
+                fsyncs.clear()
+                storage.mark_group_read('group_1', 5, 'c', ['a', 'b', 'c'])
+                assert len(fsyncs) == (1 if durability == 'always' else 0), durability
+                storage.close()
+        finally:
+            message_log.os.fsync = saved_fsync
+        print('✅ SQLite 使用 synchronous=FULL，JSON 已读记录立即 fsync')
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试存储后端')
+    print('=' * 60)
+    test_json_storage()
+    test_sqlite_storage()
+    test_migration()
+    test_durability()
+    print('\n' + '=' * 60)
+    print('存储后端测试完成!')
+    print('=' * 60)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试长文本分段总结：按页/按消息切分、token 预算、并发上限、分段缓存复用
+"""
+
+import asyncio
+
+from summarizer import MapReduceSummarizer, chunk_text, estimate_tokens
+from summary_cache import SummaryCache, summary_key
+
+
+def make_chat(count):
+    return '\n\n'.join(f'用户{i % 3} 09:{i % 60:02d}\n第{i}条消息，讨论项目进度' for i in range(count))
+
+
+def test_chunking():
+    print('\n✂️  测试1: 按边界切分')
+    chat = make_chat(200)
+    chunks = chunk_text(chat, 300)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 300 for chunk in chunks)
+    assert '\n\n'.join(chunks) == chat  # 没有丢内容，也没有在消息中间切开
+
+    pdf = '\n\n'.join(f'[第{i}页]\n' + '内容' * 100 for i in range(1, 11))
+    chunks = chunk_text(pdf, 450)
+    assert all(chunk.startswith('[第') for chunk in chunks)
+    assert len(chunks) == 5  # 每段两页
+
+    # 单条超长消息按字符切
+    chunks = chunk_text('长' * 1000, 300)
+    assert all(estimate_tokens(chunk) <= 300 for chunk in chunks) and ''.join(chunks) == '长' * 1000
+
+    # 追加内容后前面的分段不变
+    longer = chunk_text(make_chat(260), 300)
+    original = chunk_text(make_chat(200), 300)
+    assert longer[:len(original) - 1] == original[:-1]
+    print(f'✅ 200 条消息切成 {len(chunk_text(chat, 300))} 段，PDF 按页切分')
+
+
+class FakeLLM:
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+
+    async def __call__(self, system, content, user=None, on_delta=None, max_tokens=4096, bypass_cache=False):
+        async def compute():
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            await asyncio.sleep(0.01)
+            self.active -= 1
+            text = f'要点{len(content)}'
+            if on_delta is not None:
+                on_delta(text)
+            return text
+
+        if self.cache is None:
+            return await compute()
+        summary, _ = await self.cache.get_or_compute(summary_key('m', system, content), compute, bypass=bypass_cache)
+        return summary
+
+
+def test_map_reduce():
+    print('\n🗺️  测试2: 分段并发提取 + 合并总结')
+
+    async def run():
+        llm = FakeLLM()
+        summarizer = MapReduceSummarizer(llm, chunk_tokens=300, max_parallel=2)
+        progress = []
+        deltas = []
+        chat = make_chat(200)
+        result = await summarizer.summarize(chat, '请总结', on_delta=deltas.append,
+                                            on_progress=lambda done, total: progress.append((done, total)))
+        chunks = len(chunk_text(chat, 300))
+        assert llm.calls == chunks + 1
+        assert llm.max_active == 2
+        assert progress[-1] == (chunks, chunks)
+        assert deltas == [result]  # 只有合并总结流式输出
+
+        # 短文本不需要分段
+        assert not summarizer.needs_chunking('短文本')
+        print(f'✅ {chunks} 段 + 1 次合并，同时最多 {llm.max_active} 个请求')
+
+    asyncio.run(run())
+
+
+def test_incremental_reuse():
+    print('\n♻️  测试3: 追加内容后只处理新增分段')
+
+    async def run():
+        llm = FakeLLM(SummaryCache(max_entries=1000))
+        summarizer = MapReduceSummarizer(llm, chunk_tokens=300, max_parallel=4)
+        await summarizer.summarize(make_chat(200), '请总结')
+        first_calls = llm.calls
+
+        await summarizer.summarize(make_chat(260), '请总结')
+        new_chunks = len(chunk_text(make_chat(260), 300)) - len(chunk_text(make_chat(200), 300))
+        second_calls = llm.calls - first_calls
+        # 新增的分段 + 原来的最后一段（追加了内容）+ 合并
+        assert second_calls <= new_chunks + 2, second_calls
+        print(f'✅ 第一次 {first_calls} 次调用，追加后只需 {second_calls} 次')
+
+    asyncio.run(run())
+
+
+def test_condense_budget():
+    print('\n⚖️  测试4: 多份材料分配预算')
+
+    async def run():
+        llm = FakeLLM()
+        summarizer = MapReduceSummarizer(llm, chunk_tokens=300, max_parallel=2)
+        context, content = make_chat(15), make_chat(15)
+        # 每份都没有超过 chunk_tokens，但合在一起超过了
+        assert not summarizer.needs_chunking(context) and summarizer.needs_chunking(context + content)
+        assert await summarizer.condense(context) == context
+
+        budget = summarizer.chunk_tokens // 2
+        materials = [await summarizer.condense(m, budget=budget) for m in (context, content)]
+        assert all(estimate_tokens(m) <= budget for m in materials)
+        assert not summarizer.needs_chunking('\n\n'.join(materials))
+        print(f'✅ 每份材料压缩到 {budget} tokens 以内，合并后不超过预算')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试长文本分段总结')
+    print('=' * 60)
+    test_chunking()
+    test_map_reduce()
+    test_incremental_reuse()
+    test_condense_budget()
+    print('\n' + '=' * 60)
+    print('长文本分段总结测试完成!')
+    print('=' * 60)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试总结结果缓存：命中、LRU 淘汰、TTL、跳过缓存、并发合并、重启后从 SQLite 恢复
+"""
+
+import asyncio
+import os
+import tempfile
+
+from summary_cache import SummaryCache, summary_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_key():
+    print('\n🔑 测试1: 缓存 key')
+    base = summary_key('model-a', '请总结', '聊天记录')
+    assert base == summary_key('model-a', '请总结', '聊天记录')
+    assert base != summary_key('model-b', '请总结', '聊天记录')
+    assert base != summary_key('model-a', '请翻译', '聊天记录')
+    assert base != summary_key('model-a', '请总结', '聊天记录2')
+    assert summary_key('m', None, 'x') == summary_key('m', '', 'x')
+    print('✅ 模型、prompt、内容任一不同 key 就不同')
+
+
+def test_hit_and_bypass():
+    print('\n♻️  测试2: 命中与跳过缓存')
+
+    async def run():
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            return f'总结{len(calls)}'
+
+        cache = SummaryCache(max_entries=10)
+        assert await cache.get_or_compute('k', compute) == ('总结1', 'computed')
+        assert await cache.get_or_compute('k', compute) == ('总结1', 'hit')
+        assert await cache.get_or_compute('k', compute, bypass=True) == ('总结2', 'computed')
+        assert await cache.get_or_compute('k', compute) == ('总结2', 'hit')
+        assert len(calls) == 2
+
+        # 失败不缓存
+        async def fail():
+            raise RuntimeError('API错误')
+        try:
+            await cache.get_or_compute('bad', fail)
+            assert False, '应该失败'
+        except RuntimeError:
+            pass
+        assert cache.get('bad') is None
+
+        stats = cache.stats()
+        assert stats['hits'] == 2 and stats['bypassed'] == 1
+        print(f'✅ 命中 {stats["hits"]} 次，调用 {len(calls)} 次')
+
+    asyncio.run(run())
+
+
+def test_lru_and_ttl():
+    print('\n🧹 测试3: LRU 淘汰与 TTL')
+
+    async def run():
+        clock = FakeClock()
+        cache = SummaryCache(max_entries=2, ttl=60, clock=clock)
+        await cache.put('a', 'A')
+        await cache.put('b', 'B')
+        cache.get('a')  # a 变成最近使用
+        await cache.put('c', 'C')
+        assert cache.get('b') is None and cache.get('a') == 'A' and cache.get('c') == 'C'
+
+        clock.now += 61
+        assert cache.get('a') is None
+        assert cache.stats()['evictions'] == 1 and cache.stats()['expired'] == 1
+        print('✅ 淘汰最久未使用的条目，过期条目不再返回')
+
+    asyncio.run(run())
+
+
+def test_coalescing():
+    print('\n🤝 测试4: 并发请求合并')
+
+    async def run():
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return '总结'
+
+        cache = SummaryCache(max_entries=10)
+        results = await asyncio.gather(*[cache.get_or_compute('k', compute) for _ in range(5)])
+        assert calls == 1
+        assert sorted(source for _, source in results) == ['coalesced'] * 4 + ['computed']
+
+        # 发起者被取消时，等待者自己重新计算
+        async def slow():
+            await asyncio.sleep(0.05)
+            return '重新总结'
+
+        owner = asyncio.create_task(cache.get_or_compute('k2', slow))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_compute('k2', slow))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        assert await waiter == ('重新总结', 'computed')
+        print('✅ 5 个并发请求只计算 1 次')
+
+    asyncio.run(run())
+
+
+def test_persistence():
+    print('\n💾 测试5: 重启后从 SQLite 恢复')
+
+    async def run(db_path):
+        cache = SummaryCache(db_path, max_entries=2)
+        assert not os.path.exists(db_path)  # 创建时不访问磁盘
+        cache.open()
+        await cache.put('a', 'A')
+        await cache.put('b', 'B')
+        await cache.put('c', 'C')  # a 被淘汰
+        cache.get('b')
+        cache.close()
+
+        cache = SummaryCache(db_path, max_entries=2)
+        cache.open()
+        assert cache.get('a') is None
+        assert cache.get('b') == 'B' and cache.get('c') == 'C'
+        cache.close()
+
+        # 上限变小时只保留最近使用的
+        cache = SummaryCache(db_path, max_entries=1)
+        cache.open()
+        assert cache.stats()['size'] == 1
+        cache.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(run(os.path.join(tmp_dir, 'summary_cache.db')))
+    print('✅ 缓存重启后仍然有效，淘汰的条目已从数据库删除')
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试总结结果缓存')
+    print('=' * 60)
+    test_key()
+    test_hit_and_bypass()
+    test_lru_and_ttl()
+    test_coalescing()
+    test_persistence()
+    print('\n' + '=' * 60)
+    print('总结结果缓存测试完成!')
+    print('=' * 60)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试上传文件的流式接收：写入临时文件、超限立即中止、全局上传额度（总结请求结束前不归还）、临时文件清理
+"""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+
+import aiohttp
+from aiohttp.test_utils import TestClient, TestServer
+
+import server
+from persistence import PersistenceWriter
+from storage import JsonStorage
+from summary_cache import SummaryCache
+from upload_spool import (UploadBudget, UploadBudgetExceeded, UploadTooLarge,
+                          read_field, spool_field)
+
+
+class FakeField:
+    """模拟 multipart 字段，记录被读取了多少字节"""
+
+    def __init__(self, data, chunk_size=1000):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.read_bytes = 0
+
+    async def read_chunk(self, size):
+        size = min(size, self.chunk_size)
+        chunk = self.data[self.read_bytes:self.read_bytes + size]
+        self.read_bytes += len(chunk)
+        return chunk
+
+
+def test_spool():
+    print('\n📥 测试1: 写入临时文件')
+
+    async def run():
+        budget = UploadBudget(10000)
+        data = os.urandom(5000)
+        with await spool_field(FakeField(data), 8000, budget) as upload:
+            with open(upload.path, 'rb') as f:
+                assert f.read() == data
+            assert upload.size == 5000 and upload.sha256 == hashlib.sha256(data).hexdigest()
+            assert budget.in_flight == 5000
+            path = upload.path
+        assert not os.path.exists(path) and budget.in_flight == 0
+        print('✅ 内容和 SHA-256 正确，用完后删除临时文件并归还额度')
+
+    asyncio.run(run())
+
+
+def test_early_reject():
+    print('\n🚫 测试2: 超过大小上限立即中止')
+
+    async def run():
+        budget = UploadBudget(0)
+        field = FakeField(b'x' * 100000)
+        try:
+            await spool_field(field, 8000, budget)
+            assert False, '应该失败'
+        except UploadTooLarge:
+            pass
+        assert field.read_bytes <= 9000  # 没有读完整个文件
+        assert budget.in_flight == 0
+
+        try:
+            await read_field(FakeField(b'y' * 5000), 100, budget)
+            assert False, '应该失败'
+        except UploadTooLarge as e:
+            assert '100字节' in str(e)
+        print(f'✅ 读到 {field.read_bytes} 字节时中止')
+
+    asyncio.run(run())
+
+
+def test_budget():
+    print('\n🧮 测试3: 全服务器上传额度')
+
+    async def run():
+        budget = UploadBudget(6000)
+        first = await spool_field(FakeField(b'a' * 4000), 10000, budget)
+        try:
+            await spool_field(FakeField(b'b' * 4000), 10000, budget)
+            assert False, '应该超出额度'
+        except UploadBudgetExceeded:
+            pass
+        assert budget.in_flight == 4000
+        first.close()
+
+        # 额度归还后可以继续上传
+        second = await spool_field(FakeField(b'b' * 4000), 10000, budget)
+        second.close()
+        stats = budget.stats()
+        assert stats['in_flight'] == 0 and stats['rejected'] == 1 and stats['peak'] <= 6000
+
+        # 文本字段同样占用额度，由调用方用完后归还；超出额度时已读的部分立即归还
+        text = await read_field(FakeField(b'c' * 4000), 10000, budget)
+        assert budget.in_flight == 4000
+        try:
+            await read_field(FakeField(b'd' * 4000), 10000, budget)
+            assert False, '应该超出额度'
+        except UploadBudgetExceeded:
+            pass
+        assert budget.in_flight == 4000
+        budget.release(len(text))
+        assert budget.in_flight == 0 and budget.stats()['peak'] <= 6000
+        print('✅ 超出额度的上传和文本字段被拒绝，额度归还后恢复')
+
+    asyncio.run(run())
+
+
+def test_summarize_holds_budget():
+    print('\n⏳ 测试4: 总结请求处理期间一直占用文本的额度')
+
+    async def run():
+        saved_budget, saved_complete = server.upload_budget, server.llm_client.complete
+        saved_cache = server.summary_cache
+        tmp_dir = tempfile.TemporaryDirectory()
+        storage = JsonStorage(tmp_dir.name)
+        storage.load()
+        server.storage = storage
+        server.persistence = PersistenceWriter(storage, flush_interval=60)
+        server.summary_cache = SummaryCache()
+        server.upload_budget = UploadBudget(6000)
+        release = asyncio.Event()
+        started = asyncio.Event()
+
+        async def complete(prompt, user=None, max_tokens=4096):
+            started.set()
+            await release.wait()
+            return '总结'
+
+        server.llm_client.complete = complete
+        client = TestClient(TestServer(server.create_app()))
+        await client.start_server()
+
+        def form(text):
+            writer = aiohttp.MultipartWriter('form-data')
+            for name, value in (('context_text', '上下文'), ('content_text', text), ('no_cache', '1')):
+                writer.append(value).set_content_disposition('form-data', name=name)
+            return writer
+
+        try:
+            first = asyncio.create_task(client.post('/api/summarize_chat', data=form('x' * 4000)))
+            await asyncio.wait_for(started.wait(), 5)
+            # 第一个请求还在等 Claude 回复，文本仍占用额度
+            assert server.upload_budget.in_flight >= 4000
+            second = await client.post('/api/summarize_chat', data=form('y' * 4000))
+            assert second.status == 503, second.status
+
+            release.set()
+            response = await first
+            assert response.status == 200 and (await response.json())['summary'] == '总结'
+            assert server.upload_budget.in_flight == 0
+        finally:
+            release.set()
+            await client.close()
+            server.upload_budget, server.llm_client.complete = saved_budget, saved_complete
+            server.summary_cache = saved_cache
+            tmp_dir.cleanup()
+        print('✅ 第一个请求处理完之前，第二个大文本请求被拒绝')
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    print('=' * 60)
+    print('开始测试上传文件流式接收')
+    print('=' * 60)
+    test_spool()
+    test_early_reject()
+    test_budget()
+    test_summarize_holds_budget()
+    print('\n' + '=' * 60)
+    print('上传文件流式接收测试完成!')
+    print('=' * 60)
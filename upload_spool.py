@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+上传文件的流式接收
+
+- 分块读取，超过大小上限立即中止（不会先把整个文件读进内存再检查）
+- 文件内容写入临时文件，边写边计算 SHA-256；处理时把文件路径交给 PDF 解析进程，不复制内容
+- UploadBudget 限制全服务器正在接收/处理的上传字节总数，并发大文件上传不会耗尽内存和磁盘
+"""
+
+import hashlib
+import os
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit):
+        super().__init__(f'大小不能超过{limit // 1024 // 1024}MB' if limit >= 1024 * 1024 else f'大小不能超过{limit}字节')
+        self.limit = limit
+
+
+class UploadBudgetExceeded(Exception):
+    def __init__(self):
+        super().__init__('服务器正在处理的上传过多，请稍后再试')
+
+
+class UploadBudget:
+    """全服务器正在上传的字节数上限（max_bytes 为 0 时不限制）"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self._stats = {'reserved_total': 0, 'rejected': 0, 'peak': 0}
+
+    def reserve(self, size):
+        if self.max_bytes and self.in_flight + size > self.max_bytes:
+            self._stats['rejected'] += 1
+            raise UploadBudgetExceeded()
+        self.in_flight += size
+        self._stats['reserved_total'] += size
+        self._stats['peak'] = max(self._stats['peak'], self.in_flight)
+
+    def release(self, size):
+        self.in_flight -= size
+
+    def stats(self):
+        return {**self._stats, 'in_flight': self.in_flight, 'max_bytes': self.max_bytes}
+
+
+class SpooledUpload:
+    """写入临时文件的上传内容；用完调用 close()（或用 with）删除文件并归还额度"""
+
+    def __init__(self, budget, max_size, tmp_dir=None):
+        self.budget = budget
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+        fd, self.path = tempfile.mkstemp(prefix='upload-', dir=tmp_dir)
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, chunk):
+        if self.size + len(chunk) > self.max_size:
+            raise UploadTooLarge(self.max_size)
+        self.budget.reserve(len(chunk))
+        self.size += len(chunk)
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def finish(self):
+        """写完后关闭文件，返回 SHA-256"""
+        self._file.close()
+        return self.sha256
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+            self.budget.release(self.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def spool_field(field, max_size, budget, tmp_dir=None):
+    """把 multipart 字段分块写入临时文件，返回 SpooledUpload；超过上限时抛出 UploadTooLarge"""
+    upload = SpooledUpload(budget, max_size, tmp_dir)
+    try:
+        while True:
+            chunk = await field.read_chunk(CHUNK_SIZE)
+            if not chunk:
+                break
+            upload.write(chunk)
+        upload.finish()
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+
+async def read_field(field, max_size, budget):
+    """分块读取较小的文本字段，超过上限立即中止
+
+    读到的字节数占用上传额度，成功返回后额度不归还：调用方用完内容后 budget.release(len(data))。
+    """
+    parts = []
+    size = 0
+    try:
+        while True:
+            chunk = await field.read_chunk(CHUNK_SIZE)
+            if not chunk:
+                break
+            if size + len(chunk) > max_size:
+                raise UploadTooLarge(max_size)
+            budget.reserve(len(chunk))
+            size += len(chunk)
+            parts.append(chunk)
+    except BaseException:
+        budget.release(size)
+        raise
+    return b''.join(parts)